@@ -0,0 +1,465 @@
+"""
+قياس أداء مسار التحميل محلياً بدون يوتيوب أو تيليجرام:
+خادم وسائط محلي (ملفات تقدمية + HLS مجزأ) ومستخرج بديل ومستقبل رفع وهمي (fake_botapi)
+
+التشغيل:
+    python benchmark.py --jobs 20 --concurrency 4 --size 50 --kind mixed
+    python benchmark.py --jobs 10 --format audio --rate 2 --json results.json
+
+يقيس: المهام في الثانية، p50/p99 لكل مرحلة (انتظار، تحميل، معالجة، رفع)،
+أعلى استهلاك ذاكرة (البوت + العمال + ffmpeg) وأعلى استخدام للقرص المؤقت.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import logging
+import tempfile
+import subprocess
+import contextvars
+from collections import Counter
+from pathlib import Path
+from typing import Optional, Dict, List
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("queue", "download", "postprocess", "upload", "total")
+
+# سجل توقيت المهمة الحالية - ينتقل تلقائياً لمهمة التحميل المنشأة داخل download()
+current_job: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "current_job", default=None
+)
+
+FFMPEG_STUB = """#!{python}
+# ffmpeg بديل: ينسخ المدخل الأول إلى المخرج (للوسائط الاصطناعية غير الصالحة)
+import sys, shutil
+args = sys.argv[1:]
+shutil.copyfile(args[args.index('-i') + 1], args[-1])
+sys.stderr.write("bench: utime=0.000s stime=0.000s rtime=0.000s\\n")
+"""
+
+
+# ============ الوسائط ============
+
+def _write_random(path: Path, size: int):
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as f:
+        remaining = size
+        while remaining:
+            f.write(block[:min(len(block), remaining)])
+            remaining -= min(len(block), remaining)
+
+
+def prepare_media(media_dir: Path, size_mb: float, real: bool, segment_seconds: int = 2) -> dict:
+    """
+    إنشاء وسائط الاختبار: فيديو بدون صوت (mp4) وصوت (m4a) ونسخة HLS مجزأة من الفيديو.
+    real=True: وسائط حقيقية بـ ffmpeg (تصلح للدمج الفعلي)، وإلا بايتات عشوائية بنفس الأحجام.
+    """
+    media_dir.mkdir(parents=True, exist_ok=True)
+    hls_dir = media_dir / "hls"
+    hls_dir.mkdir(exist_ok=True)
+    video_size = int(size_mb * 1024 * 1024)
+    video_kbps, audio_kbps = 4000, 128
+    duration = max(4, int(video_size * 8 / 1000 / video_kbps))
+
+    if real:
+        run = lambda *cmd: subprocess.run(["ffmpeg", "-y", "-loglevel", "error", *cmd], check=True)
+        run("-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30", "-t", str(duration),
+            "-c:v", "libx264", "-preset", "ultrafast", "-b:v", f"{video_kbps}k", "-an",
+            str(media_dir / "video.mp4"))
+        run("-f", "lavfi", "-i", "sine=frequency=440", "-t", str(duration),
+            "-c:a", "aac", "-b:a", f"{audio_kbps}k", str(media_dir / "audio.m4a"))
+        run("-i", str(media_dir / "video.mp4"), "-c", "copy", "-f", "hls",
+            "-hls_time", str(segment_seconds), "-hls_playlist_type", "vod",
+            "-hls_segment_filename", str(hls_dir / "seg%04d.ts"), str(hls_dir / "index.m3u8"))
+    else:
+        _write_random(media_dir / "video.mp4", video_size)
+        _write_random(media_dir / "audio.m4a", duration * audio_kbps * 125)
+        segments = max(1, duration // segment_seconds)
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{segment_seconds}",
+                 "#EXT-X-PLAYLIST-TYPE:VOD", "#EXT-X-MEDIA-SEQUENCE:0"]
+        for i in range(segments):
+            _write_random(hls_dir / f"seg{i:04d}.ts", video_size // segments)
+            lines += [f"#EXTINF:{segment_seconds}.0,", f"seg{i:04d}.ts"]
+        lines.append("#EXT-X-ENDLIST")
+        (hls_dir / "index.m3u8").write_text("\n".join(lines) + "\n")
+
+    return {
+        "duration": duration,
+        "video_size": (media_dir / "video.mp4").stat().st_size,
+        "audio_size": (media_dir / "audio.m4a").stat().st_size,
+        "audio_kbps": audio_kbps,
+        "video_kbps": video_kbps,
+    }
+
+
+class MediaServer:
+    """خادم ملفات يدعم طلبات النطاق مع حد سرعة اختياري لكل اتصال (محاكاة خنق CDN)"""
+
+    def __init__(self, root: Path, rate: float = 0):
+        self.root = root
+        self.rate = rate
+        self.requests = 0
+        self.bytes_sent = 0
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        path = (self.root / request.match_info["path"]).resolve()
+        if self.root.resolve() not in path.parents or not path.is_file():
+            raise web.HTTPNotFound()
+        self.requests += 1
+        size = path.stat().st_size
+
+        try:
+            requested = request.http_range
+        except ValueError:
+            raise web.HTTPRequestRangeNotSatisfiable()
+        start = requested.start or 0
+        end = (requested.stop if requested.stop is not None else size) - 1
+        end = min(end, size - 1)
+        if start < 0:
+            start, end = max(0, size + start), size - 1
+
+        response = web.StreamResponse(status=206 if "Range" in request.headers else 200)
+        response.content_length = end - start + 1
+        response.headers["Accept-Ranges"] = "bytes"
+        if response.status == 206:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        await response.prepare(request)
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                data = f.read(min(64 * 1024, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+                await response.write(data)
+                self.bytes_sent += len(data)
+                if self.rate:
+                    await asyncio.sleep(len(data) / self.rate)
+        await response.write_eof()
+        return response
+
+    async def start(self, host: str = "127.0.0.1") -> web.AppRunner:
+        app = web.Application()
+        app.router.add_get("/media/{path:.+}", self.handle)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, 0).start()
+        return runner
+
+
+def stub_info(base_url: str, video_id: str, kind: str, media: dict) -> dict:
+    """بديل extract_info: بيانات بصيغة yt-dlp تشير لخادم الوسائط المحلي"""
+    audio = {
+        "format_id": "140", "ext": "m4a", "vcodec": "none", "acodec": "mp4a.40.2",
+        "protocol": "http", "url": f"{base_url}/media/audio.m4a",
+        "filesize": media["audio_size"], "abr": media["audio_kbps"], "tbr": media["audio_kbps"],
+    }
+    if kind == "fragmented":
+        video = {
+            "format_id": "hls-720", "ext": "mp4", "vcodec": "avc1.64001f", "acodec": "none",
+            "protocol": "m3u8_native", "url": f"{base_url}/media/hls/index.m3u8",
+            "height": 720, "width": 1280, "tbr": media["video_kbps"],
+        }
+    else:
+        video = {
+            "format_id": "136", "ext": "mp4", "vcodec": "avc1.64001f", "acodec": "none",
+            "protocol": "http", "url": f"{base_url}/media/video.mp4",
+            "height": 720, "width": 1280, "filesize": media["video_size"], "tbr": media["video_kbps"],
+        }
+    return {
+        "id": video_id,
+        "title": f"Benchmark {video_id}",
+        "duration": media["duration"],
+        "uploader": "benchmark",
+        "extractor": "generic",
+        "extractor_key": "Generic",
+        "webpage_url": f"https://youtu.be/{video_id}",
+        "formats": [audio, video],
+    }
+
+
+# ============ القياس ============
+
+def tree_rss(pid: int) -> int:
+    """مجموع الذاكرة المقيمة لعملية وكل أبنائها (من /proc)"""
+    total, stack, seen = 0, [pid], set()
+    while stack:
+        current = stack.pop()
+        if current in seen:
+            continue
+        seen.add(current)
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+def dir_size(path: Path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+class Sampler:
+    """أخذ عينات دورية لأعلى ذاكرة وأعلى استخدام للقرص"""
+
+    def __init__(self, disk_path: Path, interval: float = 0.25, exclude: Path = None):
+        self.disk_path = disk_path
+        self.exclude = exclude
+        self.interval = interval
+        self.peak_rss = 0
+        self.peak_disk = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self):
+        self.peak_rss = max(self.peak_rss, tree_rss(os.getpid()))
+        disk = dir_size(self.disk_path) - (dir_size(self.exclude) if self.exclude else 0)
+        self.peak_disk = max(self.peak_disk, disk)
+
+    async def _run(self):
+        while True:
+            await asyncio.to_thread(self.sample)
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        self.sample()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """أقرب رتبة (nearest-rank)"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def instrument(manager):
+    """تغليف مراحل المدير لتسجيل أوقاتها في سجل المهمة الحالية"""
+    fetch, postprocess = manager._fetch, manager._postprocess
+
+    async def timed_fetch(*args, **kwargs):
+        record = current_job.get()
+        if record is not None:
+            record["fetch_start"] = time.monotonic()
+        try:
+            return await fetch(*args, **kwargs)
+        finally:
+            if record is not None:
+                record["fetch_end"] = time.monotonic()
+
+    async def timed_postprocess(*args, **kwargs):
+        record = current_job.get()
+        if record is not None:
+            record["post_start"] = time.monotonic()
+        try:
+            return await postprocess(*args, **kwargs)
+        finally:
+            if record is not None:
+                record["post_end"] = time.monotonic()
+
+    manager._fetch = timed_fetch
+    manager._postprocess = timed_postprocess
+
+
+# ============ التشغيل ============
+
+async def run_benchmark(args) -> dict:
+    # البيئة قبل استيراد وحدات البوت (الإعدادات تُقرأ عند الاستيراد)
+    workdir = Path(args.workdir or tempfile.mkdtemp(prefix="ytbot-bench-"))
+    os.environ["TMPDIR"] = str(workdir / "tmp")
+    # TEMP_DIR يتقدم على TMPDIR - القياس يراقب مجلد العمل فقط
+    os.environ.pop("TEMP_DIR", None)
+    (workdir / "tmp").mkdir(parents=True, exist_ok=True)
+    os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+    os.environ["MAX_CONCURRENT_DOWNLOADS"] = str(args.concurrency)
+    os.environ["MAX_DOWNLOADS_PER_USER"] = str(args.concurrency)
+    os.environ["PARALLEL_DOWNLOADS"] = "0" if args.sequential else "1"
+    if args.postprocess_workers:
+        os.environ["POSTPROCESS_WORKERS"] = str(args.postprocess_workers)
+    if args.local_mode:
+        os.environ["BOT_API_URL"] = "http://127.0.0.1"
+    tempfile.tempdir = None
+
+    from telegram import Bot
+    from fake_botapi import start_fake_botapi
+    from config import CACHE_DIR
+    from downloader import dl_manager
+    from utils import open_upload
+
+    real_ffmpeg = bool(shutil.which("ffmpeg")) and not args.stub_ffmpeg
+    media = prepare_media(workdir / "media", args.size, real=real_ffmpeg)
+    if not real_ffmpeg:
+        stub = workdir / "ffmpeg-stub"
+        stub.write_text(FFMPEG_STUB.format(python=sys.executable))
+        stub.chmod(0o755)
+        dl_manager.postprocessor.ffmpeg = str(stub)
+
+    server = MediaServer(workdir / "media", rate=args.rate * 1024 * 1024)
+    media_runner = await server.start()
+    media_url = f"http://127.0.0.1:{media_runner.addresses[0][1]}"
+    sink, sink_runner = await start_fake_botapi(port=0, upload_delay=args.upload_delay)
+    # local_mode: PTB يرسل file:// بدل رفع الملف (نفس إعداد main.py مع BOT_API_URL)
+    bot = Bot("0:benchmark", base_url=f"http://127.0.0.1:{sink_runner.addresses[0][1]}/bot",
+              local_mode=args.local_mode)
+    await bot.initialize()
+
+    instrument(dl_manager)
+    await dl_manager.start()
+    # انتظار جاهزية كل العمال حتى لا يدخل التسخين في القياس
+    while dl_manager.pool._idle.qsize() < dl_manager.pool.size:
+        await asyncio.sleep(0.2)
+
+    # الكاش يحوي روابط صلبة لنفس الملفات - يُستثنى من قياس القرص المؤقت
+    sampler = Sampler(workdir / "tmp", exclude=CACHE_DIR)
+    records: List[Dict[str, float]] = []
+    errors: List[str] = []
+
+    async def job(i: int):
+        record = {"start": time.monotonic()}
+        current_job.set(record)
+        kind = args.kind if args.kind != "mixed" else ("fragmented" if i % 2 else "progressive")
+        video_id = f"bench{i:06d}"[:11].ljust(11, "x")
+        info = stub_info(media_url, video_id, kind, media)
+        try:
+            result = await dl_manager.download(
+                info["webpage_url"], args.format, args.quality,
+                info=info, user_id=i % args.users
+            )
+            record["upload_start"] = time.monotonic()
+            with open_upload(result["file_path"]) as upload:
+                send = bot.send_audio if args.format == "audio" else bot.send_video
+                await send(1, upload, read_timeout=120, write_timeout=600)
+            record["end"] = time.monotonic()
+            await dl_manager.release(result["output_dir"])
+            records.append(record)
+        except Exception as e:
+            errors.append(f"{video_id}: {type(e).__name__}: {e}")
+
+    sampler.start()
+    started = time.monotonic()
+    await asyncio.gather(*(job(i) for i in range(args.jobs)))
+    wall = time.monotonic() - started
+    sampler.stop()
+
+    stages = {stage: [] for stage in STAGES}
+    for r in records:
+        fetch_start = r.get("fetch_start", r["start"])
+        stages["queue"].append(fetch_start - r["start"])
+        stages["download"].append(r.get("fetch_end", fetch_start) - fetch_start)
+        if "post_start" in r:
+            stages["postprocess"].append(r["post_end"] - r["post_start"])
+        stages["upload"].append(r["end"] - r["upload_start"])
+        stages["total"].append(r["end"] - r["start"])
+
+    # التأكد من أن الرفع تم بالطريقة المقاسة فعلاً
+    expected_source = "path" if args.local_mode else "multipart"
+    sources = Counter(upload["source"] for upload in sink.uploads)
+    for source, count in sources.items():
+        if source != expected_source:
+            errors.append(f"{count} uploads sent as {source}, expected {expected_source}")
+
+    await dl_manager.shutdown()
+    await bot.shutdown()
+    await sink_runner.cleanup()
+    await media_runner.cleanup()
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "config": {
+            "jobs": args.jobs, "concurrency": args.concurrency, "size_mb": args.size,
+            "kind": args.kind, "format": args.format, "quality": args.quality,
+            "rate_mb_s": args.rate, "parallel_downloads": not args.sequential,
+            "ffmpeg": "real" if real_ffmpeg else "stub", "local_mode": args.local_mode,
+        },
+        "completed": len(records),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "jobs_per_second": round(len(records) / wall, 3) if wall else 0,
+        "stages": {
+            stage: {"p50": round(percentile(v, 50), 3), "p99": round(percentile(v, 99), 3),
+                    "count": len(v)}
+            for stage, v in stages.items()
+        },
+        "peak_rss_bytes": sampler.peak_rss,
+        "peak_disk_bytes": sampler.peak_disk,
+        "media_requests": server.requests,
+        "uploads": len(sink.uploads),
+        "upload_sources": dict(sources),
+    }
+
+
+def print_report(report: dict):
+    mb = lambda n: f"{n / 1024 / 1024:.1f}MB"
+    config = report["config"]
+    print(f"jobs={config['jobs']} concurrency={config['concurrency']} size={config['size_mb']}MB "
+          f"kind={config['kind']} format={config['format']} ffmpeg={config['ffmpeg']}")
+    print(f"completed {report['completed']}/{config['jobs']} in {report['wall_seconds']}s "
+          f"-> {report['jobs_per_second']} jobs/s")
+    print(f"{'stage':<12}{'p50 (s)':>10}{'p99 (s)':>10}")
+    for stage, values in report["stages"].items():
+        print(f"{stage:<12}{values['p50']:>10.3f}{values['p99']:>10.3f}")
+    print(f"peak RSS (bot + workers + ffmpeg): {mb(report['peak_rss_bytes'])}")
+    print(f"peak temp disk: {mb(report['peak_disk_bytes'])}")
+    print("uploads: " + ", ".join(f"{source}={count}" for source, count in report["upload_sources"].items()))
+    for error in report["errors"][:10]:
+        print(f"error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download pipeline benchmark")
+    parser.add_argument("--jobs", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=3, help="MAX_CONCURRENT_DOWNLOADS")
+    parser.add_argument("--users", type=int, default=10, help="distinct user ids for the fair scheduler")
+    parser.add_argument("--size", type=float, default=20, help="video size in MB")
+    parser.add_argument("--kind", choices=("progressive", "fragmented", "mixed"), default="progressive")
+    parser.add_argument("--format", choices=("video", "audio"), default="video")
+    parser.add_argument("--quality", default="best")
+    parser.add_argument("--rate", type=float, default=0, help="per-connection limit in MB/s (0 = unlimited)")
+    parser.add_argument("--upload-delay", type=float, default=0.0)
+    parser.add_argument("--postprocess-workers", type=int, default=0)
+    parser.add_argument("--sequential", action="store_true", help="disable parallel fragments/ranges")
+    parser.add_argument("--local-mode", action="store_true", help="upload by path (local Bot API mode)")
+    parser.add_argument("--stub-ffmpeg", action="store_true", help="synthetic media + copy-only ffmpeg")
+    parser.add_argument("--workdir", help="keep media and temp files here")
+    parser.add_argument("--keep", action="store_true", help="do not delete the work directory")
+    parser.add_argument("--json", help="write the report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = asyncio.run(run_benchmark(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
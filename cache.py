@@ -0,0 +1,207 @@
+"""
+الكاش - كاش التحميلات على القرص (LRU) وكاش ذاكرة بمدة صلاحية
+"""
+import os
+import json
+import time
+import shutil
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional, Dict, Any, Hashable, List, Tuple
+
+from config import CACHE_DIR, CACHE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+
+def link_or_copy(src: str, dst: str):
+    """ربط صلب للملف (بدون نسخ) أو نسخه إذا لم يكن الربط ممكناً"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class TTLCache:
+    """كاش في الذاكرة بمدة صلاحية وحد أقصى للعناصر (LRU)"""
+
+    def __init__(self, ttl: float, max_items: int = 1024):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value, ttl: float = None):
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_items:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default=None):
+        item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, self) is not self
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class DownloadCache:
+    def __init__(self, cache_dir: Path = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.index_path = self.cache_dir / "index.json"
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = self._load_index()
+        # ملفات أُخليت ولم تُحذف قبل توقف سابق
+        self._remove(list(self.cache_dir.glob(".evicted-*")))
+
+    @staticmethod
+    def make_key(video_id: str, format_type: str, quality: str) -> str:
+        return hashlib.sha256(f"{video_id}:{format_type}:{quality}".encode()).hexdigest()
+
+    @property
+    def total_size(self) -> int:
+        return sum(entry["size"] for entry in self._entries.values())
+
+    def size(self) -> int:
+        """الحجم الكلي تحت القفل (آمن من خيط آخر أثناء put على حلقة الأحداث)"""
+        with self._lock:
+            return self.total_size
+
+    def _load_index(self) -> Dict[str, Dict[str, Any]]:
+        """تحميل الفهرس وحذف المدخلات التي فقدت ملفاتها"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+
+        return {
+            key: entry for key, entry in entries.items()
+            if (self.cache_dir / entry["file"]).exists()
+        }
+
+    def _save_index(self):
+        tmp_path = self.index_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.index_path)
+
+    def get(self, video_id: str, format_type: str, quality: str,
+            dest_dir: Path) -> Optional[Dict[str, Any]]:
+        """إرجاع نسخة من الملف المخزن داخل dest_dir مع بياناته، أو None"""
+        key = self.make_key(video_id, format_type, quality)
+        with self._lock:
+            entry = self._entries.get(key)
+            if not entry:
+                return None
+
+            cached_path = self.cache_dir / entry["file"]
+            if not cached_path.exists():
+                self._entries.pop(key, None)
+                self._save_index()
+                return None
+
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            dest_path = dest_dir / entry["filename"]
+            if not dest_path.exists():
+                link_or_copy(str(cached_path), str(dest_path))
+
+            entry["last_access"] = time.time()
+            entry["hits"] = entry.get("hits", 0) + 1
+            self._save_index()
+
+        return {**entry["metadata"], "file_path": str(dest_path), "file_size": entry["size"]}
+
+    def put(self, video_id: str, format_type: str, quality: str,
+            file_path: str, metadata: Dict[str, Any]):
+        """إضافة ملف للكاش ثم إخلاء الأقدم استخداماً إذا تجاوزنا الحد"""
+        size = os.path.getsize(file_path)
+        if size > self.max_bytes:
+            return
+
+        key = self.make_key(video_id, format_type, quality)
+        filename = os.path.basename(file_path)
+        stored_name = f"{key}{Path(filename).suffix}"
+
+        with self._lock:
+            stored_path = self.cache_dir / stored_name
+            if not stored_path.exists():
+                link_or_copy(file_path, str(stored_path))
+
+            now = time.time()
+            self._entries[key] = {
+                "file": stored_name,
+                "filename": filename,
+                "size": size,
+                "created_at": now,
+                "last_access": now,
+                "hits": 0,
+                "metadata": metadata,
+            }
+            victims, _ = self._evict(self.max_bytes)
+            self._save_index()
+        self._remove(victims)
+
+    def _evict(self, limit: int) -> Tuple[List[Path], int]:
+        """
+        (تحت القفل) إزالة المدخلات الأقدم استخداماً حتى نعود تحت limit - يعيد (الملفات، البايتات المحررة).
+        الملفات تُنقل لأسماء مؤقتة فقط، والحذف الفعلي بعد تحرير القفل عبر _remove.
+        """
+        total = start = self.total_size
+        victims = []
+        if total <= limit:
+            return victims, 0
+
+        for key, entry in sorted(self._entries.items(), key=lambda item: item[1]["last_access"]):
+            if total <= limit:
+                break
+            path = self.cache_dir / entry["file"]
+            evicted = path.with_name(f".evicted-{uuid.uuid4().hex}")
+            try:
+                os.replace(path, evicted)
+                victims.append(evicted)
+            except FileNotFoundError:
+                pass
+            total -= entry["size"]
+            del self._entries[key]
+            logger.info(f"Cache evicted {entry['filename']} ({entry['size']} bytes)")
+        return victims, start - total
+
+    @staticmethod
+    def _remove(paths: List[Path]):
+        for path in paths:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def shrink(self, limit: int) -> int:
+        """تقليص الكاش إلى limit بايت (لحصة المجلد المؤقت) - يعيد البايتات المحررة"""
+        with self._lock:
+            victims, freed = self._evict(limit)
+            if freed:
+                self._save_index()
+        self._remove(victims)
+        return freed
@@ -2,6 +2,7 @@
 الإعدادات - بدون أي إشارة لـ aria2
 """
 import os
+import socket
 import tempfile
 from pathlib import Path
 
@@ -14,14 +15,112 @@ WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
 PORT = int(os.environ.get("PORT", 8080))
 ADMIN_ID = int(os.environ.get("ADMIN_ID", 0))
 
+# خادم Bot API محلي (telegram-bot-api --local) - يرفع الملفات من مسارها على القرص
+# يجب أن يرى الخادم نفس مسار TEMP_DIR (مجلد مشترك)
+BOT_API_URL = os.environ.get("BOT_API_URL", "").rstrip("/")
+BOT_API_LOCAL_MODE = bool(BOT_API_URL)
+UPLOAD_TIMEOUT = int(os.environ.get("UPLOAD_TIMEOUT", 600))
+
 MAX_FILE_SIZE = 2 * 1024 * 1024 * 1024
+# أقل مساحة حرة تبقى في TEMP_DIR بعد حجز مساحة التحميلات الجارية
+MIN_FREE_DISK_BYTES = int(os.environ.get("MIN_FREE_DISK_BYTES", 512 * 1024 * 1024))
 MAX_PLAYLIST_ITEMS = 5
+# خط إنتاج قوائم التشغيل: عدد التحميلات والرفع المتزامن لكل قائمة
+PLAYLIST_DOWNLOAD_CONCURRENCY = int(os.environ.get("PLAYLIST_DOWNLOAD_CONCURRENCY", 2))
+PLAYLIST_UPLOAD_CONCURRENCY = int(os.environ.get("PLAYLIST_UPLOAD_CONCURRENCY", 1))
+MEDIA_GROUP_SIZE = 10
 MAX_DURATION_MINUTES = 120
 RATE_LIMIT_PER_MINUTE = 5
-MAX_CONCURRENT_DOWNLOADS = 3
+# مشاركة حد الطلبات بين عدة نسخ من البوت عبر عدادات Mongo (وإلا في الذاكرة فقط)
+RATE_LIMIT_SHARED = os.environ.get("RATE_LIMIT_SHARED", "0") == "1"
+# كاش نتائج is_banned / is_admin، وفترة استطلاع التغييرات من النسخ الأخرى (بدون change streams)
+ACCESS_CACHE_TTL = int(os.environ.get("ACCESS_CACHE_TTL", 300))
+ACCESS_CACHE_SIZE = 10000
+ACCESS_POLL_SECONDS = int(os.environ.get("ACCESS_POLL_SECONDS", 10))
+# الكتابة المؤجلة لسجلات التحميل وتحديثات المستخدمين: حجم الدفعة، أقصى تأخير،
+# وملف الحفظ عند تعذر الوصول لـ Mongo (خارج TEMP_DIR حتى لا يحذفه المنظف)
+WRITE_BUFFER_SIZE = int(os.environ.get("WRITE_BUFFER_SIZE", 500))
+WRITE_FLUSH_SECONDS = float(os.environ.get("WRITE_FLUSH_SECONDS", 2))
+WRITE_SPOOL_PATH = Path(os.environ.get("WRITE_SPOOL_PATH", Path(tempfile.gettempdir()) / "yt_bot_spool.jsonl"))
+MAX_CONCURRENT_DOWNLOADS = int(os.environ.get("MAX_CONCURRENT_DOWNLOADS", 3))
+MAX_DOWNLOADS_PER_USER = int(os.environ.get("MAX_DOWNLOADS_PER_USER", 1))
+
+# وضع طابور المهام: الواجهة تضيف المهام في Mongo وعمال download_worker.py (على أي خادم) ينفذونها
+JOB_QUEUE_MODE = os.environ.get("JOB_QUEUE_MODE", "0") == "1"
+# محادثة يرفع إليها العمال الملفات، ثم تعيد الواجهة إرسالها للمستخدم بـ file_id
+STORAGE_CHAT_ID = int(os.environ.get("STORAGE_CHAT_ID", 0))
+# مدة حجز المهمة؛ إن لم يجددها العامل (توقف أو انقطع) يحجزها عامل آخر
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", 60))
+# فترة تجديد الحجز ونشر التقدم، وفترة استطلاع الواجهة لحالة المهمة
+JOB_POLL_SECONDS = float(os.environ.get("JOB_POLL_SECONDS", 2))
+JOB_MAX_ATTEMPTS = 3
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY", MAX_CONCURRENT_DOWNLOADS))
+
+# اسم ثابت لهذا الخادم في سجل الطلبات - الطلبات غير المكتملة تُستأنف عند تشغيله التالي
+# (مع TEMP_DIR على مساحة دائمة تُكمل الملفات الجزئية بدل البدء من الصفر).
+# اسم المضيف في Docker يتغير بكل إعادة نشر: عندها لا يجد الخادم طلباته السابقة
+# ويتبناها خادم آخر (أو هو نفسه) بعد JOURNAL_STALE_SECONDS بلا تجديد، من البداية
+NODE_NAME_PINNED = bool(os.environ.get("NODE_NAME"))
+NODE_NAME = os.environ.get("NODE_NAME") or socket.gethostname()
+JOURNAL_STALE_SECONDS = int(os.environ.get("JOURNAL_STALE_SECONDS", 300))
+# كل خادم يجدد طلباته الجارية بهذه الفترة ويتبنى المتروكة
+JOURNAL_HEARTBEAT_SECONDS = max(1, JOURNAL_STALE_SECONDS // 3)
+
+# تحديثات التقدم: أقل فترة بين تعديلات الرسالة (ثوان) وأقل تغير في النسبة
+PROGRESS_MIN_INTERVAL = float(os.environ.get("PROGRESS_MIN_INTERVAL", 3))
+PROGRESS_MIN_DELTA = 5
+
+# عمليات yt-dlp المنفصلة وعدد المهام قبل إعادة تدوير كل عملية؛ التحميل يشغل عملية طوال النقل
+# لذا تبقى YTDLP_EXTRACT_WORKERS منها للاستخراج فقط (لا ينتظر الاستخراج خلف التحميلات الجارية)
+YTDLP_EXTRACT_WORKERS = int(os.environ.get("YTDLP_EXTRACT_WORKERS", 2))
+YTDLP_WORKERS = int(os.environ.get("YTDLP_WORKERS", MAX_CONCURRENT_DOWNLOADS + YTDLP_EXTRACT_WORKERS))
+YTDLP_WORKER_MAX_JOBS = int(os.environ.get("YTDLP_WORKER_MAX_JOBS", 50))
+# مهلة الإلغاء اللطيف قبل إنهاء عملية العامل (وffmpeg) بالقوة
+CANCEL_GRACE_SECONDS = float(os.environ.get("CANCEL_GRACE_SECONDS", 2))
+
+# مرحلة المعالجة (ffmpeg): عدد العمليات المتزامنة وأولويتها (nice، 0 = بدون)
+POSTPROCESS_WORKERS = int(os.environ.get("POSTPROCESS_WORKERS", os.cpu_count() or 2))
+POSTPROCESS_NICE = int(os.environ.get("POSTPROCESS_NICE", 10))
+
+# التحميل المتوازي: أجزاء DASH/HLS المتزامنة (عدد ثابت داخل yt-dlp)، ونطاقات HTTP للصيغ التقدمية
+# (الاتصالات تبدأ بواحد وتتضاعف حتى RANGE_MAX_CONNECTIONS ما دامت السرعة تتحسن)
+PARALLEL_DOWNLOADS = os.environ.get("PARALLEL_DOWNLOADS", "1") == "1"
+FRAGMENT_CONCURRENCY = int(os.environ.get("FRAGMENT_CONCURRENCY", 4))
+RANGE_MAX_CONNECTIONS = int(os.environ.get("RANGE_MAX_CONNECTIONS", 8))
+RANGE_CHUNK_SIZE = int(os.environ.get("RANGE_CHUNK_SIZE", 4 * 1024 * 1024))
+RANGE_MIN_SIZE = int(os.environ.get("RANGE_MIN_SIZE", 8 * 1024 * 1024))
 
-TEMP_DIR = Path(tempfile.gettempdir()) / "yt_bot"
+# مجلد التحميلات المؤقت؛ على مساحة دائمة (volume) تبقى الملفات الجزئية بعد إعادة النشر فيكملها الاستئناف
+TEMP_DIR_PINNED = bool(os.environ.get("TEMP_DIR"))
+TEMP_DIR = Path(os.environ.get("TEMP_DIR") or Path(tempfile.gettempdir()) / "yt_bot")
 TEMP_DIR.mkdir(parents=True, exist_ok=True)
 
+# كاش التحميلات على القرص (داخل TEMP_DIR)
+CACHE_DIR = TEMP_DIR / "cache"
+CACHE_MAX_BYTES = int(os.environ.get("CACHE_MAX_BYTES", 10 * 1024 * 1024 * 1024))
+
+# منظف TEMP_DIR: ما لا يملكه تحميل جارٍ ولم يتغير منذ JANITOR_MIN_AGE يُحذف،
+# والحجم الكلي (مع الكاش) يبقى تحت TEMP_QUOTA_BYTES
+JANITOR_INTERVAL = int(os.environ.get("JANITOR_INTERVAL", 600))
+JANITOR_MIN_AGE = int(os.environ.get("JANITOR_MIN_AGE", 3600))
+TEMP_QUOTA_BYTES = int(os.environ.get("TEMP_QUOTA_BYTES", 20 * 1024 * 1024 * 1024))
+
+# كاش بيانات الفيديو (extract_info) - روابط يوتيوب تنتهي بعد ساعات لذا المدة قصيرة
+INFO_CACHE_TTL = int(os.environ.get("INFO_CACHE_TTL", 600))
+INFO_CACHE_SIZE = 512
+# الصور المصغرة للصوت (بالبايت) حسب معرف الفيديو
+THUMBNAIL_CACHE_TTL = 24 * 3600
+THUMBNAIL_CACHE_SIZE = 256
+
+# جلسة HTTP المشتركة للتطبيق
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", 32))
+
+# مقاييس Prometheus على /metrics (0 يعطل الخادم)؛ محلية فقط افتراضياً - METRICS_HOST=0.0.0.0 لكشفها
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 9090))
+
+# جدول الصيغ والصيغة المختارة لكل فيديو (بدون روابط - يبقى صالحاً أطول)
+FORMAT_CACHE_TTL = int(os.environ.get("FORMAT_CACHE_TTL", 6 * 3600))
+
 DEFAULT_LANG = 'ar'
 SUPPORTED_LANGS = ['ar', 'en']
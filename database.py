@@ -1,13 +1,26 @@
 """
 قاعدة البيانات - Async MongoDB مع دعم Atlas و المحلي
 """
+import uuid
+import asyncio
 import logging
+from typing import Optional
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
 from datetime import datetime, timedelta
-from config import MONGO_URI, ADMIN_ID, RATE_LIMIT_PER_MINUTE
+from config import (
+    MONGO_URI, ADMIN_ID, ACCESS_CACHE_TTL, ACCESS_CACHE_SIZE, ACCESS_POLL_SECONDS,
+    WRITE_BUFFER_SIZE, WRITE_FLUSH_SECONDS, WRITE_SPOOL_PATH
+)
+from cache import TTLCache
+from writebehind import WriteBehind
 
 logger = logging.getLogger(__name__)
 
+# حالات نهائية في سجل الطلبات (لا تُستأنف)
+JOURNAL_FINAL_STATES = ["done", "failed", "cancelled", "abandoned"]
+
 
 class AsyncDatabase:
     def __init__(self, uri: str = MONGO_URI):
@@ -36,6 +49,22 @@ class AsyncDatabase:
         self.cookies = self.db["cookies"]
         self.settings = self.db["settings"]
         self.banned = self.db["banned"]
+        self.file_cache = self.db["file_cache"]
+        # عدادات حد الطلبات المشتركة (دلو لكل مستخدم ودقيقة)
+        self.rate_limits = self.db["rate_limits"]
+        # طابور المهام المشترك بين الواجهة والعمال (JOB_QUEUE_MODE)
+        self.jobs = self.db["jobs"]
+        # سجل الطلبات الجارية لاستئنافها بعد إعادة التشغيل
+        self.journal = self.db["journal"]
+        
+        # كاش الحظر والصلاحيات: ("banned", user_id) -> bool و ("admins",) -> set
+        self._access_cache = TTLCache(ACCESS_CACHE_TTL, ACCESS_CACHE_SIZE)
+        
+        # سجلات التحميل وتحديثات المستخدمين تُكتب مجمعة بالخلفية
+        self.writer = WriteBehind(
+            self.downloads, self.users,
+            WRITE_BUFFER_SIZE, WRITE_FLUSH_SECONDS, WRITE_SPOOL_PATH
+        )
         
     async def init_indexes(self):
         """إنشاء الفهارس لتحسين الأداء"""
@@ -55,6 +84,22 @@ class AsyncDatabase:
             await self.banned.create_index("user_id", unique=True)
             await self.banned.create_index("expires_at", expireAfterSeconds=0)
             
+            # فهرس file_id المرفوعة مسبقاً
+            await self.file_cache.create_index(
+                [("video_id", 1), ("format", 1), ("quality", 1)], unique=True
+            )
+            
+            # عدادات حد الطلبات تُحذف بعد انتهاء نافذتها
+            await self.rate_limits.create_index("expires_at", expireAfterSeconds=0)
+            
+            # فهارس طابور المهام: الحجز بالأولوية ثم الأقدم، والحذف التلقائي بعد يوم
+            await self.jobs.create_index([("status", 1), ("priority", -1), ("created_at", 1)])
+            await self.jobs.create_index("expires_at", expireAfterSeconds=0)
+            
+            # فهارس سجل الطلبات
+            await self.journal.create_index([("node", 1), ("state", 1)])
+            await self.journal.create_index("expires_at", expireAfterSeconds=0)
+            
             logger.info("✅ Database indexes created successfully")
         except Exception as e:
             logger.error(f"❌ Failed to create indexes: {e}")
@@ -63,7 +108,18 @@ class AsyncDatabase:
         
     async def is_banned(self, user_id: int) -> bool:
         """التحقق إذا كان المستخدم محظور"""
+        key = ("banned", user_id)
+        cached = self._access_cache.get(key)
+        if cached is not None:
+            return cached
+        
         banned = await self.banned.find_one({"user_id": user_id})
+        ttl = None
+        if banned and banned.get("expires_at"):
+            # الحظر المؤقت لا يبقى في الكاش بعد انتهائه
+            remaining = (banned["expires_at"] - datetime.now()).total_seconds()
+            ttl = max(0.0, min(ACCESS_CACHE_TTL, remaining))
+        self._access_cache.set(key, banned is not None, ttl)
         return banned is not None
     
     async def ban_user(self, user_id: int, reason: str = "", duration_hours: int = 0):
@@ -82,19 +138,25 @@ class AsyncDatabase:
             {"$set": doc},
             upsert=True
         )
+        await self._access_changed(("banned", user_id))
         logger.info(f"User {user_id} banned. Reason: {reason}")
     
     async def unban_user(self, user_id: int):
         """إلغاء حظر مستخدم"""
         await self.banned.delete_one({"user_id": user_id})
+        await self._access_changed(("banned", user_id))
         logger.info(f"User {user_id} unbanned")
     
     async def is_admin(self, user_id: int) -> bool:
         """التحقق إذا كان المستخدم أدمن"""
         if user_id == ADMIN_ID:
             return True
-        config = await self.settings.find_one({"key": "admin_ids"})
-        return user_id in config.get("value", []) if config else False
+        admins = self._access_cache.get(("admins",))
+        if admins is None:
+            config = await self.settings.find_one({"key": "admin_ids"})
+            admins = set(config.get("value", [])) if config else set()
+            self._access_cache.set(("admins",), admins)
+        return user_id in admins
     
     async def add_admin(self, user_id: int):
         """إضافة أدمن جديد"""
@@ -103,21 +165,68 @@ class AsyncDatabase:
             {"$addToSet": {"value": user_id}},
             upsert=True
         )
+        await self._access_changed(("admins",))
         logger.info(f"User {user_id} added as admin")
     
-    async def check_rate_limit(self, user_id: int) -> bool:
-        """التحقق من عدم تجاوز الحد المسموح"""
-        one_minute_ago = datetime.now() - timedelta(minutes=1)
-        count = await self.downloads.count_documents({
-            "user_id": user_id,
-            "created_at": {"$gte": one_minute_ago}
-        })
-        return count < RATE_LIMIT_PER_MINUTE
+    async def _access_changed(self, key: tuple):
+        """إبطال الكاش محلياً وزيادة رقم الإصدار لتبطله بقية النسخ (وضع الاستطلاع)"""
+        self._access_cache.pop(key)
+        await self.settings.update_one(
+            {"key": "access_version"},
+            {"$inc": {"value": 1}},
+            upsert=True
+        )
+    
+    async def _access_version(self) -> int:
+        doc = await self.settings.find_one({"key": "access_version"})
+        return doc.get("value", 0) if doc else 0
+    
+    async def watch_access_changes(self):
+        """
+        إبطال كاش الحظر والصلاحيات عند تغييرها من نسخة أخرى (أو انتهاء حظر مؤقت):
+        change stream إن كان Mongo مجموعة نسخ، وإلا استطلاع رقم الإصدار
+        """
+        pipeline = [{"$match": {"ns.coll": {"$in": [self.banned.name, self.settings.name]}}}]
+        try:
+            async with self.db.watch(pipeline) as stream:
+                logger.info("Access cache: watching change stream")
+                async for _ in stream:
+                    self._access_cache.clear()
+        except PyMongoError as e:
+            logger.info(f"Access cache: change stream unavailable ({e}), polling")
+        
+        version = None
+        while True:
+            try:
+                current = await self._access_version()
+                if version is not None and current != version:
+                    self._access_cache.clear()
+                version = current
+            except PyMongoError as e:
+                logger.warning(f"Access version poll error: {e}")
+            await asyncio.sleep(ACCESS_POLL_SECONDS)
+    
+    async def incr_rate_bucket(self, user_id: int, minute: int, amount: int = 1) -> int:
+        """زيادة عداد طلبات المستخدم في دقيقة معينة بشكل ذري وإرجاع القيمة الجديدة"""
+        doc = await self.rate_limits.find_one_and_update(
+            {"_id": f"{user_id}:{minute}"},
+            {
+                "$inc": {"count": amount},
+                "$setOnInsert": {"expires_at": datetime.now() + timedelta(minutes=3)}
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return doc["count"]
+    
+    async def get_rate_bucket(self, user_id: int, minute: int) -> int:
+        doc = await self.rate_limits.find_one({"_id": f"{user_id}:{minute}"}, {"count": 1})
+        return doc["count"] if doc else 0
     
     async def log_download(self, user_id: int, url: str, status: str, 
                           metadata: dict = None, error: str = None):
-        """تسجيل عملية تحميل"""
-        await self.downloads.insert_one({
+        """تسجيل عملية تحميل (كتابة مؤجلة - لا ينتظر Mongo)"""
+        self.writer.insert({
             "user_id": user_id,
             "url": url,
             "status": status,
@@ -127,14 +236,248 @@ class AsyncDatabase:
             "expires_at": datetime.now() + timedelta(days=7)
         })
     
-    async def update_user(self, user_id: int, **kwargs):
-        """تحديث معلومات المستخدم"""
-        await self.users.update_one(
-            {"user_id": user_id},
-            {"$set": {**kwargs, "last_visit": datetime.now()}},
+    async def get_cached_file(self, video_id: str, format_type: str, quality: str) -> Optional[dict]:
+        """البحث عن file_id لملف سبق رفعه لتيليجرام"""
+        return await self.file_cache.find_one({
+            "video_id": video_id,
+            "format": format_type,
+            "quality": quality
+        })
+    
+    async def cache_file_id(self, video_id: str, format_type: str, quality: str,
+                            file_id: str, metadata: dict = None):
+        """حفظ file_id بعد الرفع لإعادة استخدامه لاحقاً"""
+        await self.file_cache.update_one(
+            {"video_id": video_id, "format": format_type, "quality": quality},
+            {
+                "$set": {"file_id": file_id, "metadata": metadata or {}, "updated_at": datetime.now()},
+                "$setOnInsert": {"hits": 0, "created_at": datetime.now()}
+            },
             upsert=True
         )
     
+    async def touch_cached_file(self, video_id: str, format_type: str, quality: str):
+        """زيادة عداد الاستخدام لملف مخزن"""
+        await self.file_cache.update_one(
+            {"video_id": video_id, "format": format_type, "quality": quality},
+            {"$inc": {"hits": 1}, "$set": {"last_hit": datetime.now()}}
+        )
+    
+    async def drop_cached_file(self, video_id: str, format_type: str, quality: str):
+        """حذف file_id لم يعد صالحاً"""
+        await self.file_cache.delete_one(
+            {"video_id": video_id, "format": format_type, "quality": quality}
+        )
+    
+    # ============ طابور المهام ============
+    
+    async def enqueue_job(self, user_id: int, url: str, format_type: str, quality: str,
+                          priority: bool = False) -> str:
+        """إضافة مهمة تحميل للطابور وإرجاع معرفها"""
+        job_id = uuid.uuid4().hex
+        now = datetime.now()
+        await self.jobs.insert_one({
+            "_id": job_id,
+            "user_id": user_id,
+            "url": url,
+            "format": format_type,
+            "quality": quality,
+            "priority": priority,
+            "status": "queued",
+            "attempts": 0,
+            "cancel_requested": False,
+            "worker": None,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + timedelta(days=1)
+        })
+        return job_id
+    
+    async def claim_job(self, worker_id: str, lease_seconds: int, max_attempts: int) -> Optional[dict]:
+        """
+        حجز أقدم مهمة متاحة بشكل ذري: في الانتظار، أو قيد التنفيذ بحجز منتهٍ (عاملها توقف)
+        """
+        now = datetime.now()
+        # مهام انتهى حجزها بعد آخر محاولة مسموحة أو بعد طلب إلغائها لا تُعاد
+        await self.jobs.update_many(
+            {
+                "status": "running",
+                "lease_until": {"$lt": now},
+                "$or": [{"attempts": {"$gte": max_attempts}}, {"cancel_requested": True}]
+            },
+            {"$set": {
+                "status": "failed",
+                "error": {"type": "unknown", "message": "Worker lost"},
+                "updated_at": now
+            }}
+        )
+        return await self.jobs.find_one_and_update(
+            {
+                "cancel_requested": False,
+                "$or": [
+                    {"status": "queued"},
+                    {"status": "running", "lease_until": {"$lt": now}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker": worker_id,
+                    "lease_until": now + timedelta(seconds=lease_seconds),
+                    "updated_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def renew_job(self, job_id: str, worker_id: str, lease_seconds: int,
+                        progress: dict = None) -> Optional[dict]:
+        """تجديد الحجز ونشر آخر تقدم؛ None إن فقد العامل المهمة"""
+        now = datetime.now()
+        return await self.jobs.find_one_and_update(
+            {"_id": job_id, "worker": worker_id, "status": "running"},
+            {"$set": {
+                "lease_until": now + timedelta(seconds=lease_seconds),
+                "progress": progress,
+                "updated_at": now
+            }},
+            projection={"cancel_requested": 1},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    async def finish_job(self, job_id: str, worker_id: str, status: str,
+                         result: dict = None, error: dict = None):
+        """تسجيل نتيجة المهمة (done / failed / cancelled)"""
+        await self.jobs.update_one(
+            {"_id": job_id, "worker": worker_id, "status": "running"},
+            {"$set": {
+                "status": status,
+                "result": result,
+                "error": error,
+                "progress": None,
+                "updated_at": datetime.now()
+            }}
+        )
+    
+    async def release_job(self, job_id: str, worker_id: str):
+        """إعادة المهمة للطابور عند إيقاف العامل ليحجزها غيره فوراً"""
+        await self.jobs.update_one(
+            {"_id": job_id, "worker": worker_id, "status": "running"},
+            {
+                "$set": {"status": "queued", "worker": None, "progress": None,
+                         "updated_at": datetime.now()},
+                "$inc": {"attempts": -1}
+            }
+        )
+    
+    async def get_job(self, job_id: str) -> Optional[dict]:
+        return await self.jobs.find_one({"_id": job_id})
+    
+    async def job_position(self, job: dict) -> int:
+        """ترتيب مهمة منتظرة في الطابور"""
+        ahead = await self.jobs.count_documents({
+            "status": "queued",
+            "cancel_requested": False,
+            "$or": [
+                {"priority": {"$gt": job.get("priority", False)}},
+                {"priority": job.get("priority", False), "created_at": {"$lt": job["created_at"]}}
+            ]
+        })
+        return ahead + 1
+    
+    async def cancel_job(self, job_id: str):
+        """إلغاء مهمة: المنتظرة تُلغى مباشرة والجارية يوقفها عاملها عند تجديد حجزها"""
+        await self.jobs.update_one(
+            {"_id": job_id, "status": "queued"},
+            {"$set": {"status": "cancelled", "cancel_requested": True, "updated_at": datetime.now()}}
+        )
+        await self.jobs.update_one(
+            {"_id": job_id, "status": "running"},
+            {"$set": {"cancel_requested": True, "updated_at": datetime.now()}}
+        )
+    
+    # ============ سجل الطلبات ============
+    
+    async def journal_create(self, node: str, user_id: int, chat_id: int, url: str,
+                             format_type: str, quality: str, priority: bool = False) -> str:
+        """تسجيل طلب جديد بحالة queued وإرجاع معرفه"""
+        entry_id = uuid.uuid4().hex
+        now = datetime.now()
+        await self.journal.insert_one({
+            "_id": entry_id,
+            "node": node,
+            "user_id": user_id,
+            "chat_id": chat_id,
+            "url": url,
+            "format": format_type,
+            "quality": quality,
+            "priority": priority,
+            "state": "queued",
+            "history": [{"state": "queued", "at": now}],
+            "resumes": 0,
+            "created_at": now,
+            "updated_at": now,
+            "expires_at": now + timedelta(days=7)
+        })
+        return entry_id
+    
+    async def journal_state(self, entry_id: str, state: str, **fields):
+        """تسجيل انتقال الحالة (مع حقول إضافية مثل job_id)"""
+        now = datetime.now()
+        await self.journal.update_one(
+            {"_id": entry_id},
+            {
+                "$set": {"state": state, "updated_at": now, **fields},
+                "$push": {"history": {"state": state, "at": now}}
+            }
+        )
+    
+    async def journal_unfinished(self, node: str) -> list:
+        """طلبات هذا الخادم التي توقفت قبل نهايتها (إعادة تشغيل أو انهيار)"""
+        return await self.journal.find({
+            "node": node,
+            "state": {"$nin": JOURNAL_FINAL_STATES}
+        }).sort("created_at", 1).to_list(length=None)
+    
+    async def journal_resumed(self, entry_id: str):
+        await self.journal.update_one({"_id": entry_id}, {"$inc": {"resumes": 1}})
+
+    async def journal_touch(self, node: str):
+        """تجديد طلبات هذا الخادم الجارية حتى لا تبدو متروكة للخوادم الأخرى"""
+        await self.journal.update_many(
+            {"node": node, "state": {"$nin": JOURNAL_FINAL_STATES}},
+            {"$set": {"updated_at": datetime.now()}}
+        )
+
+    async def journal_adopt(self, node: str, stale_seconds: int) -> list:
+        """نقل طلبات الخوادم التي لم تُجدد منذ stale_seconds إلى هذا الخادم
+        (خادم انهار أو تغير اسمه بإعادة النشر)؛ النقل ذري فلا يتبنى الطلب خادمان"""
+        stale_before = datetime.now() - timedelta(seconds=stale_seconds)
+        adopted = []
+        while True:
+            entry = await self.journal.find_one_and_update(
+                {
+                    "node": {"$ne": node},
+                    "state": {"$nin": JOURNAL_FINAL_STATES},
+                    "updated_at": {"$lt": stale_before}
+                },
+                {"$set": {"node": node, "updated_at": datetime.now()}},
+                sort=[("created_at", 1)],
+                return_document=ReturnDocument.AFTER
+            )
+            if not entry:
+                return adopted
+            adopted.append(entry)
+    
+    async def update_user(self, user_id: int, **kwargs):
+        """تحديث معلومات المستخدم (كتابة مؤجلة؛ التحديثات المتتالية لنفس المستخدم تُدمج)"""
+        self.writer.upsert_user(user_id, {**kwargs, "last_visit": datetime.now()})
+    
     async def get_user_stats(self, user_id: int) -> dict:
         """الحصول على إحصائيات المستخدم"""
         total = await self.downloads.count_documents({"user_id": user_id})
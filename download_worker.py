@@ -0,0 +1,69 @@
+"""
+عامل التحميل - يحجز مهام الطابور من Mongo وينفذها (JOB_QUEUE_MODE)
+التشغيل: python download_worker.py (عدة عمليات على أي عدد من الخوادم)
+"""
+import signal
+import asyncio
+import logging
+
+from telegram import Bot
+from telegram.request import HTTPXRequest
+
+from config import (
+    TOKEN, BOT_API_URL, UPLOAD_TIMEOUT, STORAGE_CHAT_ID, WORKER_CONCURRENCY,
+    METRICS_HOST, METRICS_PORT
+)
+from database import db
+from downloader import dl_manager
+from jobqueue import JobWorker
+from metrics import start_metrics_server
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+
+def build_bot() -> Bot:
+    """نفس إعدادات الاتصال بـ Bot API التي تستخدمها الواجهة"""
+    if BOT_API_URL:
+        return Bot(
+            TOKEN,
+            base_url=f"{BOT_API_URL}/bot",
+            base_file_url=f"{BOT_API_URL}/file/bot",
+            local_mode=True,
+            request=HTTPXRequest(read_timeout=UPLOAD_TIMEOUT, write_timeout=UPLOAD_TIMEOUT)
+        )
+    return Bot(TOKEN)
+
+
+async def run():
+    if not STORAGE_CHAT_ID:
+        logger.error("STORAGE_CHAT_ID is required for download workers!")
+        return
+
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+
+    await db.init_indexes()
+    await dl_manager.start()
+    try:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        logger.error(f"⚠️ Metrics server failed: {e}")
+        metrics_runner = None
+
+    try:
+        async with build_bot() as bot:
+            await JobWorker(bot, dl_manager, STORAGE_CHAT_ID, WORKER_CONCURRENCY).run(stop_event)
+    finally:
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        await dl_manager.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -3,49 +3,200 @@
 """
 import os
 import asyncio
-import functools
-import hashlib
+import logging
+import shutil
+import time
+import uuid
 from pathlib import Path
-from typing import Optional, Dict, Any, Callable
-
-import yt_dlp
+from typing import Optional, Dict, Any, Callable, List, AsyncIterator, Tuple
 
 from exceptions import DownloadError, CancelledError, FileTooLargeError
-from config import TEMP_DIR, MAX_PLAYLIST_ITEMS, MAX_FILE_SIZE
-from validators import sanitize_filename
+from config import (
+    TEMP_DIR, MAX_PLAYLIST_ITEMS, MAX_FILE_SIZE, MAX_DURATION_MINUTES,
+    INFO_CACHE_TTL, INFO_CACHE_SIZE, FORMAT_CACHE_TTL,
+    YTDLP_WORKERS, YTDLP_EXTRACT_WORKERS, YTDLP_WORKER_MAX_JOBS,
+    MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_USER,
+    PLAYLIST_DOWNLOAD_CONCURRENCY, CANCEL_GRACE_SECONDS, MIN_FREE_DISK_BYTES,
+    POSTPROCESS_WORKERS, POSTPROCESS_NICE, PARALLEL_DOWNLOADS, FRAGMENT_CONCURRENCY,
+    RANGE_MAX_CONNECTIONS, RANGE_CHUNK_SIZE, RANGE_MIN_SIZE,
+    THUMBNAIL_CACHE_TTL, THUMBNAIL_CACHE_SIZE, UPLOAD_TIMEOUT,
+    JANITOR_INTERVAL, JANITOR_MIN_AGE, TEMP_QUOTA_BYTES
+)
+from validators import sanitize_filename, extract_video_id
+from cache import DownloadCache, TTLCache, link_or_copy
+from janitor import TempJanitor
+from formats import (
+    estimate_size, estimate_disk_usage, format_filesize, format_table, fit_formats,
+    select_formats, audio_profile, AUDIO_MP3, MP3_BITRATE_KBPS
+)
+from postprocess import FFmpegPool, merge_args, audio_copy_args, mp3_args, native_audio_ext
+from progress import ProgressBus
+from metrics import STAGE_SECONDS, BYTES, CACHE, JOB_CPU_SECONDS, QUEUE_DEPTH, ACTIVE_JOBS
+from scheduler import FairScheduler
+from workers import WorkerPool, WorkerCancelled, WorkerFailed
+from utils import cleanup_file
+
+logger = logging.getLogger(__name__)
+
+
+def cache_variant(format_type: str, quality: str) -> str:
+    """الجودة الفعلية المستخدمة في مفتاح الكاش (للصوت: native أو mp3)"""
+    return quality if format_type == "video" else audio_profile(quality)
+
+
+def check_duration(info: dict):
+    """رفض الفيديو الأطول من MAX_DURATION_MINUTES قبل تحميله"""
+    minutes = (info.get('duration') or 0) / 60
+    if minutes > MAX_DURATION_MINUTES:
+        raise DownloadError(
+            f"Video too long ({int(minutes)} min). Max: {MAX_DURATION_MINUTES} min.", "too_long"
+        )
+
+
+def downloaded_files(info: dict) -> list:
+    """المسارات النهائية للملفات بعد المعالجة (من requested_downloads)"""
+    return [
+        d['filepath'] for d in info.get('requested_downloads') or []
+        if d.get('filepath')
+    ]
+
+
+def downloaded_bytes(info: dict) -> int:
+    """مجموع أحجام الملفات المحملة (تشمل عناصر قائمة التشغيل)"""
+    sources = [e for e in info.get('entries') or [] if e] if 'entries' in info else [info]
+    return sum(os.path.getsize(f) for source in sources
+               for f in downloaded_files(source) if os.path.exists(f))
+
+
+def written_thumbnail(info: dict) -> Optional[str]:
+    """مسار الصورة المصغرة التي كتبها yt-dlp (writethumbnail) إن وُجدت"""
+    for source in [info, *(info.get('requested_downloads') or [])]:
+        for thumbnail in reversed(source.get('thumbnails') or []):
+            path = thumbnail.get('filepath')
+            if path and os.path.exists(path):
+                return path
+    return None
+
+
+class DownloadJob:
+    """تحميل جارٍ مشترك بين كل الطلبات المتطابقة"""
+
+    def __init__(self, key: str, output_dir: Path):
+        self.key = key
+        self.output_dir = output_dir
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers: Dict[str, Dict[str, Any]] = {}
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.progress = ProgressBus()
+        self.cancelled = False
+        self.aborting = False
+
+    def subscribe(self, token: str, output_dir: Path, progress_callback: Callable = None):
+        self.subscribers[token] = {"output_dir": output_dir, "callback": progress_callback}
+        if progress_callback:
+            self.progress.subscribe(progress_callback)
+
+    def unsubscribe(self, token: str):
+        sub = self.subscribers.pop(token, None)
+        self.results.pop(token, None)
+        if sub and sub["callback"]:
+            self.progress.unsubscribe(sub["callback"])
+        # لا أحد ينتظر هذا التحميل - إيقافه
+        if not self.subscribers and self.task and not self.task.done():
+            self.cancelled = True
+
+    async def publish_position(self, position: int):
+        self.progress.post("queued", position=position)
+
+    def distribute(self, result: Dict[str, Any]):
+        """ربط ملفات النتيجة في مجلد خاص لكل منتظر"""
+        for token, sub in self.subscribers.items():
+            dest_dir = sub["output_dir"]
+            dest_dir.mkdir(parents=True, exist_ok=True)
+
+            def private_copy(path: str) -> str:
+                dest = dest_dir / os.path.basename(path)
+                link_or_copy(path, str(dest))
+                return str(dest)
+
+            if result.get("is_playlist"):
+                private = {"files": [private_copy(f) for f in result["files"]]}
+            else:
+                private = {"file_path": private_copy(result["file_path"])}
+            self.results[token] = {**result, **private, "output_dir": str(dest_dir)}
 
 
 class AdvancedDownloadManager:
     def __init__(self):
         self.temp_dir = Path(TEMP_DIR)
         self.temp_dir.mkdir(exist_ok=True)
-        self.active_downloads = {}
-        self._semaphore = asyncio.Semaphore(3)
+        # سجل الإلغاء: معرف الطلب -> حدث الإلغاء الخاص به
+        self.active_downloads: Dict[str, asyncio.Event] = {}
+        self.scheduler = FairScheduler(MAX_CONCURRENT_DOWNLOADS, MAX_DOWNLOADS_PER_USER)
+        self.cache = DownloadCache()
+        self._jobs: Dict[str, DownloadJob] = {}
+        # مجلدات أُعيدت للمستدعي (نسخة خاصة أو إصابة كاش) ولم يحررها بعد release
+        self._handed_out: set = set()
+        self._info_cache = TTLCache(INFO_CACHE_TTL, INFO_CACHE_SIZE)
+        # لكل فيديو: جدول الصيغ المختصر والصيغة المختارة لكل جودة
+        self._format_cache = TTLCache(FORMAT_CACHE_TTL, INFO_CACHE_SIZE)
+        # الصور المصغرة بالبايت: من الملف الذي كتبه التحميل أو من جلب سابق
+        self.thumbnails = TTLCache(THUMBNAIL_CACHE_TTL, THUMBNAIL_CACHE_SIZE)
+        self.pool = WorkerPool(YTDLP_WORKERS, YTDLP_WORKER_MAX_JOBS, YTDLP_EXTRACT_WORKERS)
+        self.postprocessor = FFmpegPool(POSTPROCESS_WORKERS, POSTPROCESS_NICE)
+        QUEUE_DEPTH.set_function(lambda: self.scheduler.queued, stage="download")
+        ACTIVE_JOBS.set_function(lambda: self.scheduler.active, stage="download")
+        QUEUE_DEPTH.set_function(lambda: self.postprocessor.queued, stage="postprocess")
+        ACTIVE_JOBS.set_function(lambda: self.postprocessor.active, stage="postprocess")
+        # مجموع المساحة المحجوزة للتحميلات الجارية في TEMP_DIR
+        self._reserved_bytes = 0
+        # أثناء الإيقاف تبقى الملفات الجزئية ليكملها الاستئناف عند التشغيل التالي
+        self.stopping = False
+        self.janitor = TempJanitor(
+            self, self.temp_dir, self.cache, TEMP_QUOTA_BYTES,
+            min_age=JANITOR_MIN_AGE, upload_age=UPLOAD_TIMEOUT, interval=JANITOR_INTERVAL
+        )
+        self._janitor_task: Optional[asyncio.Task] = None
         
     def get_ydl_opts(self, format_type: str, quality: str = "best", 
                      output_path: str = None, 
-                     progress_hook: Callable = None) -> dict:
+                     progress_hook: Callable = None,
+                     format_id: str = None,
+                     raw_formats: str = None) -> dict:
+        """
+        raw_formats: معرفات صيغ مفصولة بفواصل تُحمّل كما هي بدون أي معالجة داخل yt-dlp
+        (الدمج والتحويل في مرحلة المعالجة المنفصلة)
+        """
         opts = {
             'outtmpl': str(output_path or self.temp_dir / '%(title)s.%(ext)s'),
             'quiet': True,
+            'noprogress': True,
             'no_warnings': True,
             'extract_flat': False,
             'socket_timeout': 30,
             'retries': 3,
             'fragment_retries': 3,
             'skip_unavailable_fragments': True,
+            'playlistend': MAX_PLAYLIST_ITEMS,
+            'concurrent_fragment_downloads': FRAGMENT_CONCURRENCY if PARALLEL_DOWNLOADS else 1,
         }
         
         if progress_hook:
             opts['progress_hooks'] = [progress_hook]
+
+        if raw_formats:
+            opts['format'] = raw_formats
+            # الصورة المصغرة للصوت: غلاف MP3 في مرحلة المعالجة وصورة الرد لكل الملفات الصوتية
+            opts['writethumbnail'] = format_type == "audio"
+            return opts
             
-        if format_type == "audio":
+        if format_type == "audio" and audio_profile(quality) == AUDIO_MP3:
             opts.update({
                 'format': 'bestaudio/best',
                 'postprocessors': [{
                     'key': 'FFmpegExtractAudio',
                     'preferredcodec': 'mp3',
-                    'preferredquality': '192',
+                    'preferredquality': str(MP3_BITRATE_KBPS),
                 }, {
                     'key': 'FFmpegMetadata',
                     'add_metadata': True,
@@ -53,24 +204,144 @@ class AdvancedDownloadManager:
                 'writethumbnail': True,
                 'embedthumbnail': True,
             })
+        elif format_type == "audio":
+            # المسار الأصلي كما هو (m4a أو opus): نسخ بدون ترميز + البيانات الوصفية فقط
+            opts.update({
+                'format': 'bestaudio[ext=m4a]/bestaudio/best',
+                'postprocessors': [{
+                    'key': 'FFmpegExtractAudio',
+                    'preferredcodec': 'best',
+                }, {
+                    'key': 'FFmpegMetadata',
+                    'add_metadata': True,
+                }],
+            })
         elif format_type == "video":
             if quality == "best":
                 opts['format'] = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
             else:
                 height = quality.replace('p', '')
                 opts['format'] = f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/best[height<={height}]'
+            if format_id:
+                # صيغة محددة اختيرت لتناسب حد الحجم
+                opts['format'] = format_id
             opts['merge_output_format'] = 'mp4'
             
         return opts
     
+    # ============ سجل الإلغاء ============
+
+    def register_cancel(self, request_id: str) -> asyncio.Event:
+        """تسجيل طلب قابل للإلغاء وإرجاع حدثه (يُمرر لـ download أو iter_playlist)"""
+        event = asyncio.Event()
+        self.active_downloads[request_id] = event
+        return event
+
+    def unregister_cancel(self, request_id: str):
+        self.active_downloads.pop(request_id, None)
+
+    def cancel(self, request_id: str) -> bool:
+        """إلغاء طلب: ينهي انتظاره فوراً، والتحميل نفسه يتوقف إن لم يبقَ له منتظر"""
+        event = self.active_downloads.get(request_id)
+        if event is None:
+            return False
+        event.set()
+        return True
+
+    def _abort_job(self, job: "DownloadJob"):
+        """إيقاف تحميل بلا منتظرين: في الطابور يُلغى مباشرة، والجاري يُنهى بالقوة بعد مهلة"""
+        if job.aborting or job.task is None or job.task.done():
+            return
+        job.aborting = True
+        worker_job_id = job.output_dir.name
+        if not self.pool.cancel(worker_job_id):
+            # لم يصل لعامل بعد (ينتظر مكاناً في الجدولة أو عاملاً متاحاً)
+            job.task.cancel()
+            return
+
+        def kill():
+            if not job.task.done() and not self.pool.kill(worker_job_id):
+                job.task.cancel()
+
+        asyncio.get_running_loop().call_later(CANCEL_GRACE_SECONDS, kill)
+
+    # ============ القبول قبل التحميل ============
+
+    def _choose_format(self, info: Optional[dict], video_id: Optional[str],
+                       format_type: str, quality: str) -> Optional[dict]:
+        """
+        None إذا كانت الجودة المطلوبة تناسب حد الرفع (أو لا تكفي البيانات للتقدير)،
+        وإلا أفضل صيغة أصغر تناسبه: {"format_id", "quality", "size"}.
+        يرفض التحميل قبل دفع تكلفته إن لم يناسب شيء.
+        """
+        if format_type != "video":
+            size = estimate_size(info, format_type, quality) if info else None
+            if size and size > MAX_FILE_SIZE:
+                raise FileTooLargeError(size, MAX_FILE_SIZE)
+            return None
+
+        entry = self._format_cache.get(video_id) if video_id else None
+        if entry and quality in entry["choices"]:
+            return entry["choices"][quality]
+
+        if info and info.get('formats'):
+            table = info
+            if video_id and entry is None:
+                entry = {"formats": format_table(info), "duration": info.get('duration'),
+                         "choices": {}}
+                self._format_cache.set(video_id, entry)
+        elif entry:
+            table = entry
+        else:
+            return None
+
+        choice = None
+        size = estimate_size(table, format_type, quality)
+        if size and size > MAX_FILE_SIZE:
+            fitted = fit_formats(table, quality, MAX_FILE_SIZE)
+            if not fitted:
+                raise FileTooLargeError(size, MAX_FILE_SIZE)
+            choice = {
+                "format_id": "+".join(f['format_id'] for f in fitted),
+                "quality": f"{fitted[0].get('height')}p",
+                "size": sum(format_filesize(f, table.get('duration')) for f in fitted),
+            }
+            logger.info(f"{video_id}: {quality} ~{size} bytes > limit, using {choice['format_id']}")
+        if entry is not None:
+            entry["choices"][quality] = choice
+        return choice
+
+    def _reserve_disk(self, info: Optional[dict], format_type: str, quality: str,
+                      choice: Optional[dict] = None) -> int:
+        """حجز المساحة المؤقتة المتوقعة أو رفض التحميل إن لم تكفِ (يعيد الحجم المحجوز)"""
+        if choice:
+            needed = choice["size"] * 2
+        else:
+            needed = (estimate_disk_usage(info, format_type, quality) if info else None) or 0
+        free = shutil.disk_usage(self.temp_dir).free
+        if free - self._reserved_bytes - needed < MIN_FREE_DISK_BYTES:
+            raise DownloadError("Not enough disk space", "no_space")
+        self._reserved_bytes += needed
+        return needed
+
+    @staticmethod
+    def _info_key(url: str) -> str:
+        return extract_video_id(url) or url
+
     async def extract_info(self, url: str) -> Optional[dict]:
-        loop = asyncio.get_event_loop()
+        cached = self._info_cache.get(self._info_key(url))
+        CACHE.inc(cache="info", result="miss" if cached is None else "hit")
+        if cached is not None:
+            return cached
+
         try:
-            with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-                return await loop.run_in_executor(
-                    None, 
-                    functools.partial(ydl.extract_info, url, download=False)
-                )
+            # العامل يعيد نسخة منقحة قابلة لإعادة الاستخدام في process_ie_result
+            info = await self.pool.submit(
+                "extract", url, {'quiet': True, 'playlistend': MAX_PLAYLIST_ITEMS}
+            )
+            if info:
+                self._info_cache.set(self._info_key(url), info)
+            return info
         except Exception as e:
             error_msg = str(e).lower()
             if "copyright" in error_msg:
@@ -83,90 +354,437 @@ class AdvancedDownloadManager:
     
     async def download(self, url: str, format_type: str, quality: str = "best",
                       cancel_event: asyncio.Event = None,
-                      progress_callback: Callable = None) -> Dict[str, Any]:
-        async with self._semaphore:
-            download_id = hashlib.md5(f"{url}{format_type}{quality}".encode()).hexdigest()[:8]
-            output_dir = self.temp_dir / download_id
-            output_dir.mkdir(exist_ok=True)
-            
-            def progress_hook(d):
+                      progress_callback: Callable = None,
+                      info: Optional[dict] = None,
+                      user_id: int = 0, priority: bool = False,
+                      job_name: Optional[str] = None) -> Dict[str, Any]:
+        """
+        progress_callback(event) تستقبل أحداث التقدم المجمعة:
+        queued (position) / downloading (percent, speed, eta) / processing (step)
+        job_name: اسم مجلد التحميل إن بدأ هذا الطلب تحميلاً جديداً (معرف سجل الطلب،
+        فيجد الطلب المستأنف ملفاته الجزئية)؛ وإلا اسم عشوائي
+        """
+        token = uuid.uuid4().hex[:8]
+        output_dir = self.temp_dir / token
+        video_id = extract_video_id(url)
+        variant = cache_variant(format_type, quality)
+
+        # الكاش مرة ثانية: قد يكون طلب متطابق اكتمل أثناء استخراج هذا الطلب
+        if video_id:
+            cached = self._from_cache(video_id, format_type, variant, output_dir)
+            CACHE.inc(cache="disk", result="hit" if cached else "miss")
+            if cached:
+                return cached
+
+        # طلبات متطابقة متزامنة تشترك في تحميل واحد
+        key = f"{video_id or url}:{format_type}:{variant}"
+        job = self._jobs.get(key)
+        if job is None:
+            info = info or self._info_cache.get(self._info_key(url))
+            choice = self._choose_format(info, video_id, format_type, quality)
+            # مجلد خاص بكل تحميل: المفتاح لدمج الطلبات فقط، فلا يتشارك تحميل يُلغى وتاليه مجلداً
+            job = DownloadJob(key, self.temp_dir / (job_name or uuid.uuid4().hex))
+            self._jobs[key] = job
+            job.task = asyncio.create_task(
+                self._run_job(job, url, format_type, quality, video_id, variant,
+                              info, choice, user_id, priority)
+            )
+            job.task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        job.subscribe(token, output_dir, progress_callback)
+
+        try:
+            result = await self._wait_job(job, token, cancel_event)
+        finally:
+            job.unsubscribe(token)
+            if job.cancelled:
+                self._forget_job(job)
+                self._abort_job(job)
+        self._handed_out.add(output_dir.name)
+        return result
+
+    def _from_cache(self, video_id: str, format_type: str, variant: str,
+                    output_dir: Path) -> Optional[Dict[str, Any]]:
+        cached = self.cache.get(video_id, format_type, variant, output_dir)
+        if not cached:
+            return None
+        self._handed_out.add(output_dir.name)
+        return {**cached, "success": True, "is_playlist": False, "cached": True,
+                "output_dir": str(output_dir)}
+
+    def cached_result(self, url: str, format_type: str, quality: str) -> Optional[Dict[str, Any]]:
+        """
+        نتيجة من كاش القرص قبل الاستخراج - بدون أي اتصال بالشبكة (None إن لم توجد).
+        الكاش يحفظ العنوان والمدة وبقية البيانات فلا حاجة لـ extract_info عند الإصابة؛
+        الإخفاق لا يُحسب هنا لأن download يتحقق مجدداً ويحسبه.
+        """
+        video_id = extract_video_id(url)
+        if not video_id:
+            return None
+        result = self._from_cache(video_id, format_type, cache_variant(format_type, quality),
+                                  self.temp_dir / uuid.uuid4().hex[:8])
+        if result:
+            CACHE.inc(cache="disk", result="hit")
+        return result
+
+    async def release(self, path: Optional[str]):
+        """حذف مجلد النتيجة (أو ملفها) بعد الإرسال وإنهاء حمايته من المنظف"""
+        if not path:
+            return
+        await cleanup_file(path)
+        self._handed_out.discard(Path(path).name)
+
+    def owned_dirs(self) -> set:
+        """
+        أسماء مجلدات التحميلات الجارية ونسخ طالبيها، والمجلدات التي أُعيدت ولم تُحرر بعد
+        (رفع طويل)، داخل temp_dir - لا يحذفها المنظف
+        """
+        dirs = set(self._handed_out)
+        for job in self._jobs.values():
+            dirs.add(job.output_dir.name)
+            dirs.update(sub["output_dir"].name for sub in job.subscribers.values())
+        return dirs
+
+    def _forget_job(self, job: "DownloadJob"):
+        """إزالة التحميل من قائمة الجاري حتى لا ينضم إليه طلب جديد"""
+        if self._jobs.get(job.key) is job:
+            del self._jobs[job.key]
+
+    async def iter_playlist(self, entries: List[dict], format_type: str, quality: str = "best",
+                            cancel_event: asyncio.Event = None,
+                            user_id: int = 0, priority: bool = False,
+                            concurrency: int = PLAYLIST_DOWNLOAD_CONCURRENCY
+                            ) -> AsyncIterator[Tuple[dict, Optional[dict], Optional[Exception]]]:
+        """
+        تحميل عناصر قائمة التشغيل بالتوازي وإرجاع كل عنصر فور اكتماله:
+        (entry, result, error) - العنصر الفاشل يُرجع مع الخطأ بدلاً من إيقاف القائمة
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch(entry: dict):
+            async with semaphore:
                 if cancel_event and cancel_event.is_set():
                     raise CancelledError()
-                
-                if d['status'] == 'downloading' and progress_callback:
-                    percent = d.get('_percent_str', '0%')
-                    speed = d.get('_speed_str', 'N/A')
-                    eta = d.get('_eta_str', 'N/A')
-                    asyncio.create_task(progress_callback(percent, speed, eta))
-            
-            try:
-                opts = self.get_ydl_opts(format_type, quality, str(output_dir), progress_hook)
-                loop = asyncio.get_event_loop()
-                
-                with yt_dlp.YoutubeDL(opts) as ydl:
-                    info = await loop.run_in_executor(
-                        None,
-                        functools.partial(ydl.extract_info, url, download=True)
+                entry_url = entry.get('webpage_url') or entry.get('url')
+                try:
+                    result = await self.download(
+                        entry_url, format_type, quality,
+                        cancel_event=cancel_event,
+                        # العناصر المستخرجة كاملة لا تحتاج استخراجاً ثانياً
+                        info=entry if entry.get('formats') else None,
+                        user_id=user_id, priority=priority
                     )
-                    
-                    if not info:
-                        raise DownloadError("Failed to extract info")
-                    
-                    if 'entries' in info:
-                        files = []
-                        entries = list(info['entries'])[:MAX_PLAYLIST_ITEMS]
-                        for entry in entries:
-                            if not entry:
-                                continue
-                            filename = ydl.prepare_filename(entry)
-                            if format_type == "audio":
-                                filename = filename.rsplit('.', 1)[0] + '.mp3'
-                            if os.path.exists(filename):
-                                files.append(filename)
-                        
-                        return {
-                            "success": True,
-                            "files": files,
-                            "is_playlist": True,
-                            "title": sanitize_filename(info.get("title", "Playlist")),
-                            "count": len(files)
-                        }
-                    else:
-                        filename = ydl.prepare_filename(info)
-                        if format_type == "audio":
-                            filename = filename.rsplit('.', 1)[0] + '.mp3'
-                        
-                        if not os.path.exists(filename):
-                            raise DownloadError("File not created")
-                        
-                        file_size = os.path.getsize(filename)
-                        if file_size > MAX_FILE_SIZE:
-                            os.remove(filename)
-                            raise FileTooLargeError(file_size, MAX_FILE_SIZE)
-                        
-                        return {
-                            "success": True,
-                            "file_path": filename,
-                            "title": sanitize_filename(info.get("title", "Unknown")),
-                            "duration": info.get("duration", 0),
-                            "uploader": info.get("uploader", "Unknown"),
-                            "thumbnail": info.get("thumbnail"),
-                            "is_playlist": False,
-                            "file_size": file_size
-                        }
-                        
-            except CancelledError:
-                import shutil
-                if output_dir.exists():
-                    shutil.rmtree(output_dir, ignore_errors=True)
+                    return entry, result, None
+                except (DownloadError, FileTooLargeError) as e:
+                    return entry, None, e
+
+        tasks = [asyncio.create_task(fetch(entry)) for entry in entries]
+        delivered = set()
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                entry, result, error = await next_done
+                if result:
+                    delivered.add(result["output_dir"])
+                yield entry, result, error
+        finally:
+            for task in tasks:
+                task.cancel()
+            # عناصر اكتمل تحميلها ولم تصل للمستدعي (إلغاء أو خطأ)
+            for task in tasks:
+                if task.done() and not task.cancelled() and not task.exception():
+                    result = task.result()[1]
+                    if result and result["output_dir"] not in delivered:
+                        await self.release(result["output_dir"])
+
+    async def _wait_job(self, job: "DownloadJob", token: str,
+                        cancel_event: asyncio.Event = None) -> Dict[str, Any]:
+        """انتظار التحميل المشترك أو إلغاء هذا الطلب فقط"""
+        if cancel_event is None:
+            await asyncio.shield(job.task)
+            return job.results[token]
+
+        cancel_wait = asyncio.create_task(cancel_event.wait())
+        try:
+            await asyncio.wait({job.task, cancel_wait}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            cancel_wait.cancel()
+
+        if job.task.done():
+            job.task.result()
+            return job.results[token]
+        raise CancelledError()
+
+    async def _run_job(self, job: "DownloadJob", url: str, format_type: str, quality: str,
+                       video_id: Optional[str], variant: str, info: Optional[dict],
+                       choice: Optional[dict], user_id: int, priority: bool) -> None:
+        output_dir = job.output_dir
+        worker_job_id = output_dir.name
+
+        def on_progress(d):
+            # يُستدعى على حلقة الأحداث عند وصول تقدم من العامل - يكتب آخر قيمة فقط
+            if job.cancelled:
+                return
+            if d['status'] == 'downloading':
+                total = d.get('total_bytes') or d.get('total_bytes_estimate')
+                downloaded = d.get('downloaded_bytes') or 0
+                job.progress.post(
+                    "downloading",
+                    percent=downloaded * 100 / total if total else 0,
+                    speed=d.get('speed'),
+                    eta=d.get('eta')
+                )
+            elif d['status'] == 'processing':
+                job.progress.post("processing", step=d.get('postprocessor'))
+
+        reserved = 0
+        queued_at = time.monotonic()
+        try:
+            async with self.scheduler.slot(user_id, priority, job.publish_position):
+                STAGE_SECONDS.observe(time.monotonic() - queued_at, stage="queue")
+                reserved = self._reserve_disk(info, format_type, quality, choice)
+                output_dir.mkdir(exist_ok=True)
+                with STAGE_SECONDS.time(stage="download"):
+                    info, raw = await self._fetch(output_dir, url, format_type, quality,
+                                                  worker_job_id, on_progress, info, choice)
+                BYTES.inc(downloaded_bytes(info), direction="download")
+            # مكان التحميل يُحرر هنا؛ المعالجة تنتظر دورها في مجموعة ffmpeg المستقلة
+            result = await self._finish(output_dir, info, raw, format_type, quality,
+                                        video_id, variant, on_progress, choice)
+        except BaseException as e:
+            self._reserved_bytes -= reserved
+            # يشمل إلغاء المهمة نفسها (asyncio) - المكان يُحرر والملفات الجزئية تُحذف
+            self._forget_job(job)
+            job.progress.close()
+            if output_dir.exists() and not self.stopping:
+                shutil.rmtree(output_dir, ignore_errors=True)
+            if not isinstance(e, Exception) or isinstance(
+                    e, (DownloadError, FileTooLargeError, CancelledError)):
                 raise
-            except Exception as e:
-                import shutil
-                if output_dir.exists():
-                    shutil.rmtree(output_dir, ignore_errors=True)
-                if isinstance(e, (DownloadError, FileTooLargeError, CancelledError)):
-                    raise
-                raise DownloadError(str(e), "unknown")
+            raise DownloadError(str(e), "unknown")
+
+        # توزيع نسخة خاصة لكل طلب ثم حذف مجلد التحميل المشترك
+        self._reserved_bytes -= reserved
+        self._forget_job(job)
+        job.progress.close()
+        try:
+            job.distribute(result)
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    @staticmethod
+    def _raw_formats(info: Optional[dict], format_type: str, quality: str,
+                     choice: Optional[dict]) -> Optional[List[dict]]:
+        """
+        الصيغ المطلوب تحميلها خاماً (بدون دمج أو تحويل داخل yt-dlp)،
+        أو None لتنفيذ كل شيء داخل العامل (بيانات غير كافية أو قائمة تشغيل)
+        """
+        if not info or 'entries' in info:
+            return None
+        if choice:
+            ids = choice["format_id"].split("+")
+            by_id = {f.get('format_id'): f for f in info.get('formats') or []}
+            chosen = [by_id[i] for i in ids if i in by_id]
+            return chosen if len(chosen) == len(ids) else None
+        chosen = select_formats(info, format_type, quality)
+        if not chosen or not all(f.get('format_id') for f in chosen):
+            return None
+        return chosen
+
+    async def _fetch(self, output_dir: Path, url: str, format_type: str, quality: str,
+                     worker_job_id: str, progress_callback: Callable,
+                     info: Optional[dict] = None,
+                     choice: Optional[dict] = None) -> Tuple[dict, bool]:
+        """مرحلة التحميل (شبكة) - يعيد (info, raw) حيث raw تعني أن المعالجة لم تتم بعد"""
+        raw = self._raw_formats(info, format_type, quality, choice)
+        if raw and PARALLEL_DOWNLOADS and all(
+                f.get('protocol') in ('http', 'https') and f.get('url') for f in raw):
+            return await self._fetch_ranged(output_dir, info, raw, format_type, quality,
+                                            worker_job_id, progress_callback), True
+        if raw:
+            opts = self.get_ydl_opts(
+                format_type, quality, str(output_dir / '%(title)s.f%(format_id)s.%(ext)s'),
+                raw_formats=",".join(f['format_id'] for f in raw)
+            )
+        else:
+            opts = self.get_ydl_opts(format_type, quality, str(output_dir / '%(title)s.%(ext)s'),
+                                     format_id=choice and choice["format_id"])
+
+        # إعادة استخدام البيانات المستخرجة مسبقاً بدون طلب الصفحة مرة ثانية
+        try:
+            info = await self.pool.submit(
+                "download", url, opts, info,
+                job_id=worker_job_id, progress_callback=progress_callback
+            )
+        except WorkerCancelled:
+            raise CancelledError()
+        except WorkerFailed as e:
+            raise DownloadError(e.message, "unknown")
+
+        if not info:
+            raise DownloadError("Failed to extract info")
+        return info, bool(raw)
+
+    async def _fetch_ranged(self, output_dir: Path, info: dict, raw: List[dict],
+                            format_type: str, quality: str, worker_job_id: str,
+                            progress_callback: Callable) -> dict:
+        """الصيغ التقدمية: تحميل مباشر بعدة نطاقات HTTP متوازية بدلاً من yt-dlp"""
+        name = info.get('id') or worker_job_id
+        parts = [{
+            'url': f['url'],
+            'headers': f.get('http_headers') or {},
+            'filepath': str(output_dir / f"{name}.f{f['format_id']}.{f.get('ext') or 'bin'}"),
+            # يوتيوب يبطئ الطلبات الأكبر من هذا الحجم
+            'chunk_size': (f.get('downloader_options') or {}).get('http_chunk_size'),
+            **{key: f.get(key) for key in ('format_id', 'ext', 'vcodec', 'acodec')},
+        } for f in raw]
+
+        thumbnail = None
+        if format_type == "audio" and info.get('thumbnail'):
+            ext = info['thumbnail'].split('?')[0].rpartition('.')[2] or 'jpg'
+            thumbnail = {'url': info['thumbnail'], 'filepath': str(output_dir / f"{name}.{ext}")}
+
+        options = {
+            'chunk_size': RANGE_CHUNK_SIZE,
+            'max_connections': RANGE_MAX_CONNECTIONS,
+            'min_size': RANGE_MIN_SIZE,
+        }
+        try:
+            result = await self.pool.submit(
+                "ranged", parts, options, thumbnail,
+                job_id=worker_job_id, progress_callback=progress_callback
+            )
+        except WorkerCancelled:
+            raise CancelledError()
+        except WorkerFailed as e:
+            raise DownloadError(e.message, "network")
+        return {**info, **result}
+
+    async def _postprocess(self, output_dir: Path, info: dict, format_type: str,
+                           quality: str, progress_callback: Callable) -> Tuple[str, float]:
+        """مرحلة المعالجة (معالج) في مجموعة ffmpeg المستقلة - يعيد (الملف النهائي، وقت المعالج)"""
+        parts = [d for d in info.get('requested_downloads') or []
+                 if d.get('filepath') and os.path.exists(d['filepath'])]
+        if not parts:
+            raise DownloadError("File not created")
+
+        base = output_dir / (sanitize_filename(info.get("title") or "") or info.get("id") or "media")
+        metadata = {
+            "title": info.get("title"),
+            "artist": info.get("uploader"),
+            "comment": info.get("webpage_url"),
+        }
+
+        if format_type == "video":
+            if len(parts) == 1:
+                # صيغة واحدة فيها الصوت والصورة - لا حاجة لـ ffmpeg
+                output = f"{base}.{parts[0].get('ext') or 'mp4'}"
+                os.replace(parts[0]['filepath'], output)
+                return output, 0.0
+            video = next((d for d in parts if d.get('vcodec') != 'none'), parts[0])
+            audio = next((d for d in parts if d is not video), parts[-1])
+            output, step = f"{base}.mp4", "Merger"
+            args = merge_args(video['filepath'], audio['filepath'], output)
+        elif audio_profile(quality) == AUDIO_MP3:
+            output, step = f"{base}.mp3", "ExtractAudio"
+            args = mp3_args(parts[0]['filepath'], output, metadata, MP3_BITRATE_KBPS,
+                            cover=written_thumbnail(info))
+        else:
+            output, step = f"{base}.{native_audio_ext(parts[0])}", "Metadata"
+            args = audio_copy_args(parts[0]['filepath'], output, metadata)
+
+        progress_callback({'status': 'processing', 'postprocessor': step})
+        with STAGE_SECONDS.time(stage="postprocess"):
+            cpu_time = await self.postprocessor.run(args)
+        for part in parts:
+            try:
+                os.remove(part['filepath'])
+            except OSError:
+                pass
+        return output, cpu_time
+
+    async def _finish(self, output_dir: Path, info: dict, raw: bool, format_type: str,
+                      quality: str, video_id: Optional[str], variant: str,
+                      progress_callback: Callable,
+                      choice: Optional[dict] = None) -> Dict[str, Any]:
+        if 'entries' in info:
+            files = []
+            entries = list(info['entries'])[:MAX_PLAYLIST_ITEMS]
+            for entry in entries:
+                if not entry:
+                    continue
+                files.extend(f for f in downloaded_files(entry) if os.path.exists(f))
+
+            return {
+                "success": True,
+                "files": files,
+                "is_playlist": True,
+                "title": sanitize_filename(info.get("title", "Playlist")),
+                "count": len(files)
+            }
+
+        cpu_time = info.get("cpu_time") or 0.0
+        if raw:
+            filename, postprocess_cpu = await self._postprocess(
+                output_dir, info, format_type, quality, progress_callback
+            )
+            cpu_time += postprocess_cpu
+        else:
+            filenames = downloaded_files(info)
+            if not filenames or not os.path.exists(filenames[0]):
+                raise DownloadError("File not created")
+            filename = filenames[0]
+
+        file_size = os.path.getsize(filename)
+        if file_size > MAX_FILE_SIZE:
+            os.remove(filename)
+            raise FileTooLargeError(file_size, MAX_FILE_SIZE)
+
+        thumbnail_path = written_thumbnail(info)
+        if thumbnail_path:
+            try:
+                self.thumbnails.set(video_id or info.get("id"), Path(thumbnail_path).read_bytes())
+            except OSError:
+                pass
+
+        JOB_CPU_SECONDS.observe(cpu_time, format=format_type)
+        logger.info(f"{video_id or info.get('id')}: {format_type}/{variant} done, "
+                    f"{file_size} bytes, cpu {cpu_time:.2f}s")
+
+        metadata = {
+            "title": sanitize_filename(info.get("title", "Unknown")),
+            "duration": info.get("duration", 0),
+            "uploader": info.get("uploader", "Unknown"),
+            "thumbnail": info.get("thumbnail"),
+            # الجودة الفعلية إن خُفضت لتناسب حد الرفع
+            "adapted_quality": choice and choice["quality"],
+        }
+        try:
+            self.cache.put(info.get("id") or video_id, format_type, variant,
+                           filename, metadata)
+        except OSError as e:
+            logger.warning(f"Cache store failed: {e}")
+
+        return {
+            "success": True,
+            "file_path": filename,
+            **metadata,
+            "is_playlist": False,
+            "file_size": file_size,
+            "cpu_time": round(cpu_time, 3)
+        }
+
+    async def start(self, warm_pool: bool = True):
+        """
+        تشغيل عمليات yt-dlp مسبقاً حتى تكون دافئة عند أول طلب، ومنظف المجلد المؤقت
+        (warm_pool=False: العمليات تبدأ عند أول استخدام فقط)
+        """
+        if warm_pool:
+            await self.pool.start()
+        self._janitor_task = asyncio.create_task(self.janitor.run())
 
+    async def shutdown(self):
+        self.stopping = True
+        if self._janitor_task:
+            self._janitor_task.cancel()
+        await self.pool.shutdown()
 
 dl_manager = AdvancedDownloadManager()
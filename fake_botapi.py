@@ -0,0 +1,201 @@
+"""
+خادم Bot API بديل للتجربة المحلية - يستقبل الرفع (multipart أو file://) ويسجله بدون تيليجرام
+
+التشغيل:
+    python fake_botapi.py --port 8081
+ثم تشغيل البوت مع BOT_API_URL=http://127.0.0.1:8081
+"""
+import os
+import time
+import uuid
+import json
+import asyncio
+import argparse
+import logging
+from itertools import count
+from urllib.parse import urlparse, unquote
+
+from aiohttp import web, BodyPartReader
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {
+    "id": 1000001,
+    "is_bot": True,
+    "first_name": "FakeBot",
+    "username": "fake_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+MEDIA_METHODS = {
+    "sendVideo": "video",
+    "sendAudio": "audio",
+    "sendDocument": "document",
+    "sendPhoto": "photo",
+}
+
+
+class FakeBotAPI:
+    def __init__(self, upload_delay: float = 0.0):
+        self.upload_delay = upload_delay
+        self.uploads = []
+        self.calls = {}
+        self._message_ids = count(1)
+
+    # ============ قراءة الطلب ============
+
+    async def _read_params(self, request: web.Request) -> dict:
+        """قراءة المعاملات وحساب حجم الملفات المرفوعة بدون تخزينها"""
+        params, files = {}, {}
+        content_type = request.content_type
+        if content_type == "multipart/form-data":
+            reader = await request.multipart()
+            async for part in reader:
+                if isinstance(part, BodyPartReader) and part.filename:
+                    size = 0
+                    while True:
+                        chunk = await part.read_chunk()
+                        if not chunk:
+                            break
+                        size += len(chunk)
+                    files[part.name] = {"filename": part.filename, "size": size}
+                else:
+                    params[part.name] = await part.text()
+        elif content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+
+        for key, value in list(params.items()):
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return {"params": params, "files": files}
+
+    @staticmethod
+    def _resolve_file(value, files: dict) -> dict:
+        """تحديد مصدر الملف: multipart أو مسار محلي أو file_id سابق"""
+        if isinstance(value, str) and value.startswith("attach://"):
+            value = value[len("attach://"):]
+        if isinstance(value, str) and value in files:
+            return {"source": "multipart", **files[value]}
+        if isinstance(value, str) and value.startswith("file://"):
+            path = unquote(urlparse(value).path)
+            return {
+                "source": "path",
+                "filename": os.path.basename(path),
+                "size": os.path.getsize(path) if os.path.exists(path) else -1,
+            }
+        return {"source": "file_id", "filename": None, "size": 0}
+
+    # ============ بناء الردود ============
+
+    def _message(self, chat_id, **extra) -> dict:
+        return {
+            "message_id": next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id or 0), "type": "private"},
+            "from": BOT_USER,
+            **extra,
+        }
+
+    @staticmethod
+    def _media(kind: str, size: int) -> dict:
+        media = {
+            "file_id": uuid.uuid4().hex,
+            "file_unique_id": uuid.uuid4().hex[:16],
+            "file_size": max(size, 0),
+        }
+        if kind == "video":
+            media.update({"width": 1280, "height": 720, "duration": 0})
+        elif kind == "audio":
+            media.update({"duration": 0})
+        elif kind == "photo":
+            return [{**media, "width": 320, "height": 180}]
+        return media
+
+    async def _send_media(self, method: str, params: dict, files: dict) -> dict:
+        kind = MEDIA_METHODS[method]
+        # الملف المرفوع مباشرة يأتي كجزء multipart باسم الحقل نفسه
+        upload = self._resolve_file(params.get(kind, kind), files)
+        if self.upload_delay and upload["source"] != "file_id":
+            await asyncio.sleep(self.upload_delay)
+        self.uploads.append({"method": method, "chat_id": params.get("chat_id"),
+                             "time": time.time(), **upload})
+        return self._message(params.get("chat_id"), caption=params.get("caption"),
+                             **{kind: self._media(kind, upload["size"])})
+
+    async def _send_media_group(self, params: dict, files: dict) -> list:
+        messages = []
+        for item in params.get("media") or []:
+            kind = item.get("type", "document")
+            upload = self._resolve_file(item.get("media"), files)
+            self.uploads.append({"method": "sendMediaGroup", "chat_id": params.get("chat_id"),
+                                 "time": time.time(), **upload})
+            messages.append(self._message(params.get("chat_id"),
+                                          **{kind: self._media(kind, upload["size"])}))
+        return messages
+
+    # ============ المعالج ============
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        data = await self._read_params(request)
+        params, files = data["params"], data["files"]
+
+        if method in MEDIA_METHODS:
+            result = await self._send_media(method, params, files)
+        elif method == "sendMediaGroup":
+            result = await self._send_media_group(params, files)
+        elif method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            await asyncio.sleep(min(float(params.get("timeout") or 0), 1))
+            result = []
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params.get("chat_id"), text=params.get("text", ""))
+        else:
+            # deleteMessage, answerCallbackQuery, sendChatAction, setWebhook, ...
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"calls": self.calls, "uploads": self.uploads})
+
+    def make_app(self) -> web.Application:
+        app = web.Application(client_max_size=4 * 1024 ** 3)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def start_fake_botapi(host: str = "127.0.0.1", port: int = 8081,
+                            upload_delay: float = 0.0):
+    """تشغيل الخادم داخل حلقة أحداث موجودة - يعيد (api, runner)"""
+    api = FakeBotAPI(upload_delay)
+    runner = web.AppRunner(api.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return api, runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Telegram Bot API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--upload-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    api = FakeBotAPI(args.upload_delay)
+    web.run_app(api.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+الصيغ - اختيار الصيغ من جدول yt-dlp وتقدير حجم الملف قبل التحميل
+"""
+from typing import Optional, List
+
+# معدل MP3 المستخدم في التحويل (يطابق preferredquality في get_ydl_opts)
+MP3_BITRATE_KBPS = 192
+
+# ملفات الصوت: native = المسار الأصلي (m4a/opus) بنسخ بدون ترميز، mp3 = تحويل صريح
+AUDIO_NATIVE = "native"
+AUDIO_MP3 = "mp3"
+
+
+def audio_profile(quality: str) -> str:
+    return AUDIO_MP3 if quality == AUDIO_MP3 else AUDIO_NATIVE
+
+
+def has_video(f: dict) -> bool:
+    return f.get('vcodec') != 'none'
+
+
+def has_audio(f: dict) -> bool:
+    return f.get('acodec') != 'none'
+
+
+def _last(formats: List[dict], predicate) -> Optional[dict]:
+    """yt-dlp يرتب الصيغ من الأسوأ للأفضل - الأفضل المطابق هو الأخير"""
+    for f in reversed(formats):
+        if predicate(f):
+            return f
+    return None
+
+
+def format_filesize(f: dict, duration: Optional[float]) -> Optional[int]:
+    """الحجم المعلن أو التقريبي، أو معدل البت × المدة"""
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return int(size)
+    tbr = f.get('tbr') or ((f.get('vbr') or 0) + (f.get('abr') or 0))
+    if tbr and duration:
+        # kbit/s -> بايت
+        return int(tbr * 125 * duration)
+    return None
+
+
+def select_formats(info: dict, format_type: str, quality: str = "best") -> List[dict]:
+    """الصيغ التي ستختارها سلسلة format في get_ydl_opts لهذا الفيديو"""
+    formats = info.get('formats') or []
+    if not formats:
+        return [info] if info.get('url') else []
+
+    if format_type == "audio":
+        audio_only = lambda f: has_audio(f) and not has_video(f)
+        # native: bestaudio[ext=m4a]/bestaudio/best - mp3: bestaudio/best
+        chosen = (audio_profile(quality) == AUDIO_NATIVE
+                  and _last(formats, lambda f: audio_only(f) and f.get('ext') == 'm4a')) \
+            or _last(formats, audio_only) \
+            or _last(formats, lambda f: has_audio(f) and has_video(f))
+        return [chosen] if chosen else []
+
+    height = None if quality == "best" else int(quality.rstrip('p'))
+
+    def within(f: dict) -> bool:
+        return height is None or (f.get('height') is not None and f['height'] <= height)
+
+    video = _last(formats, lambda f: has_video(f) and not has_audio(f)
+                  and f.get('ext') == 'mp4' and within(f))
+    audio = _last(formats, lambda f: has_audio(f) and not has_video(f) and f.get('ext') == 'm4a')
+    if video and audio:
+        return [video, audio]
+
+    combined = lambda f: has_video(f) and has_audio(f) and within(f)
+    if height is None:
+        chosen = _last(formats, lambda f: combined(f) and f.get('ext') == 'mp4') \
+            or _last(formats, combined)
+    else:
+        chosen = _last(formats, combined)
+    return [chosen] if chosen else []
+
+
+def _sources_size(info: dict, format_type: str, quality: str) -> Optional[int]:
+    chosen = select_formats(info, format_type, quality)
+    sizes = [format_filesize(f, info.get('duration')) for f in chosen]
+    if not sizes or None in sizes:
+        return None
+    return sum(sizes)
+
+
+def estimate_size(info: dict, format_type: str, quality: str = "best") -> Optional[int]:
+    """حجم الملف النهائي المتوقع، أو None إن لم تكفِ البيانات"""
+    if 'entries' in info:
+        return None
+    if format_type == "audio" and audio_profile(quality) == AUDIO_MP3 and info.get('duration'):
+        # MP3 يُعاد ترميزه بمعدل ثابت
+        return int(MP3_BITRATE_KBPS * 125 * info['duration'])
+    return _sources_size(info, format_type, quality)
+
+
+def estimate_disk_usage(info: dict, format_type: str, quality: str = "best") -> Optional[int]:
+    """أقصى مساحة مؤقتة: الملفات المحملة والناتج معاً أثناء الدمج أو التحويل"""
+    if 'entries' in info:
+        return None
+    sources = _sources_size(info, format_type, quality)
+    if sources is None:
+        return None
+    return sources + (estimate_size(info, format_type, quality) or sources)
+
+
+# الحقول اللازمة لقرارات الحجم فقط (بدون الروابط المؤقتة)
+TABLE_FIELDS = (
+    'format_id', 'ext', 'height', 'vcodec', 'acodec',
+    'filesize', 'filesize_approx', 'tbr', 'vbr', 'abr',
+)
+
+
+def format_table(info: dict) -> List[dict]:
+    """جدول صيغ مختصر يبقى صالحاً بعد انتهاء روابط التحميل"""
+    return [{key: f.get(key) for key in TABLE_FIELDS} for f in info.get('formats') or []]
+
+
+def fit_formats(info: dict, quality: str, max_size: int) -> Optional[List[dict]]:
+    """
+    أفضل صيغة فيديو (مع أفضل صوت إن كانت بدونه) بارتفاع لا يتجاوز المطلوب
+    وحجم متوقع تحت max_size؛ None إن لم يناسب شيء
+    """
+    formats = info.get('formats') or []
+    duration = info.get('duration')
+    height = None if quality == "best" else int(quality.rstrip('p'))
+    audio = _last(formats, lambda f: has_audio(f) and not has_video(f) and f.get('ext') == 'm4a') \
+        or _last(formats, lambda f: has_audio(f) and not has_video(f))
+
+    candidates = []
+    for f in formats:
+        if not has_video(f) or (height and (f.get('height') or 0) > height):
+            continue
+        combo = [f] if has_audio(f) else ([f, audio] if audio else None)
+        if not combo:
+            continue
+        sizes = [format_filesize(c, duration) for c in combo]
+        if None in sizes or sum(sizes) > max_size:
+            continue
+        # الأعلى ارتفاعاً ثم mp4 (دمج بدون إعادة ترميز) ثم الأعلى معدلاً
+        candidates.append(((f.get('height') or 0, f.get('ext') == 'mp4', sum(sizes)), combo))
+
+    if not candidates:
+        return None
+    return max(candidates, key=lambda c: c[0])[1]
@@ -0,0 +1,130 @@
+"""
+منظف المجلد المؤقت - يحذف مجلدات التحميل اليتيمة (أخطاء، إلغاء، انهيار) ويفرض حصة للحجم الكلي
+"""
+import os
+import time
+import shutil
+import asyncio
+import logging
+from pathlib import Path
+from typing import List, Set, Tuple
+
+from cache import DownloadCache
+from utils import format_size
+
+logger = logging.getLogger(__name__)
+
+
+def tree_size_and_mtime(path: Path) -> Tuple[int, float]:
+    """الحجم الكلي وآخر تعديل داخل المسار (ملف أو مجلد)"""
+    try:
+        stat = path.stat()
+    except OSError:
+        return 0, 0.0
+    if not path.is_dir():
+        return stat.st_size, stat.st_mtime
+
+    size, mtime = 0, stat.st_mtime
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                file_stat = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            size += file_stat.st_size
+            mtime = max(mtime, file_stat.st_mtime)
+    return size, mtime
+
+
+def remove_path(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path, ignore_errors=True)
+    else:
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class TempJanitor:
+    """
+    دورة كل interval ثانية:
+    1. حذف كل ما في temp_dir (عدا الكاش) مما لا يملكه تحميل جارٍ ولم يتغير منذ min_age
+    2. إن بقي الحجم الكلي فوق quota: إخلاء الكاش ثم اليتيم الأحدث (بعد upload_age على الأقل)
+    العمل على القرص كله في خيط منفصل حتى لا يوقف حلقة الأحداث.
+    """
+
+    def __init__(self, manager, temp_dir: Path, cache: DownloadCache, quota: int,
+                 min_age: float, upload_age: float, interval: float):
+        self.manager = manager
+        self.temp_dir = Path(temp_dir)
+        self.cache = cache
+        self.quota = quota
+        self.min_age = min_age
+        # أقصى مدة يبقى فيها ملف مُسلّم للرفع قبل حذفه من معالجه
+        self.upload_age = upload_age
+        self.interval = interval
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Janitor error: {e}", exc_info=True)
+
+    async def sweep(self) -> int:
+        """دورة واحدة - تعيد عدد البايتات المحررة"""
+        # لقطة المجلدات المملوكة على حلقة الأحداث قبل الانتقال للخيط
+        owned = self.manager.owned_dirs()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._sweep, owned)
+
+    def _orphans(self, owned: Set[str]) -> List[Tuple[float, int, Path]]:
+        """(آخر تعديل، الحجم، المسار) لكل مدخل لا يملكه تحميل جارٍ"""
+        orphans = []
+        for path in self.temp_dir.iterdir():
+            if path == self.cache.cache_dir or path.name in owned:
+                continue
+            size, mtime = tree_size_and_mtime(path)
+            orphans.append((mtime, size, path))
+        return orphans
+
+    def _sweep(self, owned: Set[str]) -> int:
+        now = time.time()
+        reclaimed, removed = 0, 0
+        remaining = []
+        for mtime, size, path in self._orphans(owned):
+            if now - mtime >= self.min_age:
+                remove_path(path)
+                reclaimed += size
+                removed += 1
+            else:
+                remaining.append((mtime, size, path))
+
+        owned_size = sum(
+            tree_size_and_mtime(self.temp_dir / name)[0] for name in owned
+        )
+        cache_size = self.cache.size()
+        total = owned_size + sum(size for _, size, _ in remaining) + cache_size
+        if total > self.quota:
+            # الكاش قابل لإعادة البناء - يُخلى أولاً
+            freed = self.cache.shrink(max(0, cache_size - (total - self.quota)))
+            reclaimed += freed
+            total -= freed
+            for mtime, size, path in sorted(remaining):
+                if total <= self.quota:
+                    break
+                if now - mtime < self.upload_age:
+                    continue
+                remove_path(path)
+                reclaimed += size
+                removed += 1
+                total -= size
+            if total > self.quota:
+                logger.warning(f"Temp dir over quota: {format_size(total)} > {format_size(self.quota)} "
+                               f"(held by active downloads)")
+
+        if reclaimed:
+            logger.info(f"🧹 Janitor removed {removed} orphaned entries, reclaimed {format_size(reclaimed)}")
+        return reclaimed
@@ -0,0 +1,247 @@
+"""
+طابور المهام الموزع - الواجهة تضيف المهام في Mongo، والعمال (download_worker.py) على أي خادم
+يحجزونها بحجز مؤقت يجددونه، ويرفعون الناتج لمحادثة التخزين لتعيد الواجهة إرساله بـ file_id
+"""
+import os
+import time
+import socket
+import asyncio
+import logging
+from typing import Callable, Dict, Any
+
+from config import (
+    JOB_LEASE_SECONDS, JOB_POLL_SECONDS, JOB_MAX_ATTEMPTS, MAX_FILE_SIZE, UPLOAD_TIMEOUT
+)
+from database import db
+from downloader import AdvancedDownloadManager, cache_variant, check_duration, dl_manager
+from exceptions import DownloadError, CancelledError, FileTooLargeError
+from metrics import STAGE_SECONDS, BYTES
+from utils import open_upload
+from validators import extract_video_id
+
+logger = logging.getLogger(__name__)
+
+# الحقول التي تعيدها المهمة للواجهة (مثل نتيجة dl_manager.download بدون المسارات المحلية)
+RESULT_FIELDS = ("title", "duration", "uploader", "thumbnail", "adapted_quality", "file_size", "cpu_time")
+
+
+def job_error(job: dict) -> Exception:
+    """تحويل خطأ المهمة المخزن إلى الاستثناء الذي كان سيرفعه التحميل المحلي"""
+    if job["status"] == "cancelled":
+        return CancelledError()
+    error = job.get("error") or {}
+    if error.get("type") == "too_large":
+        return FileTooLargeError(error.get("size") or 0, MAX_FILE_SIZE)
+    return DownloadError(error.get("message") or "Job failed", error.get("type") or "unknown")
+
+
+# ============ جهة الواجهة ============
+
+async def wait_job(job_id: str, cancel_event: asyncio.Event,
+                   progress_callback: Callable = None) -> Dict[str, Any]:
+    """
+    انتظار نتيجة مهمة (أضافتها db.enqueue_job) مع تمرير التقدم - نفس أحداث
+    dl_manager.download بالإضافة إلى uploading؛ النتيجة تحتوي file_id بدل file_path.
+    إيقاف الواجهة (إلغاء هذه المهمة أو dl_manager.stopping) لا يلغي المهمة في الطابور:
+    الاستئناف بعد إعادة التشغيل يرتبط بنفس job_id.
+    """
+    last_event = None
+    try:
+        while True:
+            try:
+                await asyncio.wait_for(cancel_event.wait(), JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            if cancel_event.is_set():
+                raise CancelledError()
+
+            job = await db.get_job(job_id)
+            if job is None:
+                raise DownloadError("Job expired", "unknown")
+            if job["status"] == "done":
+                return job["result"]
+            if job["status"] in ("failed", "cancelled"):
+                raise job_error(job)
+
+            event = job.get("progress")
+            if job["status"] == "queued":
+                event = {"stage": "queued", "position": await db.job_position(job)}
+            if event and event != last_event and progress_callback:
+                last_event = event
+                await progress_callback(event)
+    except asyncio.CancelledError:
+        raise
+    except BaseException:
+        # إلغاء من المستخدم أو خطأ في الواجهة: العامل يتوقف عند تجديد حجزه التالي
+        if cancel_event.is_set() or not dl_manager.stopping:
+            try:
+                await db.cancel_job(job_id)
+            except Exception as e:
+                logger.error(f"Job cancel error: {e}")
+        raise
+
+
+# ============ جهة العامل ============
+
+class JobWorker:
+    """
+    concurrency حلقات حجز متوازية؛ كل مهمة تُنفذ عبر AdvancedDownloadManager
+    (نفس الجدولة والكاش ودمج الطلبات المتطابقة) ثم تُرفع لمحادثة التخزين.
+    """
+
+    def __init__(self, bot, manager: AdvancedDownloadManager, storage_chat_id: int,
+                 concurrency: int, lease_seconds: int = JOB_LEASE_SECONDS,
+                 poll_seconds: float = JOB_POLL_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS):
+        self.bot = bot
+        self.manager = manager
+        self.storage_chat_id = storage_chat_id
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.max_attempts = max_attempts
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+    async def run(self, stop_event: asyncio.Event):
+        """العمل حتى stop_event؛ المهام الجارية تعود للطابور عند الإيقاف"""
+        loops = [asyncio.create_task(self._loop(stop_event)) for _ in range(self.concurrency)]
+        logger.info(f"Worker {self.worker_id} started ({self.concurrency} slots)")
+        try:
+            await stop_event.wait()
+        finally:
+            for task in loops:
+                task.cancel()
+            await asyncio.gather(*loops, return_exceptions=True)
+            logger.info(f"Worker {self.worker_id} stopped")
+
+    async def _loop(self, stop_event: asyncio.Event):
+        while not stop_event.is_set():
+            try:
+                job = await db.claim_job(self.worker_id, self.lease_seconds, self.max_attempts)
+            except Exception as e:
+                logger.error(f"Job claim error: {e}")
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(stop_event.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._process(job)
+
+    async def _heartbeat(self, job_id: str, state: dict):
+        """تجديد الحجز ونشر التقدم؛ فقدان المهمة أو طلب إلغائها يوقف التحميل"""
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                doc = await db.renew_job(job_id, self.worker_id, self.lease_seconds, state["progress"])
+            except Exception as e:
+                logger.warning(f"Lease renew error for {job_id}: {e}")
+                continue
+            if doc is None or doc.get("cancel_requested"):
+                logger.info(f"Job {job_id} cancelled or lost")
+                self.manager.cancel(job_id)
+                return
+
+    async def _process(self, job: dict):
+        job_id = job["_id"]
+        format_type = job["format"]
+        state = {"progress": None, "title": None}
+
+        async def on_progress(event):
+            # العنوان للواجهة (لا تستخرج البيانات بنفسها في هذا الوضع)
+            state["progress"] = {**event, "title": state["title"]}
+
+        cancel_event = self.manager.register_cancel(job_id)
+        heartbeat = asyncio.create_task(self._heartbeat(job_id, state))
+        result = None
+        logger.info(f"Job {job_id} claimed (attempt {job['attempts']}): {job['url']}")
+        try:
+            # كاش القرص أولاً بدون أي طلب لـ yt-dlp
+            result = self.manager.cached_result(job["url"], format_type, job["quality"])
+            if result is None:
+                # الاستخراج والتحقق من المدة هنا فقط، والبيانات تُمرر للتحميل بدون استخراج ثانٍ
+                with STAGE_SECONDS.time(stage="extract"):
+                    info = await self.manager.extract_info(job["url"])
+                if not info:
+                    raise DownloadError("Failed to get video info")
+                check_duration(info)
+                state["title"] = info.get("title")
+
+                result = await self.manager.download(
+                    job["url"], format_type, job["quality"],
+                    cancel_event=cancel_event,
+                    progress_callback=on_progress,
+                    info=info,
+                    user_id=job["user_id"],
+                    priority=job.get("priority", False)
+                )
+            if cancel_event.is_set():
+                raise CancelledError()
+            if result.get("is_playlist"):
+                # الواجهة تعالج قوائم التشغيل بنفسها
+                raise DownloadError("Playlists are not supported by workers", "unknown")
+
+            state["progress"] = {"stage": "uploading"}
+            file_id = await self._upload(result, format_type)
+            metadata = {field: result.get(field) for field in RESULT_FIELDS}
+
+            video_id = extract_video_id(job["url"])
+            if video_id:
+                await db.cache_file_id(video_id, format_type, cache_variant(format_type, job["quality"]),
+                                       file_id, metadata)
+            await db.finish_job(job_id, self.worker_id, "done", result={"file_id": file_id, **metadata})
+        except asyncio.CancelledError:
+            # إيقاف العامل: المهمة تعود للطابور لعامل آخر
+            await self._settle(db.release_job(job_id, self.worker_id))
+            raise
+        except CancelledError:
+            await self._settle(db.finish_job(job_id, self.worker_id, "cancelled"))
+        except FileTooLargeError as e:
+            await self._settle(db.finish_job(job_id, self.worker_id, "failed",
+                                             error={"type": "too_large", "size": e.size}))
+        except DownloadError as e:
+            await self._settle(db.finish_job(job_id, self.worker_id, "failed",
+                                             error={"type": e.error_type, "message": e.message}))
+        except Exception as e:
+            logger.error(f"Job {job_id} error: {e}", exc_info=True)
+            await self._settle(db.finish_job(job_id, self.worker_id, "failed",
+                                             error={"type": "unknown", "message": str(e)}))
+        finally:
+            heartbeat.cancel()
+            self.manager.unregister_cancel(job_id)
+            if result:
+                for path in result.get("files") or [result.get("output_dir") or result.get("file_path")]:
+                    await self.manager.release(path)
+
+    async def _settle(self, update):
+        """تحديث حالة المهمة دون أن يُخفي خطأ قاعدة البيانات الخطأ الأصلي"""
+        try:
+            await update
+        except Exception as e:
+            logger.error(f"Job state update error: {e}")
+
+    async def _upload(self, result: dict, format_type: str) -> str:
+        """رفع الملف لمحادثة التخزين وإرجاع file_id"""
+        started = time.monotonic()
+        with open_upload(result["file_path"]) as upload:
+            if format_type == "audio":
+                sent = await self.bot.send_audio(
+                    self.storage_chat_id, upload,
+                    title=result["title"],
+                    performer=result.get("uploader", "YouTube"),
+                    duration=result.get("duration"),
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
+                )
+            else:
+                sent = await self.bot.send_video(
+                    self.storage_chat_id, upload,
+                    supports_streaming=True,
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
+                )
+        STAGE_SECONDS.observe(time.monotonic() - started, stage="upload")
+        BYTES.inc(result["file_size"], direction="upload")
+
+        media = (sent.audio if format_type == "audio" else sent.video) or sent.document
+        return media.file_id
@@ -1,18 +1,18 @@
 """
 بوت تحميل يوتيوب - الإصدار النهائي
 """
-import os
+import time
+import signal
 import asyncio
 import logging
 import uuid
-from io import BytesIO
+from contextlib import ExitStack
 from datetime import datetime
 
 import aiohttp
-import aiofiles
 from telegram import (
     Update, InlineKeyboardButton, InlineKeyboardMarkup, 
-    BotCommand, InputFile
+    BotCommand, InputMediaAudio, InputMediaVideo
 )
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
@@ -21,13 +21,21 @@ from telegram.ext import (
 from telegram.constants import ParseMode, ChatAction
 from telegram.error import RetryAfter, BadRequest
 
-from config import TOKEN, WEBHOOK_URL, PORT, ADMIN_ID
+from config import (
+    TOKEN, WEBHOOK_URL, PORT, ADMIN_ID, BOT_API_URL, UPLOAD_TIMEOUT, HTTP_POOL_SIZE,
+    MAX_PLAYLIST_ITEMS, PLAYLIST_UPLOAD_CONCURRENCY, MEDIA_GROUP_SIZE,
+    METRICS_HOST, METRICS_PORT, JOB_QUEUE_MODE, JOB_MAX_ATTEMPTS, NODE_NAME,
+    NODE_NAME_PINNED, TEMP_DIR_PINNED, JOURNAL_STALE_SECONDS, JOURNAL_HEARTBEAT_SECONDS
+)
 from database import db
-from downloader import dl_manager
-from validators import validate_youtube_url
+from downloader import dl_manager, cache_variant, check_duration
+from jobqueue import wait_job
+from ratelimit import rate_limiter
+from validators import validate_youtube_url, extract_video_id
 from exceptions import DownloadError, CancelledError, FileTooLargeError
+from metrics import STAGE_SECONDS, REQUESTS, FAILURES, BYTES, CACHE, start_metrics_server
 from i18n import get_text
-from utils import cleanup_file, safe_edit_message, format_duration
+from utils import safe_edit_message, format_duration, format_size, open_upload
 
 # Logging
 logging.basicConfig(
@@ -39,8 +47,13 @@ logger = logging.getLogger(__name__)
 # States
 CHOOSING_FORMAT, CHOOSING_QUALITY, WAITING_URL, DOWNLOADING, ADMIN_MENU = range(5)
 
-# Active downloads for cancellation
-active_downloads = {}
+# مراحل التقدم -> حالات سجل الطلبات
+JOURNAL_STATES = {
+    "queued": "queued",
+    "downloading": "downloading",
+    "processing": "post-processing",
+    "uploading": "uploading",
+}
 
 
 async def post_init(app: Application):
@@ -51,6 +64,90 @@ async def post_init(app: Application):
     except Exception as e:
         logger.error(f"⚠️ Database init warning: {e}")
         # استمر حتى لو فشلت قاعدة البيانات
+    
+    # جلسة HTTP واحدة للتطبيق كله (اتصالات مستمرة بدل جلسة لكل طلب)
+    app.bot_data["http"] = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=30)
+    )
+    
+    # تسخين عمليات yt-dlp قبل أول طلب (في وضع الطابور يستخرج العمال ويحملون؛
+    # العمليات المحلية تبدأ عند أول قائمة تشغيل فقط)
+    await dl_manager.start(warm_pool=not JOB_QUEUE_MODE)
+    
+    try:
+        app.bot_data["metrics"] = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        logger.error(f"⚠️ Metrics server failed: {e}")
+    
+    # كتابة السجلات المؤجلة بالخلفية
+    db.writer.start()
+    
+    # كاش الحظر والصلاحيات يبقى متسقاً مع النسخ الأخرى
+    app.bot_data["access_watch"] = asyncio.create_task(db.watch_access_changes())
+    
+    if not NODE_NAME_PINNED or not TEMP_DIR_PINNED:
+        logger.warning(
+            "⚠️ NODE_NAME and TEMP_DIR should be set to a stable name and a persistent volume: "
+            f"otherwise interrupted downloads are picked up only after {JOURNAL_STALE_SECONDS}s "
+            "and restart from zero (a redeploy changes the hostname and the container temp dir)"
+        )
+    
+    # الطلبات التي قطعها الإيقاف السابق (بالخلفية حتى لا يتأخر بدء البوت)
+    app.bot_data["resume"] = asyncio.create_task(resume_downloads(app))
+    
+    # إشارات الإيقاف لنا لا لـ PTB: Application.stop ينتظر مهام المعالجات (block=False)
+    # قبل post_shutdown، فتُقطع التحميلات الجارية هنا قبل ذلك
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        loop.add_signal_handler(sig, begin_shutdown, app)
+
+
+def begin_shutdown(app: Application):
+    """
+    إشارة الإيقاف: الملفات الجزئية تبقى من الآن، والطلبات الجارية تُقطع فتبقى
+    غير مكتملة في السجل ليستأنفها التشغيل التالي، ثم يكمل PTB إيقافه المعتاد
+    """
+    logger.info("🛑 Stop signal received - interrupting running downloads")
+    dl_manager.stopping = True
+    for task in app.bot_data.get("requests", ()):
+        task.cancel()
+    app.stop_running()
+
+
+async def post_shutdown(app: Application):
+    """إيقاف البوت"""
+    # أولاً: الطلبات المقطوعة من الآن تبقى غير مكتملة في السجل لتُستأنف في التشغيل التالي
+    await dl_manager.shutdown()
+    for name in ("resume", "access_watch"):
+        task = app.bot_data.pop(name, None)
+        if task:
+            task.cancel()
+    session = app.bot_data.pop("http", None)
+    if session:
+        await session.close()
+    await db.writer.close()
+    metrics_runner = app.bot_data.pop("metrics", None)
+    if metrics_runner:
+        await metrics_runner.cleanup()
+
+
+async def get_thumbnail(bot_data: dict, video_id: str, url: str):
+    """الصورة المصغرة من الكاش (ملف التحميل أو جلب سابق) أو جلبها بالجلسة المشتركة"""
+    key = video_id or url
+    data = dl_manager.thumbnails.get(key)
+    if data is not None:
+        return data
+    
+    session = bot_data.get("http")
+    if not session or not url:
+        return None
+    async with session.get(url) as resp:
+        if resp.status != 200:
+            return None
+        data = await resp.read()
+    dl_manager.thumbnails.set(key, data)
+    return data
 
 
 def get_user_lang(update: Update) -> str:
@@ -84,7 +181,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"User update error: {e}")
     
     keyboard = [
-        [InlineKeyboardButton("🎵 " + "Audio MP3", callback_data="fmt_audio"),
+        [InlineKeyboardButton("🎵 " + "Audio", callback_data="fmt_audio"),
          InlineKeyboardButton("🎬 " + "Video MP4", callback_data="fmt_video")],
         [InlineKeyboardButton("📊 " + "My Stats", callback_data="my_stats")]
     ]
@@ -111,6 +208,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if data.startswith("fmt_"):
         format_type = data.replace("fmt_", "")
         context.user_data["format"] = format_type
+        context.user_data.pop("quality", None)
         
         if format_type == "video":
             keyboard = [
@@ -126,12 +224,16 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return CHOOSING_QUALITY
         else:
+            keyboard = [
+                [InlineKeyboardButton("⚡ Original (M4A/Opus)", callback_data="q_native")],
+                [InlineKeyboardButton("🎵 MP3 192k", callback_data="q_mp3")],
+                [InlineKeyboardButton("🔙 Back", callback_data="back_start")]
+            ]
             await safe_edit_message(
-                query,
-                get_text(lang, 'send_url'),
-                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="back_start")]])
+                query, "🎧 Choose audio format:",
+                InlineKeyboardMarkup(keyboard)
             )
-            return WAITING_URL
+            return CHOOSING_QUALITY
     
     elif data.startswith("q_"):
         quality = data.replace("q_", "")
@@ -169,176 +271,551 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     elif data.startswith("cancel_dl:"):
         download_id = data.split(":")[1]
-        if download_id in active_downloads:
-            active_downloads[download_id].set()
+        if dl_manager.cancel(download_id):
             await query.edit_message_text(get_text(lang, 'cancelled'))
         return ConversationHandler.END
     
     return ConversationHandler.END
 
 
+def video_caption(title: str, adapted_quality: str = None) -> str:
+    caption = f"🎬 {title}\n✅ Downloaded successfully"
+    if adapted_quality:
+        caption += f"\n📉 Quality: {adapted_quality} (requested quality exceeds the 2GB limit)"
+    return caption
+
+
+async def log_download(user_id: int, url: str, status: str, metadata: dict = None, error: str = None):
+    """تسجيل العملية في قاعدة البيانات مع قياس زمن الكتابة"""
+    with STAGE_SECONDS.time(stage="log"):
+        await db.log_download(user_id, url, status, metadata, error=error)
+
+
+async def send_media(message, format_type: str, media, meta: dict):
+    """إرسال الملف (file_id أو رفع) مع عنوانه؛ meta = title/uploader/duration/adapted_quality"""
+    if format_type == "audio":
+        return await message.reply_audio(
+            media,
+            title=meta.get("title"),
+            performer=meta.get("uploader", "YouTube"),
+            duration=meta.get("duration"),
+            caption="✅ Downloaded successfully"
+        )
+    return await message.reply_video(
+        media,
+        supports_streaming=True,
+        caption=video_caption(meta.get("title", ""), meta.get("adapted_quality"))
+    )
+
+
+async def send_cached_file(message, video_id: str, format_type: str, quality: str) -> bool:
+    """إعادة إرسال ملف سبق رفعه عبر file_id بدون تحميل أو رفع"""
+    try:
+        cached = await db.get_cached_file(video_id, format_type, quality)
+    except Exception as e:
+        logger.error(f"File cache lookup error: {e}")
+        return False
+    
+    CACHE.inc(cache="file_id", result="hit" if cached else "miss")
+    if not cached:
+        return False
+    
+    try:
+        await send_media(message, format_type, cached["file_id"], cached.get("metadata", {}))
+    except BadRequest as e:
+        # file_id لم يعد صالحاً - نحذفه ونكمل بالتحميل العادي
+        logger.warning(f"Stale file_id for {video_id}: {e}")
+        await db.drop_cached_file(video_id, format_type, quality)
+        return False
+    
+    await db.touch_cached_file(video_id, format_type, quality)
+    return True
+
+
+async def remember_file_id(sent_message, video_id: str, format_type: str, quality: str, metadata: dict):
+    """حفظ file_id الناتج عن الرفع"""
+    if not video_id or not sent_message:
+        return
+    media = (sent_message.audio if format_type == "audio" else sent_message.video) or sent_message.document
+    if not media:
+        return
+    try:
+        await db.cache_file_id(video_id, format_type, quality, media.file_id, metadata)
+    except Exception as e:
+        logger.error(f"File cache store error: {e}")
+
+
+async def send_playlist_batch(message, batch: list, format_type: str, total: int) -> list:
+    """إرسال مجموعة عناصر جاهزة: عنصر واحد كرسالة عادية أو حتى 10 كمجموعة وسائط"""
+    with ExitStack() as stack:
+        medias = []
+        for item in batch:
+            media = item.get("file_id") or stack.enter_context(
+                open_upload(item["file_path"], attach=len(batch) > 1)
+            )
+            caption = f"{'🎵' if format_type == 'audio' else '🎬'} {item['index']}/{total} {item['title']}"
+            medias.append((media, caption, item))
+        
+        if len(medias) == 1:
+            media, caption, item = medias[0]
+            if format_type == "audio":
+                sent = await message.reply_audio(
+                    media, caption=caption, title=item["title"],
+                    performer=item.get("uploader"), duration=item.get("duration")
+                )
+            else:
+                sent = await message.reply_video(media, caption=caption, supports_streaming=True)
+            return [sent]
+        
+        if format_type == "audio":
+            group = [
+                InputMediaAudio(media, caption=caption, title=item["title"],
+                                performer=item.get("uploader"), duration=item.get("duration"))
+                for media, caption, item in medias
+            ]
+        else:
+            group = [
+                InputMediaVideo(media, caption=caption, supports_streaming=True)
+                for media, caption, item in medias
+            ]
+        return list(await message.reply_media_group(group))
+
+
+async def deliver_playlist(message, processing_msg, keyboard: list, info: dict,
+                           format_type: str, quality: str, cancel_event: asyncio.Event,
+                           user_id: int, is_admin: bool) -> int:
+    """
+    خط إنتاج قائمة التشغيل: العناصر تُحمّل بالتوازي وكل عنصر يُرفع فور اكتماله
+    بينما تستمر بقية العناصر في التحميل. يعيد عدد العناصر المرسلة.
+    """
+    entries = [e for e in (info.get("entries") or []) if e][:MAX_PLAYLIST_ITEMS]
+    total = len(entries)
+    variant = cache_variant(format_type, quality)
+    ready = asyncio.Queue()
+    state = {"downloaded": 0, "sent": 0, "failed": 0}
+    
+    async def show_status():
+        try:
+            await processing_msg.edit_text(
+                f"📥 {info.get('title', 'Playlist')}\n"
+                f"⬇️ {state['downloaded']}/{total} | 📤 {state['sent']}/{total}"
+                + (f" | ❌ {state['failed']}" if state["failed"] else ""),
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except:
+            pass
+    
+    def as_item(index: int, entry: dict, **extra) -> dict:
+        return {
+            "index": index,
+            "video_id": entry.get("id"),
+            "title": entry.get("title", "Unknown"),
+            "uploader": entry.get("uploader"),
+            "duration": entry.get("duration"),
+            **extra
+        }
+    
+    async def produce():
+        """مرحلة التحميل: العناصر المرفوعة مسبقاً تُرسل بالـ file_id مباشرة"""
+        index_of = {id(entry): i for i, entry in enumerate(entries, 1)}
+        to_download = []
+        for index, entry in enumerate(entries, 1):
+            cached = None
+            if entry.get("id"):
+                try:
+                    cached = await db.get_cached_file(entry["id"], format_type, variant)
+                except Exception as e:
+                    logger.error(f"File cache lookup error: {e}")
+            if cached:
+                await ready.put(as_item(index, entry, file_id=cached["file_id"]))
+            else:
+                to_download.append(entry)
+        
+        async for entry, result, error in dl_manager.iter_playlist(
+            to_download, format_type, quality,
+            cancel_event=cancel_event, user_id=user_id, priority=is_admin
+        ):
+            if error:
+                logger.warning(f"Playlist item failed: {entry.get('id')}: {error}")
+                state["failed"] += 1
+                continue
+            state["downloaded"] += 1
+            await ready.put(as_item(
+                index_of[id(entry)], entry,
+                file_path=result["file_path"], output_dir=result["output_dir"]
+            ))
+            await show_status()
+    
+    async def upload():
+        """مرحلة الرفع: تجميع العناصر الجاهزة في مجموعات حتى 10"""
+        while True:
+            item = await ready.get()
+            if item is None:
+                return
+            batch = [item]
+            while len(batch) < MEDIA_GROUP_SIZE and not ready.empty():
+                item = ready.get_nowait()
+                if item is None:
+                    ready.put_nowait(None)
+                    break
+                batch.append(item)
+            
+            if cancel_event.is_set():
+                for item in batch:
+                    if item.get("output_dir"):
+                        await dl_manager.release(item["output_dir"])
+                continue
+            
+            try:
+                messages = await send_playlist_batch(message, batch, format_type, total)
+                state["sent"] += len(batch)
+                for item, sent in zip(batch, messages):
+                    if not item.get("file_id"):
+                        await remember_file_id(sent, item["video_id"], format_type, variant, {
+                            "title": item["title"],
+                            "uploader": item.get("uploader"),
+                            "duration": item.get("duration"),
+                        })
+            except Exception as e:
+                logger.error(f"Playlist upload error: {e}")
+                state["failed"] += len(batch)
+            finally:
+                for item in batch:
+                    if item.get("output_dir"):
+                        await dl_manager.release(item["output_dir"])
+            await show_status()
+    
+    uploaders = [asyncio.create_task(upload()) for _ in range(PLAYLIST_UPLOAD_CONCURRENCY)]
+    try:
+        await produce()
+    finally:
+        for _ in uploaders:
+            ready.put_nowait(None)
+        await asyncio.gather(*uploaders, return_exceptions=True)
+        # عناصر لم تُرفع (إلغاء أو خطأ)
+        while not ready.empty():
+            item = ready.get_nowait()
+            if item and item.get("output_dir"):
+                await dl_manager.release(item["output_dir"])
+    
+    return state["sent"]
+
+
 async def handle_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """معالجة الرابط"""
     url = update.message.text.strip()
     user_id = update.effective_user.id
     lang = get_user_lang(update)
     
-    # التحقق من Rate Limit
-    try:
-        if not await db.check_rate_limit(user_id):
-            await update.message.reply_text("⏳ Rate limit exceeded. Please wait.")
-            return WAITING_URL
-    except Exception as e:
-        logger.error(f"Rate limit check error: {e}")
-    
     # التحقق من الرابط
     if not validate_youtube_url(url):
         await update.message.reply_text("❌ Invalid YouTube URL")
         return WAITING_URL
     
+    # التحقق من Rate Limit (يحجز مكان الطلب عند قبوله)
+    with STAGE_SECONDS.time(stage="rate_limit"):
+        allowed = await rate_limiter.acquire(user_id)
+    if not allowed:
+        REQUESTS.inc(format=context.user_data.get("format", "video"), result="rate_limited")
+        await update.message.reply_text("⏳ Rate limit exceeded. Please wait.")
+        return WAITING_URL
+    
     format_type = context.user_data.get("format", "video")
     quality = context.user_data.get("quality", "best")
     
+    try:
+        journal_id = await db.journal_create(
+            NODE_NAME, user_id, update.effective_chat.id, url, format_type, quality
+        )
+    except Exception as e:
+        logger.error(f"Journal error: {e}")
+        journal_id = None
+    
+    await process_url(update.message, context.application.bot_data, url, user_id,
+                      format_type, quality, journal_id, lang=lang)
+    return ConversationHandler.END
+
+
+async def record_state(journal_id: str, state: str, **fields):
+    """تسجيل انتقال الحالة في سجل الطلبات (أخطاء السجل لا توقف التحميل)"""
+    if not journal_id:
+        return
+    try:
+        await db.journal_state(journal_id, state, **fields)
+    except Exception as e:
+        logger.error(f"Journal error: {e}")
+
+
+async def process_url(message, bot_data: dict, url: str, user_id: int, format_type: str,
+                      quality: str, journal_id: str = None, job_id: str = None, lang: str = None):
+    """
+    تنفيذ الطلب حتى الإرسال - من handle_url أو من الاستئناف بعد إعادة التشغيل
+    (message = الرسالة التي يُرد عليها بالملف)
+    """
     # إنشاء معرف للإلغاء
     download_id = str(uuid.uuid4())[:8]
-    cancel_event = asyncio.Event()
-    active_downloads[download_id] = cancel_event
+    cancel_event = dl_manager.register_cancel(download_id)
     
     # رسالة مع زر إلغاء
     keyboard = [[InlineKeyboardButton("❌ Cancel", callback_data=f"cancel_dl:{download_id}")]]
-    processing_msg = await update.message.reply_text(
+    processing_msg = await message.reply_text(
         "⏳ Preparing download...",
         reply_markup=InlineKeyboardMarkup(keyboard)
     )
     
+    video_id = extract_video_id(url)
+    variant = cache_variant(format_type, quality)
+    # الحالة النهائية في السجل؛ تبقى None عند إيقاف البوت ليُستأنف الطلب لاحقاً
+    outcome = None
+    result = None
+    # الطلبات الجارية يقطعها begin_shutdown عند الإيقاف
+    requests = bot_data.setdefault("requests", set())
+    requests.add(asyncio.current_task())
+    
     try:
-        # استخراج المعلومات
-        info = await dl_manager.extract_info(url)
-        if not info:
-            await processing_msg.edit_text("❌ Failed to get video info")
-            return ConversationHandler.END
-        
-        # التحقق من المدة
-        duration_min = info.get('duration', 0) / 60
-        if duration_min > 120:
-            await processing_msg.edit_text(f"❌ Video too long ({int(duration_min)} min). Max: 120 min.")
-            return ConversationHandler.END
+        # ملف سبق رفعه - إعادة إرسال file_id مباشرة
+        if video_id and await send_cached_file(message, video_id, format_type, variant):
+            outcome = "done"
+            await processing_msg.delete()
+            REQUESTS.inc(format=format_type, result="cached")
+            await log_download(user_id, url, "success", {"format": format_type, "cached": True})
+            return
         
-        title = info.get('title', 'Unknown')
+        # وضع الطابور: العامل يستخرج المعلومات ويتحقق من المدة (قوائم التشغيل تبقى محلية)
+        remote = JOB_QUEUE_MODE and video_id
+        # كاش القرص قبل الاستخراج: الإصابة تُرسل بدون أي طلب لـ yt-dlp
+        result = None if remote else dl_manager.cached_result(url, format_type, quality)
+        info = None
+        if not remote and result is None:
+            # استخراج المعلومات
+            await record_state(journal_id, "extracting")
+            with STAGE_SECONDS.time(stage="extract"):
+                info = await dl_manager.extract_info(url)
+            if not info:
+                outcome = "failed"
+                await processing_msg.edit_text("❌ Failed to get video info")
+                return
+            
+            # التحقق من المدة
+            check_duration(info)
         
-        # دالة تحديث التقدم
-        last_update = [0]
-        async def progress(percent, speed, eta):
-            current = int(percent.replace('%', '').strip() or 0)
-            if current - last_update[0] >= 10:
-                last_update[0] = current
-                try:
-                    await processing_msg.edit_text(
-                        f"⏳ Downloading: {title}\n{percent} | {speed} | {eta}",
-                        reply_markup=InlineKeyboardMarkup(keyboard)
-                    )
-                except:
-                    pass
+        if info:
+            title = info.get('title', 'Unknown')
+        else:
+            title = result["title"] if result else url
         
-        # التحميل
-        result = await dl_manager.download(
-            url, format_type, quality,
-            cancel_event=cancel_event,
-            progress_callback=progress
-        )
+        try:
+            is_admin = await db.is_admin(user_id)
+        except Exception as e:
+            logger.error(f"Admin check error: {e}")
+            is_admin = False
         
-        if cancel_event.is_set():
+        # قائمة تشغيل: تحميل ورفع متوازيان
+        if info and (info.get('_type') == 'playlist' or 'entries' in info):
+            await record_state(journal_id, "downloading")
+            await processing_msg.edit_text(f"📥 {title}", reply_markup=InlineKeyboardMarkup(keyboard))
+            sent_count = await deliver_playlist(
+                message, processing_msg, keyboard, info, format_type, quality,
+                cancel_event, user_id, is_admin
+            )
+            if cancel_event.is_set():
+                raise CancelledError()
+            outcome = "done"
+            REQUESTS.inc(format=format_type, result="playlist")
+            await log_download(user_id, url, "success_playlist", {"count": sent_count})
             await processing_msg.delete()
-            return ConversationHandler.END
+            return
         
-        # إرسال الملف
-        await processing_msg.edit_text("📤 Sending file...")
+        journal_stage = {"state": None}
+        default_title = title
         
-        if result.get("is_playlist"):
-            # قائمة التشغيل
-            for i, file_path in enumerate(result["files"], 1):
-                if cancel_event.is_set():
-                    break
-                
-                async with aiofiles.open(file_path, 'rb') as f:
-                    data = await f.read()
-                
-                if format_type == "audio":
-                    await update.message.reply_audio(BytesIO(data), caption=f"🎵 {i}/{result['count']}")
-                else:
-                    await update.message.reply_video(BytesIO(data), supports_streaming=True)
-                
-                await cleanup_file(file_path)
-                await asyncio.sleep(1)
-            
-            await db.log_download(user_id, url, "success_playlist", {"count": len(result["files"])})
-        else:
-            # ملف واحد
-            file_path = result["file_path"]
-            
-            # إرسال الصورة المصغرة للصوت
-            if result.get('thumbnail') and format_type == "audio":
-                try:
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(result['thumbnail']) as resp:
-                            if resp.status == 200:
-                                await update.message.reply_photo(await resp.read())
-                except:
-                    pass
-            
-            # إرسال الملف
-            async with aiofiles.open(file_path, 'rb') as f:
-                file_data = await f.read()
-            
-            file_obj = BytesIO(file_data)
-            file_obj.name = os.path.basename(file_path)
+        # دالة تحديث التقدم (الأحداث تصل مجمعة ومحدودة المعدل من قناة التقدم)
+        async def progress(event):
+            state = JOURNAL_STATES.get(event["stage"])
+            if state and state != journal_stage["state"]:
+                journal_stage["state"] = state
+                await record_state(journal_id, state)
             
-            if format_type == "audio":
-                await update.message.reply_audio(
-                    InputFile(file_obj),
-                    title=result["title"],
-                    performer=result.get("uploader", "YouTube"),
-                    duration=result.get("duration"),
-                    caption="✅ Downloaded successfully"
+            # أحداث العامل تحمل العنوان الذي استخرجه
+            title = event.get("title") or default_title
+            if event["stage"] == "queued":
+                text = f"⏳ Preparing download...\n👥 Position in queue: {event['position']}"
+            elif event["stage"] == "downloading":
+                text = (
+                    f"⏳ Downloading: {title}\n{event['percent']:.0f}% | "
+                    f"{format_size(event.get('speed'))}/s | {format_duration(int(event.get('eta') or 0))}"
                 )
+            elif event["stage"] == "uploading":
+                text = f"📤 Sending file: {title}"
             else:
-                await update.message.reply_video(
-                    InputFile(file_obj),
-                    supports_streaming=True,
-                    caption=f"🎬 {result['title']}\n✅ Downloaded successfully"
-                )
-            
-            await db.log_download(
-                user_id, url, "success",
-                {"title": result["title"], "size": result["file_size"], "format": format_type}
+                text = f"⚙️ Processing: {title}"
+            try:
+                await processing_msg.edit_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
+            except:
+                pass
+        
+        # التحميل (إلا عند إصابة الكاش): محلياً، أو عبر عامل يرفع الملف لمحادثة التخزين ويعيد file_id
+        if remote:
+            if not job_id:
+                job_id = await db.enqueue_job(user_id, url, format_type, quality, is_admin)
+                await record_state(journal_id, "queued", job_id=job_id)
+            result = await wait_job(job_id, cancel_event, progress_callback=progress)
+        elif result is None:
+            result = await dl_manager.download(
+                url, format_type, quality,
+                cancel_event=cancel_event,
+                progress_callback=progress,
+                info=info,
+                user_id=user_id,
+                priority=is_admin,
+                job_name=journal_id
             )
+        
+        if cancel_event.is_set():
+            raise CancelledError()
+        
+        # إرسال الملف
+        await record_state(journal_id, "uploading")
+        await processing_msg.edit_text("📤 Sending file...")
+        
+        # إرسال الصورة المصغرة للصوت
+        if result.get('thumbnail') and format_type == "audio":
+            try:
+                thumbnail = await get_thumbnail(bot_data, video_id, result['thumbnail'])
+                if thumbnail:
+                    await message.reply_photo(thumbnail)
+            except Exception as e:
+                logger.warning(f"Thumbnail error: {e}")
+        
+        if result.get("file_id"):
+            # رفعه العامل مسبقاً - إعادة إرسال فقط
+            await send_media(message, format_type, result["file_id"], result)
+        else:
+            # إرسال الملف (بالتدفق من القرص)
+            upload_started = time.monotonic()
+            with open_upload(result["file_path"]) as upload:
+                sent = await send_media(message, format_type, upload, result)
+            STAGE_SECONDS.observe(time.monotonic() - upload_started, stage="upload")
+            BYTES.inc(result["file_size"], direction="upload")
             
-            await cleanup_file(file_path)
+            await remember_file_id(sent, video_id, format_type, variant, {
+                "title": result["title"],
+                "uploader": result.get("uploader"),
+                "duration": result.get("duration"),
+                "adapted_quality": result.get("adapted_quality"),
+            })
+        
+        outcome = "done"
+        REQUESTS.inc(format=format_type, result="success")
+        await log_download(
+            user_id, url, "success",
+            {"title": result["title"], "size": result["file_size"], "format": format_type,
+             "quality": variant, "cpu_time": result.get("cpu_time")}
+        )
         
         await processing_msg.delete()
         
     except CancelledError:
-        await processing_msg.edit_text("❌ Cancelled")
-    except FileTooLargeError:
-        await processing_msg.edit_text("❌ File too large (>2GB)")
-        await db.log_download(user_id, url, "failed", error="File too large")
+        outcome = "cancelled"
+        REQUESTS.inc(format=format_type, result="cancelled")
+        # زر الإلغاء عدّل الرسالة بنفسه (تعديلها بنفس النص يرفع BadRequest)
+        if not cancel_event.is_set():
+            await processing_msg.edit_text(get_text(lang, 'cancelled'))
+    except FileTooLargeError as e:
+        outcome = "failed"
+        REQUESTS.inc(format=format_type, result="too_large")
+        FAILURES.inc(error_type="too_large")
+        await processing_msg.edit_text(f"❌ File too large ({format_size(e.size)} > 2GB)")
+        await log_download(user_id, url, "failed", error="File too large")
     except DownloadError as e:
+        outcome = "failed"
         error_msg = {
             "copyright": "❌ Copyright protected",
             "private": "🔒 Private video",
             "unavailable": "📛 Not available in your region",
-            "network": "🌐 Network error"
+            "network": "🌐 Network error",
+            "no_space": "💾 Server is busy, please try again later",
+            "too_long": f"❌ {e.message}"
         }.get(e.error_type, f"❌ Error: {e.message}")
+        REQUESTS.inc(format=format_type, result="failed")
+        FAILURES.inc(error_type=e.error_type)
         await processing_msg.edit_text(error_msg)
-        await db.log_download(user_id, url, "failed", error=e.message)
+        await log_download(user_id, url, "failed", error=e.message)
     except Exception as e:
+        outcome = "failed"
         logger.error(f"Download error: {e}", exc_info=True)
+        REQUESTS.inc(format=format_type, result="error")
+        FAILURES.inc(error_type="internal")
         await processing_msg.edit_text("❌ Unexpected error occurred")
-        await db.log_download(user_id, url, "error", error=str(e))
+        await log_download(user_id, url, "error", error=str(e))
     finally:
-        active_downloads.pop(download_id, None)
+        requests.discard(asyncio.current_task())
+        dl_manager.unregister_cancel(download_id)
+        # الملف المحلي (أُرسل، أو أُلغي الطلب أو فشل الإرسال بعد اكتمال التحميل)
+        if result and result.get("file_path"):
+            await dl_manager.release(result.get("output_dir") or result["file_path"])
+        if outcome and not dl_manager.stopping:
+            await record_state(journal_id, outcome)
+
+
+async def resume_downloads(app: Application):
+    """
+    استئناف طلبات هذا الخادم التي قطعها إيقاف أو انهيار سابق، ثم تجديد طلباته في السجل
+    دورياً وتبني طلبات الخوادم التي توقفت عن التجديد (انهارت أو تغير اسمها بإعادة النشر)
+    """
+    try:
+        await db.journal_touch(NODE_NAME)
+        entries = await db.journal_unfinished(NODE_NAME)
+    except Exception as e:
+        logger.error(f"Journal load error: {e}")
+        entries = []
     
-    return ConversationHandler.END
+    resumed = set()
+    while True:
+        if entries:
+            logger.info(f"🔄 Resuming {len(entries)} interrupted downloads")
+        for entry in entries:
+            task = asyncio.create_task(resume_entry(app, entry))
+            resumed.add(task)
+            task.add_done_callback(resumed.discard)
+        
+        await asyncio.sleep(JOURNAL_HEARTBEAT_SECONDS)
+        try:
+            await db.journal_touch(NODE_NAME)
+            entries = await db.journal_adopt(NODE_NAME, JOURNAL_STALE_SECONDS)
+        except Exception as e:
+            logger.error(f"Journal heartbeat error: {e}")
+            entries = []
+
+
+async def resume_entry(app: Application, entry: dict):
+    """إعادة تشغيل طلب من السجل مع إشعار صاحبه"""
+    # طلب يُسقط البوت في كل مرة لا يُعاد بلا نهاية
+    if entry.get("resumes", 0) >= JOB_MAX_ATTEMPTS:
+        await record_state(entry["_id"], "abandoned")
+        try:
+            await app.bot.send_message(entry["chat_id"], f"❌ Download could not be resumed:\n{entry['url']}")
+        except Exception as e:
+            logger.warning(f"Resume notify error: {e}")
+        return
+    try:
+        await db.journal_resumed(entry["_id"])
+        notice = await app.bot.send_message(
+            entry["chat_id"], f"🔄 The bot was restarted - resuming your download:\n{entry['url']}"
+        )
+    except Exception as e:
+        logger.warning(f"Resume notify error: {e}")
+        await record_state(entry["_id"], "abandoned")
+        return
+    await process_url(
+        notice, app.bot_data, entry["url"], entry["user_id"], entry["format"],
+        entry["quality"], entry["_id"], entry.get("job_id")
+    )
+
+
+async def download_in_progress(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """رسالة من المستخدم أثناء تحميل طلبه السابق (المحادثة تنتظر انتهاء handle_url)"""
+    await update.message.reply_text("⏳ Please wait for the current download to finish.")
 
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -352,14 +829,28 @@ def main():
         logger.error("No BOT_TOKEN provided!")
         return
     
-    application = (
+    builder = (
         Application.builder()
         .token(TOKEN)
         .post_init(post_init)
+        .post_shutdown(post_shutdown)
         .rate_limiter(AIORateLimiter(max_retries=3))
-        .build()
     )
     
+    if BOT_API_URL:
+        # خادم Bot API محلي: الملفات تُمرر بالمسار والخادم يتولى الرفع
+        builder = (
+            builder
+            .base_url(f"{BOT_API_URL}/bot")
+            .base_file_url(f"{BOT_API_URL}/file/bot")
+            .local_mode(True)
+            .read_timeout(UPLOAD_TIMEOUT)
+            .write_timeout(UPLOAD_TIMEOUT)
+        )
+        logger.info(f"Using local Bot API server: {BOT_API_URL}")
+    
+    application = builder.build()
+    
     conv_handler = ConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
@@ -371,9 +862,14 @@ def main():
                 CallbackQueryHandler(button_handler, pattern="^back_start")
             ],
             WAITING_URL: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_url),
+                # بدون حجب: التحميل لا يوقف معالجة تحديثات بقية المستخدمين (ولا زر الإلغاء)
+                MessageHandler(filters.TEXT & ~filters.COMMAND, handle_url, block=False),
                 CallbackQueryHandler(button_handler, pattern="^cancel_dl:")
             ],
+            # أثناء handle_url: زر الإلغاء يصل للمعالج العام أدناه
+            ConversationHandler.WAITING: [
+                MessageHandler(filters.TEXT, download_in_progress)
+            ],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
         per_message=False,
@@ -382,6 +878,8 @@ def main():
     )
     
     application.add_handler(conv_handler)
+    # زر الإلغاء لطلبات مستأنفة بعد إعادة التشغيل (خارج أي محادثة)
+    application.add_handler(CallbackQueryHandler(button_handler, pattern="^cancel_dl:"))
     
     async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Exception: {context.error}", exc_info=True)
@@ -393,12 +891,15 @@ def main():
             listen="0.0.0.0",
             port=PORT,
             webhook_url=WEBHOOK_URL,
-            allowed_updates=Update.ALL_TYPES
+            allowed_updates=Update.ALL_TYPES,
+            # الإشارات يسجلها post_init (begin_shutdown)
+            stop_signals=None
         )
     else:
         application.run_polling(
             allowed_updates=Update.ALL_TYPES, 
-            drop_pending_updates=True
+            drop_pending_updates=True,
+            stop_signals=None
         )
 
 
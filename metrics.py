@@ -0,0 +1,209 @@
+"""
+المقاييس - عدادات ومقاييس لحظية ومدرجات زمنية بصيغة Prometheus النصية على منفذ محلي
+"""
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, float("inf"))
+
+_metrics: List["_Metric"] = []
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                    for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    """قيمة لحظية؛ set_function تحسب القيمة عند القراءة (طول الطابور مثلاً)"""
+    kind = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float], **labels):
+        self._functions[self._key(labels)] = function
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            values = dict(self._values)
+        for key, function in self._functions.items():
+            try:
+                values[key] = function()
+            except Exception as e:
+                logger.error(f"Gauge {self.name} callback error: {e}")
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+                for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        if self.buckets[-1] != float("inf"):
+            self.buckets += (float("inf"),)
+        # لكل مجموعة تسميات: (عدد كل فئة، المجموع)
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, _ = self._values.setdefault(key, [[0] * len(self.buckets), 0.0])
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key][1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """قياس مدة الكتلة (تُسجل حتى عند الاستثناء)"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, **labels)
+
+    def _samples(self) -> List[str]:
+        lines = []
+        with self._lock:
+            items = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _metrics) + "\n"
+
+
+# ============ مقاييس البوت ============
+
+STAGE_SECONDS = Histogram(
+    "ytbot_stage_seconds", "Time spent per request stage",
+    ["stage"]
+)
+REQUESTS = Counter(
+    "ytbot_requests_total", "Download requests by format and outcome",
+    ["format", "result"]
+)
+FAILURES = Counter(
+    "ytbot_failures_total", "Failed downloads by DownloadError.error_type",
+    ["error_type"]
+)
+BYTES = Counter(
+    "ytbot_bytes_total", "Bytes downloaded from sources and uploaded to Telegram",
+    ["direction"]
+)
+CACHE = Counter(
+    "ytbot_cache_total", "Cache lookups by cache and result",
+    ["cache", "result"]
+)
+JOB_CPU_SECONDS = Histogram(
+    "ytbot_job_cpu_seconds", "CPU time per download job (worker + ffmpeg)",
+    ["format"], buckets=(0.1, 0.5, 1, 2, 5, 10, 30, 60, 120, float("inf"))
+)
+QUEUE_DEPTH = Gauge(
+    "ytbot_queue_depth", "Jobs waiting per stage",
+    ["stage"]
+)
+ACTIVE_JOBS = Gauge(
+    "ytbot_active_jobs", "Jobs running per stage",
+    ["stage"]
+)
+
+
+# ============ الخادم ============
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    """تشغيل /metrics داخل حلقة الأحداث الحالية (port=0 يعطله)"""
+    if not port:
+        return None
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics on http://{host}:{port}/metrics")
+    return runner
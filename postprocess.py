@@ -0,0 +1,136 @@
+"""
+مرحلة المعالجة - دمج وتحويل ffmpeg في مجموعة محدودة منفصلة عن مرحلة التحميل
+"""
+import os
+import re
+import signal
+import shutil
+import asyncio
+import logging
+from typing import Optional, List, Dict
+
+from exceptions import DownloadError
+
+logger = logging.getLogger(__name__)
+
+BENCH_PATTERN = re.compile(r"bench: utime=([\d.]+)s stime=([\d.]+)s")
+
+# امتداد الحاوية لنسخ مسار الصوت كما هو بدون ترميز
+NATIVE_AUDIO_EXT = {
+    "m4a": "m4a",
+    "mp4": "m4a",
+    "mp3": "mp3",
+    "ogg": "ogg",
+    "opus": "opus",
+}
+
+
+def native_audio_ext(fmt: dict) -> str:
+    ext = fmt.get("ext") or ""
+    if ext == "webm":
+        return "opus" if (fmt.get("acodec") or "").startswith("opus") else "ogg"
+    return NATIVE_AUDIO_EXT.get(ext, ext or "mka")
+
+
+def metadata_args(metadata: Dict[str, Optional[str]]) -> List[str]:
+    args = []
+    for key, value in metadata.items():
+        if value:
+            args += ["-metadata", f"{key}={value}"]
+    return args
+
+
+def merge_args(video: str, audio: str, output: str) -> List[str]:
+    """دمج فيديو وصوت منفصلين في mp4 بالنسخ فقط"""
+    return [
+        "-i", video, "-i", audio,
+        "-map", "0:v:0", "-map", "1:a:0",
+        "-c", "copy", "-movflags", "+faststart",
+        output,
+    ]
+
+
+def audio_copy_args(source: str, output: str, metadata: dict) -> List[str]:
+    """المسار الأصلي كما هو مع البيانات الوصفية فقط"""
+    return ["-i", source, "-map", "0:a:0", "-c:a", "copy", *metadata_args(metadata), output]
+
+
+def mp3_args(source: str, output: str, metadata: dict, bitrate_kbps: int,
+             cover: Optional[str] = None) -> List[str]:
+    """تحويل إلى MP3 مع تضمين الغلاف إن وُجد"""
+    args = ["-i", source]
+    if cover:
+        args += ["-i", cover, "-map", "0:a:0", "-map", "1:0",
+                 "-c:v", "mjpeg", "-disposition:v", "attached_pic"]
+    else:
+        args += ["-map", "0:a:0"]
+    return args + [
+        "-c:a", "libmp3lame", "-b:a", f"{bitrate_kbps}k", "-id3v2_version", "3",
+        *metadata_args(metadata), output,
+    ]
+
+
+class FFmpegPool:
+    """
+    عدد محدود من عمليات ffmpeg المتزامنة (بعدد الأنوية افتراضياً) مع طابور انتظار
+    وأولوية منخفضة اختيارية، حتى لا تزاحم المعالجة مرحلة التحميل.
+    """
+
+    def __init__(self, max_workers: int, nice: int = 0, ffmpeg: str = "ffmpeg"):
+        self.max_workers = max_workers
+        self.nice = nice
+        self.ffmpeg = ffmpeg
+        self._semaphore = asyncio.Semaphore(max_workers)
+        self.active = 0
+        self.queued = 0
+
+    def _command(self, args: List[str]) -> List[str]:
+        command = [self.ffmpeg, "-y", "-hide_banner", "-nostats", "-nostdin", "-benchmark", *args]
+        if self.nice and shutil.which("nice"):
+            command = ["nice", "-n", str(self.nice), *command]
+        return command
+
+    async def run(self, args: List[str]) -> float:
+        """تنفيذ ffmpeg عند توفر مكان؛ يعيد وقت المعالج المستهلك بالثواني"""
+        self.queued += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.queued -= 1
+
+        self.active += 1
+        try:
+            return await self._execute(args)
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    async def _execute(self, args: List[str]) -> float:
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *self._command(args),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True,
+            )
+        except FileNotFoundError:
+            raise DownloadError("ffmpeg is not installed", "postprocess")
+
+        try:
+            _, stderr = await process.communicate()
+        except BaseException:
+            # إلغاء المهمة: إنهاء ffmpeg فوراً (مجموعته كاملة)
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                pass
+            raise
+
+        output = stderr.decode(errors="replace")
+        if process.returncode:
+            tail = output.strip().splitlines()[-1:] or ["unknown error"]
+            raise DownloadError(f"ffmpeg failed: {tail[0]}", "postprocess")
+
+        match = BENCH_PATTERN.search(output)
+        return float(match.group(1)) + float(match.group(2)) if match else 0.0
@@ -0,0 +1,80 @@
+"""
+قناة التقدم - آخر قيمة فقط لكل مهمة ومستهلك واحد يرسل التحديثات بمعدل محدود
+"""
+import time
+import asyncio
+import logging
+from typing import Optional, Dict, Any, Callable, List
+
+from config import PROGRESS_MIN_INTERVAL, PROGRESS_MIN_DELTA
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressBus:
+    """
+    المنتجون على حلقة الأحداث (تقدم العمال عبر WorkerPool، الجدولة، المعالجة) يكتبون آخر حالة فقط
+    بدون إنشاء مهام، ومستهلك واحد يرسلها للمشتركين عند تغير المرحلة أو مرور الوقت وتغير النسبة بما يكفي.
+    """
+
+    def __init__(self, min_interval: float = PROGRESS_MIN_INTERVAL,
+                 min_delta: float = PROGRESS_MIN_DELTA):
+        self.min_interval = min_interval
+        self.min_delta = min_delta
+        self._latest: Optional[Dict[str, Any]] = None
+        self._sent: Optional[Dict[str, Any]] = None
+        self._sent_at = 0.0
+        self._wakeup = asyncio.Event()
+        self._subscribers: List[Callable] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, callback: Callable):
+        """callback(event) غير متزامنة؛ event = {"stage": ..., ...}"""
+        self._subscribers.append(callback)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def unsubscribe(self, callback: Callable):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def post(self, stage: str, **fields):
+        """تسجيل آخر حالة (من داخل حلقة الأحداث)"""
+        self._latest = {"stage": stage, **fields}
+        self._wakeup.set()
+
+    def _due(self, event: Dict[str, Any]) -> float:
+        """الوقت المتبقي قبل إرسال الحدث (0 = الآن، None = لا حاجة)"""
+        if self._sent is None or event["stage"] != self._sent["stage"]:
+            return 0
+        if event == self._sent:
+            return None
+        if "percent" in event and abs(event["percent"] - self._sent.get("percent", 0)) < self.min_delta:
+            return None
+        return max(0.0, self._sent_at + self.min_interval - time.monotonic())
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+
+            delay = self._due(self._latest)
+            if delay is None:
+                continue
+            if delay:
+                await asyncio.sleep(delay)
+                self._wakeup.clear()
+
+            event = self._latest
+            self._sent, self._sent_at = event, time.monotonic()
+            for callback in list(self._subscribers):
+                try:
+                    await callback(event)
+                except Exception as e:
+                    logger.error(f"Progress subscriber error: {e}")
+
+    def close(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        self._subscribers.clear()
@@ -0,0 +1,296 @@
+"""
+تحميل HTTP متعدد النطاقات - عدة اتصالات متوازية للصيغ التقدمية مع تكييف عددها حسب السرعة المقاسة
+(يعمل داخل عملية العامل)
+"""
+import os
+import time
+import queue
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from typing import Callable, List, Optional
+
+READ_SIZE = 256 * 1024
+# فترة قياس السرعة قبل قرار زيادة الاتصالات
+PROBE_SECONDS = 2.0
+PROGRESS_SECONDS = 0.5
+
+
+class RangeNotSupported(Exception):
+    pass
+
+
+def _open(url: str, headers: dict, start: int = None, end: int = None, timeout: float = 30):
+    headers = dict(headers or {})
+    if start is not None:
+        headers['Range'] = f"bytes={start}-{'' if end is None else end}"
+    return urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=timeout)
+
+
+def probe(url: str, headers: dict) -> Optional[int]:
+    """الحجم الكلي إن كان الخادم يدعم طلبات النطاق، وإلا None"""
+    with _open(url, headers, 0, 0) as resp:
+        if resp.status != 206:
+            return None
+        total = resp.headers.get('Content-Range', '').rpartition('/')[2]
+        return int(total) if total.isdigit() else None
+
+
+def state_path(path: str) -> str:
+    """ملف القطع المكتملة بجانب الملف الجاري تحميله (يُحذف عند الاكتمال)"""
+    return path + '.ranges'
+
+
+class RangedDownload:
+    """
+    يقسم الملف لقطع ثابتة تسحبها خيوط متوازية من طابور مشترك؛ يبدأ باتصال واحد
+    ويضاعف العدد ما دامت السرعة الكلية تتحسن بنسبة min_gain على الأقل.
+    كل قطعة مكتملة تُسجل في ملف الحالة، فيكمل تحميل منقطع (إيقاف البوت) ما تبقى فقط.
+    """
+
+    def __init__(self, url: str, headers: dict, path: str, total: int,
+                 chunk_size: int, max_connections: int, min_gain: float = 0.15,
+                 retries: int = 3, progress_hook: Callable = None):
+        self.url = url
+        self.headers = headers
+        self.path = path
+        self.total = total
+        self.max_connections = max_connections
+        self.min_gain = min_gain
+        self.retries = retries
+        self.progress_hook = progress_hook
+        self.chunk_size = chunk_size
+        self.state_path = state_path(path)
+        self.downloaded = 0
+        done = self._completed()
+        self.resumed = done is not None
+        self._chunks: "queue.Queue[tuple]" = queue.Queue()
+        for start in range(0, total, chunk_size):
+            end = min(start + chunk_size, total) - 1
+            if done and start in done:
+                self.downloaded += end - start + 1
+            else:
+                self._chunks.put((start, end))
+        self._state = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._threads: List[threading.Thread] = []
+
+    def _header(self) -> str:
+        return f"{self.total}:{self.chunk_size}"
+
+    def _completed(self) -> Optional[set]:
+        """
+        بدايات القطع المكتملة من تحميل سابق لنفس الملف، أو None للبدء من الصفر.
+        ملف بالحجم الكامل بدون ملف حالة = اكتمل سابقاً (الحالة تُنشأ قبل حجز الملف).
+        """
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return None
+        if size != self.total:
+            return None
+        try:
+            with open(self.state_path) as f:
+                lines = f.read().split()
+        except FileNotFoundError:
+            return set(range(0, self.total, self.chunk_size))
+        if not lines or lines[0] != self._header():
+            return None
+        return {int(line) for line in lines[1:] if line.isdigit()}
+
+    @property
+    def connections(self) -> int:
+        return len(self._threads)
+
+    def _spawn(self, count: int):
+        for _ in range(count):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        with open(self.path, 'r+b') as f:
+            while not self._stop.is_set():
+                try:
+                    start, end = self._chunks.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    self._fetch(f, start, end)
+                    if not self._stop.is_set():
+                        self._mark_done(f, start)
+                except BaseException as e:
+                    self._error = e
+                    self._stop.set()
+                    return
+
+    def _mark_done(self, f, start: int):
+        # البيانات تُكتب للملف قبل تسجيل القطعة
+        f.flush()
+        with self._lock:
+            self._state.write(f"{start}\n")
+            self._state.flush()
+
+    def _fetch(self, f, start: int, end: int):
+        pos, attempt = start, 0
+        while pos <= end and not self._stop.is_set():
+            try:
+                with _open(self.url, self.headers, pos, end) as resp:
+                    if resp.status != 206:
+                        raise RangeNotSupported(f"HTTP {resp.status} for range request")
+                    while pos <= end and not self._stop.is_set():
+                        data = resp.read(min(READ_SIZE, end - pos + 1))
+                        if not data:
+                            break
+                        f.seek(pos)
+                        f.write(data)
+                        pos += len(data)
+                        with self._lock:
+                            self.downloaded += len(data)
+                if pos <= end and not self._stop.is_set():
+                    raise http.client.IncompleteRead(b'', end - pos + 1)
+            except (OSError, http.client.HTTPException):
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                time.sleep(attempt)
+
+    def _report(self, speed: float):
+        if self.progress_hook:
+            remaining = self.total - self.downloaded
+            self.progress_hook({
+                'status': 'downloading',
+                'downloaded_bytes': self.downloaded,
+                'total_bytes': self.total,
+                'speed': speed,
+                'eta': int(remaining / speed) if speed else None,
+                'filename': self.path,
+            })
+
+    def run(self) -> int:
+        """التحميل حتى الاكتمال - يعيد أقصى عدد اتصالات استُخدم"""
+        if self.resumed:
+            self._state = open(self.state_path, 'a')
+        else:
+            self._state = open(self.state_path, 'w')
+            self._state.write(self._header() + "\n")
+            self._state.flush()
+            with open(self.path, 'wb') as f:
+                f.truncate(self.total)
+
+        self._spawn(1)
+        growing = True
+        best_rate = 0.0
+        window_start, window_bytes = time.monotonic(), self.downloaded
+        speed = 0.0
+        try:
+            while any(t.is_alive() for t in self._threads):
+                time.sleep(PROGRESS_SECONDS)
+                now = time.monotonic()
+                elapsed = now - window_start
+                speed = (self.downloaded - window_bytes) / elapsed if elapsed else 0.0
+                # قد يرفع WorkerCancelled عند طلب الإلغاء
+                self._report(speed)
+
+                if elapsed < PROBE_SECONDS:
+                    continue
+                if growing and self.connections < self.max_connections and not self._chunks.empty():
+                    if speed >= best_rate * (1 + self.min_gain):
+                        best_rate = speed
+                        self._spawn(min(self.connections, self.max_connections - self.connections))
+                    else:
+                        # السرعة لم تعد تتحسن: الخط مشبع أو الخادم يحد الاتصالات
+                        growing = False
+                window_start, window_bytes = now, self.downloaded
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for thread in self._threads:
+                thread.join(timeout=5)
+            self._state.close()
+
+        if self._error:
+            raise self._error
+        if self.downloaded < self.total:
+            raise IOError(f"Incomplete download: {self.downloaded}/{self.total}")
+        os.remove(self.state_path)
+        self._report(speed)
+        return self.connections
+
+
+def download_single(url: str, headers: dict, path: str, progress_hook: Callable = None) -> int:
+    """
+    تحميل باتصال واحد (خادم بدون دعم النطاقات أو ملف صغير)؛ ملف جزئي من تحميل
+    منقطع يُكمل بطلب نطاق من حجمه الحالي إن دعمه الخادم
+    """
+    existing = 0
+    if os.path.exists(state_path(path)):
+        # بقايا تحميل متعدد النطاقات (غير متصل البايتات) - البدء من الصفر
+        os.remove(state_path(path))
+    elif os.path.exists(path):
+        existing = os.path.getsize(path)
+    try:
+        resp = _open(url, headers, existing) if existing else _open(url, headers)
+    except urllib.error.HTTPError as e:
+        if e.code == 416:
+            # لا شيء بعد الحجم الحالي - الملف اكتمل سابقاً
+            return existing
+        raise
+    if resp.status != 206:
+        existing = 0
+    downloaded, started, last_report = existing, time.monotonic(), 0.0
+    with resp, open(path, 'ab' if existing else 'wb') as f:
+        total = int(resp.headers.get('Content-Length') or 0) or None
+        if total:
+            total += existing
+        while True:
+            data = resp.read(READ_SIZE)
+            if not data:
+                break
+            f.write(data)
+            downloaded += len(data)
+            now = time.monotonic()
+            if progress_hook and now - last_report >= PROGRESS_SECONDS:
+                last_report = now
+                speed = (downloaded - existing) / (now - started)
+                progress_hook({
+                    'status': 'downloading', 'downloaded_bytes': downloaded,
+                    'total_bytes': total, 'speed': speed,
+                    'eta': int((total - downloaded) / speed) if total and speed else None,
+                    'filename': path,
+                })
+    return downloaded
+
+
+def download_parts(parts: List[dict], progress_hook: Callable = None, *,
+                   chunk_size: int, max_connections: int, min_size: int) -> List[dict]:
+    """
+    تحميل كل جزء (url, headers, filepath) - بالنطاقات المتوازية إن أمكن -
+    وإرجاع مدخلات بصيغة requested_downloads لمرحلة المعالجة
+    """
+    downloads = []
+    for part in parts:
+        headers = part.get('headers') or {}
+        total = probe(part['url'], headers)
+        ranged = total and total >= min_size and max_connections > 1
+        if ranged:
+            try:
+                RangedDownload(
+                    part['url'], headers, part['filepath'], total,
+                    chunk_size=min(chunk_size, part.get('chunk_size') or chunk_size),
+                    max_connections=max_connections,
+                    progress_hook=progress_hook,
+                ).run()
+            except RangeNotSupported:
+                # الخادم قبل طلب الفحص ثم أعاد 200 للنطاقات الفعلية
+                ranged = False
+        if not ranged:
+            download_single(part['url'], headers, part['filepath'], progress_hook)
+        downloads.append({
+            key: part.get(key) for key in ('format_id', 'ext', 'vcodec', 'acodec', 'filepath')
+        })
+    return downloads
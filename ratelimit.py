@@ -0,0 +1,80 @@
+"""
+حد الطلبات - نافذة منزلقة لكل مستخدم في الذاكرة، مع عدادات دقيقة مشتركة في Mongo اختيارياً
+(عدة نسخ من البوت تتقاسم نفس الحد)
+"""
+import time
+import logging
+from collections import deque
+from typing import Deque, Dict
+
+from config import RATE_LIMIT_PER_MINUTE, RATE_LIMIT_SHARED
+from database import db
+
+logger = logging.getLogger(__name__)
+
+WINDOW_SECONDS = 60
+# تنظيف المستخدمين الخاملين من الذاكرة كل عدد من الطلبات
+SWEEP_EVERY = 1000
+
+
+class RateLimiter:
+    """
+    acquire تحجز مكان الطلب لحظة قبوله (قبل التحميل) فلا تمر الدفعات المتزامنة.
+    الوضع المشترك يقرب النافذة المنزلقة بدلوين: الدقيقة الحالية + السابقة موزونة بما بقي منها.
+    """
+
+    def __init__(self, limit: int = RATE_LIMIT_PER_MINUTE, shared: bool = False):
+        self.limit = limit
+        self.shared = shared
+        self._hits: Dict[int, Deque[float]] = {}
+        self._calls = 0
+
+    def _window(self, user_id: int, now: float) -> Deque[float]:
+        hits = self._hits.setdefault(user_id, deque())
+        while hits and hits[0] <= now - WINDOW_SECONDS:
+            hits.popleft()
+        return hits
+
+    def _sweep(self, now: float):
+        for user_id in [u for u, hits in self._hits.items()
+                        if not hits or hits[-1] <= now - WINDOW_SECONDS]:
+            del self._hits[user_id]
+
+    async def acquire(self, user_id: int) -> bool:
+        """حجز طلب للمستخدم؛ False إن تجاوز الحد"""
+        now = time.monotonic()
+        self._calls += 1
+        if self._calls % SWEEP_EVERY == 0:
+            self._sweep(now)
+
+        hits = self._window(user_id, now)
+        if len(hits) >= self.limit:
+            return False
+        hits.append(now)
+
+        if self.shared:
+            try:
+                allowed = await self._acquire_shared(user_id)
+            except Exception as e:
+                # Mongo غير متاح: الحد المحلي وحده
+                logger.error(f"Shared rate limit error: {e}")
+                allowed = True
+            if not allowed:
+                hits.remove(now)
+                return False
+        return True
+
+    async def _acquire_shared(self, user_id: int) -> bool:
+        now = time.time()
+        minute = int(now // WINDOW_SECONDS)
+        count = await db.incr_rate_bucket(user_id, minute)
+        previous = await db.get_rate_bucket(user_id, minute - 1)
+        weight = 1 - (now % WINDOW_SECONDS) / WINDOW_SECONDS
+        if previous * weight + count > self.limit:
+            # إرجاع الحجز - الطلب مرفوض
+            await db.incr_rate_bucket(user_id, minute, -1)
+            return False
+        return True
+
+
+rate_limiter = RateLimiter(RATE_LIMIT_PER_MINUTE, shared=RATE_LIMIT_SHARED)
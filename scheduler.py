@@ -0,0 +1,145 @@
+"""
+جدولة التحميلات - طوابير عادلة لكل مستخدم مع حد عام وحد لكل مستخدم وأولوية للأدمن
+"""
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Callable, List
+
+logger = logging.getLogger(__name__)
+
+LANE_PRIORITY = 0
+LANE_NORMAL = 1
+
+
+class _Ticket:
+    def __init__(self, user_id: int, lane: int, on_position: Optional[Callable]):
+        self.user_id = user_id
+        self.lane = lane
+        self.on_position = on_position
+        self.position = 0
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+
+class FairScheduler:
+    """
+    يوزع أماكن التحميل بالتناوب بين المستخدمين (Round Robin) داخل كل مسار،
+    ومسار الأولوية (الأدمن) يُخدم أولاً.
+    """
+
+    def __init__(self, max_concurrent: int, max_per_user: int):
+        self.max_concurrent = max_concurrent
+        self.max_per_user = max_per_user
+        self._active = 0
+        self._active_by_user: Dict[int, int] = {}
+        # لكل مسار: مستخدم -> طابور تذاكره (ترتيب المستخدمين = دور التناوب)
+        self._lanes: Dict[int, "OrderedDict[int, deque]"] = {
+            LANE_PRIORITY: OrderedDict(),
+            LANE_NORMAL: OrderedDict(),
+        }
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for lane in self._lanes.values() for q in lane.values())
+
+    def _can_run(self, user_id: int) -> bool:
+        return self._active_by_user.get(user_id, 0) < self.max_per_user
+
+    def _order(self) -> List[_Ticket]:
+        """ترتيب التذاكر المتوقع: المسارات بالأولوية ثم التناوب بين المستخدمين"""
+        order = []
+        for lane in sorted(self._lanes):
+            queues = [list(q) for q in self._lanes[lane].values()]
+            depth = max((len(q) for q in queues), default=0)
+            for i in range(depth):
+                order.extend(q[i] for q in queues if i < len(q))
+        return order
+
+    def _dispatch(self):
+        """منح الأماكن الفارغة لأول تذكرة مؤهلة بالترتيب العادل"""
+        while self._active < self.max_concurrent:
+            ticket = self._next_ticket()
+            if ticket is None:
+                break
+            if ticket.future.cancelled():
+                continue
+            self._active += 1
+            self._active_by_user[ticket.user_id] = self._active_by_user.get(ticket.user_id, 0) + 1
+            ticket.position = 0
+            ticket.future.set_result(None)
+        self._notify_positions()
+
+    def _next_ticket(self) -> Optional[_Ticket]:
+        for lane in sorted(self._lanes):
+            users = self._lanes[lane]
+            for user_id in list(users):
+                if not self._can_run(user_id):
+                    continue
+                queue = users[user_id]
+                ticket = queue.popleft()
+                # المستخدم ينتقل لآخر الدور
+                del users[user_id]
+                if queue:
+                    users[user_id] = queue
+                return ticket
+        return None
+
+    def _remove(self, ticket: _Ticket):
+        users = self._lanes[ticket.lane]
+        queue = users.get(ticket.user_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            if not queue:
+                del users[ticket.user_id]
+
+    def _notify_positions(self):
+        for position, ticket in enumerate(self._order(), 1):
+            if ticket.position != position:
+                ticket.position = position
+                if ticket.on_position:
+                    asyncio.create_task(self._call(ticket.on_position, position))
+
+    @staticmethod
+    async def _call(callback: Callable, position: int):
+        try:
+            await callback(position)
+        except Exception as e:
+            logger.error(f"Queue position callback error: {e}")
+
+    def _release(self, user_id: int):
+        self._active -= 1
+        remaining = self._active_by_user.get(user_id, 1) - 1
+        if remaining:
+            self._active_by_user[user_id] = remaining
+        else:
+            self._active_by_user.pop(user_id, None)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, priority: bool = False,
+                   on_position: Optional[Callable] = None):
+        """انتظار مكان تحميل؛ on_position(n) تُستدعى عند تغير الترتيب في الطابور"""
+        ticket = _Ticket(user_id, LANE_PRIORITY if priority else LANE_NORMAL, on_position)
+        self._lanes[ticket.lane].setdefault(user_id, deque()).append(ticket)
+        self._dispatch()
+
+        try:
+            await ticket.future
+        except BaseException:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # حصل على المكان لحظة الإلغاء
+                self._release(user_id)
+            else:
+                self._remove(ticket)
+                self._notify_positions()
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
@@ -0,0 +1,11 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# الوحدات في جذر المستودع (بدون حزمة)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# config.py يتطلب التوكن، والمجلد المؤقت خارج مجلد البوت الحقيقي
+os.environ.setdefault("BOT_TOKEN", "123456:test")
+os.environ.setdefault("TEMP_DIR", tempfile.mkdtemp(prefix="yt_bot_tests_"))
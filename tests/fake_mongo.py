@@ -0,0 +1,183 @@
+"""
+بديل Mongo في الذاكرة للاختبارات - فقط ما يستخدمه database.py و writebehind.py:
+المقارنات ($lt/$lte/$gt/$gte/$ne/$in/$nin و $or) والتحديث ($set/$inc/$push/$setOnInsert)
+"""
+import copy
+from types import SimpleNamespace
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, ServerSelectionTimeoutError
+
+DUPLICATE_KEY = 11000
+
+OPERATORS = {
+    "$lt": lambda value, arg: value is not None and value < arg,
+    "$lte": lambda value, arg: value is not None and value <= arg,
+    "$gt": lambda value, arg: value is not None and value > arg,
+    "$gte": lambda value, arg: value is not None and value >= arg,
+    "$ne": lambda value, arg: value != arg,
+    "$in": lambda value, arg: value in arg,
+    "$nin": lambda value, arg: value not in arg,
+}
+
+
+def matches(doc: dict, query: dict) -> bool:
+    for key, condition in query.items():
+        if key == "$or":
+            if not any(matches(doc, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict) and condition and all(op in OPERATORS for op in condition):
+            if not all(OPERATORS[op](doc.get(key), arg) for op, arg in condition.items()):
+                return False
+        elif doc.get(key) != condition:
+            return False
+    return True
+
+
+def apply_update(doc: dict, update: dict, inserting: bool = False):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = copy.deepcopy(value)
+    for key, value in update.get("$inc", {}).items():
+        doc[key] = doc.get(key, 0) + value
+    for key, value in update.get("$push", {}).items():
+        doc.setdefault(key, []).append(copy.deepcopy(value))
+    if inserting:
+        for key, value in update.get("$setOnInsert", {}).items():
+            doc[key] = copy.deepcopy(value)
+
+
+def project(doc: dict, projection) -> dict:
+    if not projection:
+        return copy.deepcopy(doc)
+    return {key: copy.deepcopy(value) for key, value in doc.items()
+            if key == "_id" or projection.get(key)}
+
+
+class FakeCursor:
+    def __init__(self, docs: list):
+        self._docs = docs
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda doc: doc.get(field), reverse=order < 0)
+        return self
+
+    def limit(self, count: int):
+        self._docs = self._docs[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self._docs if length is None else self._docs[:length]
+
+
+class FakeDatabase:
+    def __init__(self):
+        # False = Mongo غير متاح: كل العمليات ترفع ServerSelectionTimeoutError
+        self.available = True
+        self.commands = []
+
+    async def command(self, name: str):
+        self.check()
+        self.commands.append(name)
+        return {"ok": 1}
+
+    def check(self):
+        if not self.available:
+            raise ServerSelectionTimeoutError("fake mongo is down")
+
+
+class FakeCollection:
+    def __init__(self, database: FakeDatabase = None):
+        self.database = database or FakeDatabase()
+        self.docs = {}
+
+    def _find(self, query: dict, sort=None) -> list:
+        self.database.check()
+        found = [doc for doc in self.docs.values() if matches(doc, query)]
+        if sort:
+            found = FakeCursor(found).sort(sort)._docs
+        return found
+
+    def _insert(self, doc: dict) -> dict:
+        doc = copy.deepcopy(doc)
+        doc.setdefault("_id", ObjectId())
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("duplicate _id", DUPLICATE_KEY)
+        self.docs[doc["_id"]] = doc
+        return doc
+
+    def _upsert(self, query: dict, update: dict) -> dict:
+        doc = {key: value for key, value in query.items()
+               if not key.startswith("$") and not isinstance(value, dict)}
+        apply_update(doc, update, inserting=True)
+        return self._insert(doc)
+
+    async def insert_one(self, doc: dict):
+        self.database.check()
+        return SimpleNamespace(inserted_id=self._insert(doc)["_id"])
+
+    async def insert_many(self, docs: list, ordered: bool = True):
+        self.database.check()
+        errors = []
+        for index, doc in enumerate(docs):
+            try:
+                self._insert(doc)
+            except DuplicateKeyError:
+                errors.append({"index": index, "code": DUPLICATE_KEY, "errmsg": "duplicate _id"})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+    async def find_one(self, query: dict, projection=None):
+        found = self._find(query)
+        return project(found[0], projection) if found else None
+
+    def find(self, query: dict = None) -> FakeCursor:
+        return FakeCursor([copy.deepcopy(doc) for doc in self._find(query or {})])
+
+    async def count_documents(self, query: dict) -> int:
+        return len(self._find(query))
+
+    async def find_one_and_update(self, query: dict, update: dict, sort=None, projection=None,
+                                  upsert: bool = False,
+                                  return_document=ReturnDocument.BEFORE):
+        found = self._find(query, sort)
+        if not found:
+            if not upsert:
+                return None
+            doc = self._upsert(query, update)
+            return project(doc, projection) if return_document == ReturnDocument.AFTER else None
+        doc = found[0]
+        before = project(doc, projection)
+        apply_update(doc, update)
+        return project(doc, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def update_one(self, query: dict, update: dict, upsert: bool = False):
+        found = self._find(query)
+        if found:
+            apply_update(found[0], update)
+        elif upsert:
+            self._upsert(query, update)
+        return SimpleNamespace(matched_count=min(len(found), 1))
+
+    async def update_many(self, query: dict, update: dict):
+        found = self._find(query)
+        for doc in found:
+            apply_update(doc, update)
+        return SimpleNamespace(matched_count=len(found))
+
+    async def delete_one(self, query: dict):
+        found = self._find(query)
+        if found:
+            del self.docs[found[0]["_id"]]
+        return SimpleNamespace(deleted_count=min(len(found), 1))
+
+    async def bulk_write(self, requests: list, ordered: bool = True):
+        # UpdateOne فقط (ما تستخدمه الكتابة المؤجلة)
+        self.database.check()
+        for request in requests:
+            await self.update_one(request._filter, request._doc, upsert=request._upsert)
+        return SimpleNamespace(matched_count=len(requests))
@@ -0,0 +1,56 @@
+"""
+اختبارات منظف TEMP_DIR (janitor.py) مع مجلدات مدير التحميل
+"""
+import asyncio
+from pathlib import Path
+
+import pytest
+
+from cache import DownloadCache
+from downloader import dl_manager, cache_variant
+from janitor import TempJanitor
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+@pytest.fixture
+def manager(monkeypatch, tmp_path):
+    temp_dir = tmp_path / "temp"
+    temp_dir.mkdir()
+    cache = DownloadCache(temp_dir / "cache", 1024 * 1024)
+    monkeypatch.setattr(dl_manager, "temp_dir", temp_dir)
+    monkeypatch.setattr(dl_manager, "cache", cache)
+    monkeypatch.setattr(dl_manager, "_handed_out", set())
+    # ملف الكاش قديم: نسخته (رابط صلب) تحمل نفس وقت التعديل
+    source = tmp_path / "video.mp4"
+    source.write_bytes(b"v" * 100)
+    cache.put("dQw4w9WgXcQ", "video", cache_variant("video", "best"), str(source),
+              {"title": "Title", "duration": 60})
+    return dl_manager
+
+
+def janitor(manager):
+    return TempJanitor(manager, manager.temp_dir, manager.cache, quota=10 ** 9,
+                       min_age=0, upload_age=0, interval=60)
+
+
+def test_cache_hit_dir_is_kept_until_released(manager):
+    async def scenario():
+        result = manager.cached_result(URL, "video", "best")
+        await janitor(manager).sweep()
+        # الرفع الطويل لم ينته: الملف باق رغم قدم وقت تعديله
+        uploading = Path(result["file_path"]).exists()
+        await manager.release(result["output_dir"])
+        return result, uploading
+
+    result, uploading = asyncio.run(scenario())
+    assert uploading
+    assert not Path(result["output_dir"]).exists()
+    assert manager.owned_dirs() == set()
+
+
+def test_unowned_dirs_are_swept(manager):
+    (manager.temp_dir / "leftover").mkdir()
+    asyncio.run(janitor(manager).sweep())
+    assert not (manager.temp_dir / "leftover").exists()
+    assert (manager.temp_dir / "cache").exists()
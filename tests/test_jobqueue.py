@@ -0,0 +1,245 @@
+"""
+اختبارات طابور المهام (database.py + jobqueue.py) مقابل بديل Mongo في الذاكرة
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import jobqueue
+from database import db
+from downloader import dl_manager
+from exceptions import CancelledError
+from fake_mongo import FakeCollection
+from jobqueue import JobWorker, wait_job
+from utils import cleanup_file
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+@pytest.fixture(autouse=True)
+def fake_db(monkeypatch):
+    monkeypatch.setattr(db, "jobs", FakeCollection())
+    monkeypatch.setattr(db, "file_cache", FakeCollection())
+    monkeypatch.setattr(jobqueue, "JOB_POLL_SECONDS", 0.01)
+
+
+class FakeManager:
+    """بديل AdvancedDownloadManager: التحميل ينتظر gate أو الإلغاء"""
+
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.gate = asyncio.Event()
+        self.events = {}
+        self.extracted = []
+
+    def register_cancel(self, request_id):
+        self.events[request_id] = asyncio.Event()
+        return self.events[request_id]
+
+    def unregister_cancel(self, request_id):
+        self.events.pop(request_id, None)
+
+    def cancel(self, request_id):
+        if request_id in self.events:
+            self.events[request_id].set()
+
+    def cached_result(self, url, format_type, quality):
+        return None
+
+    async def release(self, path):
+        await cleanup_file(path)
+
+    async def extract_info(self, url):
+        self.extracted.append(url)
+        return {"id": "dQw4w9WgXcQ", "title": "Title", "duration": 60}
+
+    async def download(self, url, format_type, quality, cancel_event, progress_callback, info,
+                       user_id, priority):
+        await progress_callback({"stage": "downloading", "percent": 50})
+        gate = asyncio.create_task(self.gate.wait())
+        cancel = asyncio.create_task(cancel_event.wait())
+        await asyncio.wait({gate, cancel}, return_when=asyncio.FIRST_COMPLETED)
+        gate.cancel()
+        cancel.cancel()
+        if cancel_event.is_set():
+            raise CancelledError()
+        output_dir = self.tmp_path / "out"
+        output_dir.mkdir(exist_ok=True)
+        path = output_dir / "video.mp4"
+        path.write_bytes(b"v" * 10)
+        return {"file_path": str(path), "output_dir": str(output_dir), "title": info["title"],
+                "duration": 60, "uploader": "U", "file_size": 10}
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_video(self, chat_id, upload, **kwargs):
+        self.sent.append(chat_id)
+        return SimpleNamespace(video=SimpleNamespace(file_id="FILE_ID"), audio=None, document=None)
+
+
+async def job(job_id):
+    return await db.get_job(job_id)
+
+
+def test_claim_is_exclusive_and_priority_first():
+    async def scenario():
+        first = await db.enqueue_job(1, URL, "video", "best")
+        admin = await db.enqueue_job(2, URL, "video", "720", priority=True)
+        claims = [await db.claim_job(f"w{i}", 60, 3) for i in range(3)]
+        return first, admin, claims
+
+    first, admin, claims = asyncio.run(scenario())
+    assert [c and c["_id"] for c in claims] == [admin, first, None]
+    assert claims[0]["status"] == "running" and claims[0]["worker"] == "w0"
+    assert claims[0]["attempts"] == 1
+
+
+def test_expired_lease_is_reclaimed_by_another_worker():
+    async def scenario():
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        await db.claim_job("w1", -1, 3)
+        reclaimed = await db.claim_job("w2", 60, 3)
+        # العامل الأول فقد المهمة: التجديد والنتيجة منه لا يُقبلان
+        renewed = await db.renew_job(job_id, "w1", 60)
+        await db.finish_job(job_id, "w1", "failed", error={"type": "unknown"})
+        return job_id, reclaimed, renewed, await job(job_id)
+
+    job_id, reclaimed, renewed, doc = asyncio.run(scenario())
+    assert reclaimed["_id"] == job_id and reclaimed["worker"] == "w2"
+    assert reclaimed["attempts"] == 2
+    assert renewed is None
+    assert doc["status"] == "running" and doc["worker"] == "w2"
+
+
+def test_expired_lease_after_last_attempt_fails_the_job():
+    async def scenario():
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        await db.claim_job("w1", -1, 1)
+        return await db.claim_job("w2", 60, 1), await job(job_id)
+
+    claimed, doc = asyncio.run(scenario())
+    assert claimed is None
+    assert doc["status"] == "failed" and doc["error"]["message"] == "Worker lost"
+
+
+def test_cancel_queued_and_running_jobs():
+    async def scenario():
+        queued = await db.enqueue_job(1, URL, "video", "best")
+        running = await db.enqueue_job(2, URL, "video", "best", priority=True)
+        await db.claim_job("w1", 60, 3)
+        await db.cancel_job(queued)
+        await db.cancel_job(running)
+        return (await job(queued), await job(running),
+                await db.renew_job(running, "w1", 60), await db.claim_job("w2", 60, 3))
+
+    queued, running, renewed, claimed = asyncio.run(scenario())
+    assert queued["status"] == "cancelled"
+    # الجارية يوقفها عاملها عند التجديد التالي
+    assert running["status"] == "running" and running["cancel_requested"]
+    assert renewed["cancel_requested"]
+    assert claimed is None
+
+
+def test_release_puts_job_back_without_using_an_attempt():
+    async def scenario():
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        await db.claim_job("w1", 60, 3)
+        await db.release_job(job_id, "w1")
+        released = await job(job_id)
+        return released, await db.claim_job("w2", 60, 3)
+
+    released, claimed = asyncio.run(scenario())
+    assert released["status"] == "queued" and released["attempts"] == 0
+    assert claimed["worker"] == "w2" and claimed["attempts"] == 1
+
+
+async def run_worker(tmp_path, body):
+    manager = FakeManager(tmp_path)
+    bot = FakeBot()
+    stop = asyncio.Event()
+    worker = JobWorker(bot, manager, storage_chat_id=-100, concurrency=1, poll_seconds=0.01)
+    task = asyncio.create_task(worker.run(stop))
+    try:
+        return await body(manager, bot)
+    finally:
+        stop.set()
+        await task
+
+
+def test_worker_runs_job_and_frontend_gets_file_id(tmp_path):
+    async def body(manager, bot):
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        events = []
+
+        async def progress(event):
+            events.append(event)
+            if event["stage"] == "downloading":
+                manager.gate.set()
+
+        result = await wait_job(job_id, asyncio.Event(), progress)
+        return result, events, bot.sent, await db.get_cached_file("dQw4w9WgXcQ", "video", "best")
+
+    result, events, sent, cached = asyncio.run(run_worker(tmp_path, body))
+    assert result["file_id"] == "FILE_ID" and result["title"] == "Title"
+    assert {"stage": "downloading", "percent": 50, "title": "Title"} in events
+    assert sent == [-100]
+    assert cached["file_id"] == "FILE_ID"
+    # ملف العامل يُحذف بعد الرفع
+    assert not (tmp_path / "out").exists()
+
+
+def test_user_cancel_stops_the_worker(tmp_path):
+    async def body(manager, bot):
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        cancel_event = asyncio.Event()
+
+        async def progress(event):
+            if event["stage"] == "downloading":
+                cancel_event.set()
+
+        with pytest.raises(CancelledError):
+            await wait_job(job_id, cancel_event, progress)
+        for _ in range(100):
+            if (await job(job_id))["status"] == "cancelled":
+                break
+            await asyncio.sleep(0.01)
+        return await job(job_id), bot.sent
+
+    doc, sent = asyncio.run(run_worker(tmp_path, body))
+    assert doc["status"] == "cancelled"
+    assert sent == []
+
+
+def test_frontend_task_cancellation_keeps_the_job():
+    async def scenario():
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        waiter = asyncio.create_task(wait_job(job_id, asyncio.Event()))
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await job(job_id)
+
+    doc = asyncio.run(scenario())
+    # الاستئناف بعد إعادة التشغيل يرتبط بنفس المهمة
+    assert doc["status"] == "queued" and not doc["cancel_requested"]
+
+
+@pytest.mark.parametrize("stopping, cancelled", [(False, True), (True, False)])
+def test_frontend_error_cancels_the_job_unless_stopping(monkeypatch, stopping, cancelled):
+    monkeypatch.setattr(dl_manager, "stopping", stopping)
+
+    async def broken(event):
+        raise RuntimeError("edit failed")
+
+    async def scenario():
+        job_id = await db.enqueue_job(1, URL, "video", "best")
+        with pytest.raises(RuntimeError):
+            await wait_job(job_id, asyncio.Event(), broken)
+        return await job(job_id)
+
+    doc = asyncio.run(scenario())
+    assert doc["cancel_requested"] is cancelled
@@ -0,0 +1,51 @@
+"""
+اختبارات سجل الطلبات (database.py): التجديد وتبني طلبات الخوادم المتوقفة
+"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from database import db
+from fake_mongo import FakeCollection
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+@pytest.fixture(autouse=True)
+def fake_db(monkeypatch):
+    monkeypatch.setattr(db, "journal", FakeCollection())
+
+
+def age(entry_id: str, seconds: int):
+    db.journal.docs[entry_id]["updated_at"] = datetime.now() - timedelta(seconds=seconds)
+
+
+def test_stale_entries_of_other_nodes_are_adopted_once():
+    async def scenario():
+        old = await db.journal_create("old-container", 1, 1, URL, "video", "best")
+        fresh = await db.journal_create("live-node", 2, 2, URL, "video", "best")
+        done = await db.journal_create("old-container", 3, 3, URL, "video", "best")
+        await db.journal_state(done, "done")
+        for entry_id in (old, fresh, done):
+            age(entry_id, 600)
+        # الخادم الحي يجدد طلباته فلا تُتبنى
+        await db.journal_touch("live-node")
+        adopted = await db.journal_adopt("new-container", 300)
+        again = await db.journal_adopt("other-container", 300)
+        return old, adopted, again, await db.journal_unfinished("new-container")
+
+    old, adopted, again, unfinished = asyncio.run(scenario())
+    assert [entry["_id"] for entry in adopted] == [old]
+    assert adopted[0]["node"] == "new-container"
+    assert again == []
+    assert [entry["_id"] for entry in unfinished] == [old]
+
+
+def test_recent_entries_are_not_adopted():
+    async def scenario():
+        entry_id = await db.journal_create("old-container", 1, 1, URL, "video", "best")
+        age(entry_id, 60)
+        return await db.journal_adopt("new-container", 300)
+
+    assert asyncio.run(scenario()) == []
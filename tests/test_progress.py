@@ -0,0 +1,96 @@
+"""
+اختبارات قناة التقدم (progress.py)
+"""
+import time
+import asyncio
+
+from progress import ProgressBus
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def collector():
+    events = []
+
+    async def callback(event):
+        events.append((time.monotonic(), event))
+    return events, callback
+
+
+def test_burst_is_coalesced_to_latest():
+    async def scenario():
+        bus = ProgressBus(min_interval=10, min_delta=5)
+        events, callback = collector()
+        bus.subscribe(callback)
+        for percent in range(1, 101):
+            bus.post("downloading", percent=percent)
+        await settle()
+        bus.close()
+        return events
+
+    events = asyncio.run(scenario())
+    assert [event for _, event in events] == [{"stage": "downloading", "percent": 100}]
+
+
+def test_small_changes_are_dropped_and_updates_are_rate_limited():
+    async def scenario():
+        bus = ProgressBus(min_interval=0.2, min_delta=5)
+        events, callback = collector()
+        bus.subscribe(callback)
+        bus.post("downloading", percent=10)
+        await settle()
+        bus.post("downloading", percent=12)
+        await settle()
+        bus.post("downloading", percent=50)
+        await asyncio.sleep(0.3)
+        bus.close()
+        return events
+
+    events = asyncio.run(scenario())
+    assert [event["percent"] for _, event in events] == [10, 50]
+    assert events[1][0] - events[0][0] >= 0.2
+
+
+def test_stage_change_is_sent_immediately():
+    async def scenario():
+        bus = ProgressBus(min_interval=10, min_delta=5)
+        events, callback = collector()
+        bus.subscribe(callback)
+        bus.post("queued", position=2)
+        await settle()
+        bus.post("downloading", percent=1)
+        await settle()
+        bus.post("processing", step="Merger")
+        await settle()
+        bus.close()
+        return events
+
+    events = asyncio.run(scenario())
+    assert [event["stage"] for _, event in events] == ["queued", "downloading", "processing"]
+
+
+def test_subscriber_errors_do_not_stop_delivery():
+    async def scenario():
+        bus = ProgressBus(min_interval=0, min_delta=0)
+        events, callback = collector()
+
+        async def broken(event):
+            raise RuntimeError("edit failed")
+
+        bus.subscribe(broken)
+        bus.subscribe(callback)
+        bus.post("queued", position=1)
+        await settle()
+        bus.unsubscribe(broken)
+        bus.post("downloading", percent=50)
+        await settle()
+        bus.close()
+        bus.post("processing", step="Merger")
+        await settle()
+        return events
+
+    events = asyncio.run(scenario())
+    assert [event["stage"] for _, event in events] == ["queued", "downloading"]
@@ -0,0 +1,218 @@
+"""
+اختبارات التحميل متعدد النطاقات (ranged.py) مقابل خادم HTTP محلي
+"""
+import os
+import threading
+import http.client
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import ranged
+from ranged import RangedDownload, RangeNotSupported, download_parts, download_single
+
+CHUNK = 64 * 1024
+DATA = os.urandom(5 * CHUNK + 1234)
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        requested = self.headers.get("Range")
+        with server.lock:
+            server.ranges.append(requested)
+            short_read = server.short_reads > 0 and requested != "bytes=0-0"
+            if short_read:
+                server.short_reads -= 1
+
+        # probe_only: يقبل طلب الفحص فقط ثم يتجاهل النطاقات (يعيد 200)
+        use_range = requested and (server.ranges_supported or
+                                   (server.probe_only and requested == "bytes=0-0"))
+        if use_range:
+            first, _, last = requested[len("bytes="):].partition("-")
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{len(data)}")
+                self.end_headers()
+                return
+            body = data[start:end + 1]
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            body = data
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if short_read:
+            # الخادم يقطع الاتصال قبل إرسال كل البايتات المعلنة
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), MediaHandler)
+    httpd.data = DATA
+    httpd.lock = threading.Lock()
+    httpd.ranges = []
+    httpd.ranges_supported = True
+    httpd.probe_only = False
+    httpd.short_reads = 0
+    httpd.url = f"http://127.0.0.1:{httpd.server_address[1]}/media"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_progress(monkeypatch):
+    monkeypatch.setattr(ranged, "PROGRESS_SECONDS", 0.01)
+    monkeypatch.setattr(ranged, "PROBE_SECONDS", 0.0)
+
+
+def fetch(server, tmp_path, **options):
+    path = tmp_path / "media.mp4"
+    parts = [{"url": server.url, "filepath": str(path), "format_id": "18", "ext": "mp4"}]
+    options = {"chunk_size": CHUNK, "max_connections": 4, "min_size": CHUNK, **options}
+    downloads = download_parts(parts, **options)
+    assert downloads == [{"format_id": "18", "ext": "mp4", "vcodec": None, "acodec": None,
+                          "filepath": str(path)}]
+    return path
+
+
+def test_splits_into_ranges(server, tmp_path):
+    path = fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+    expected = {f"bytes={start}-{min(start + CHUNK, len(DATA)) - 1}"
+                for start in range(0, len(DATA), CHUNK)}
+    assert set(server.ranges) == expected | {"bytes=0-0"}
+
+
+def test_small_file_uses_single_connection(server, tmp_path):
+    path = fetch(server, tmp_path, min_size=len(DATA) + 1)
+
+    assert path.read_bytes() == DATA
+    assert server.ranges == ["bytes=0-0", None]
+
+
+def test_falls_back_without_range_support(server, tmp_path):
+    server.ranges_supported = False
+    path = fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+    assert server.ranges == ["bytes=0-0", None]
+
+
+def test_falls_back_when_ranges_return_200(server, tmp_path):
+    server.ranges_supported = False
+    server.probe_only = True
+    path = fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+    assert server.ranges[-1] is None
+
+
+def test_range_not_supported_raises(server, tmp_path):
+    server.ranges_supported = False
+    download = RangedDownload(server.url, {}, str(tmp_path / "media.mp4"), len(DATA),
+                              chunk_size=CHUNK, max_connections=2, retries=0)
+    with pytest.raises(RangeNotSupported):
+        download.run()
+
+
+def test_retries_short_read(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(ranged.time, "sleep", lambda seconds: None)
+    server.short_reads = 2
+    path = fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+    # القطعتان المقطوعتان أُكملتا بطلب نطاق من موضع الانقطاع
+    chunks = -(-len(DATA) // CHUNK)
+    assert len(server.ranges) == 1 + chunks + 2
+    resumed = [r for r in server.ranges if r and int(r[len("bytes="):].partition("-")[0]) % CHUNK]
+    assert len(resumed) == 2
+
+
+def test_short_read_fails_after_retries(server, tmp_path, monkeypatch):
+    monkeypatch.setattr(ranged.time, "sleep", lambda seconds: None)
+    server.short_reads = 100
+    download = RangedDownload(server.url, {}, str(tmp_path / "media.mp4"), len(DATA),
+                              chunk_size=CHUNK, max_connections=1, retries=2)
+    with pytest.raises((OSError, http.client.HTTPException)):
+        download.run()
+
+
+def test_single_connection_download(server, tmp_path):
+    path = tmp_path / "thumb.jpg"
+    events = []
+    assert download_single(server.url, {}, str(path), events.append) == len(DATA)
+    assert path.read_bytes() == DATA
+
+
+def test_resume_skips_completed_chunks(server, tmp_path):
+    path = tmp_path / "media.mp4"
+    # تحميل سابق انقطع بعد القطعتين 0 و 2 (البيانات والحالة كما يتركهما RangedDownload)
+    partial = bytearray(len(DATA))
+    for start in (0, 2 * CHUNK):
+        partial[start:start + CHUNK] = DATA[start:start + CHUNK]
+    path.write_bytes(bytes(partial))
+    (tmp_path / "media.mp4.ranges").write_text(f"{len(DATA)}:{CHUNK}\n0\n{2 * CHUNK}\n")
+
+    fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+    fetched = {int(r[len("bytes="):].partition("-")[0]) for r in server.ranges if r != "bytes=0-0"}
+    assert fetched == {CHUNK, 3 * CHUNK, 4 * CHUNK, 5 * CHUNK}
+    assert not (tmp_path / "media.mp4.ranges").exists()
+
+
+def test_resume_with_other_chunk_size_restarts(server, tmp_path):
+    path = tmp_path / "media.mp4"
+    path.write_bytes(bytes(len(DATA)))
+    (tmp_path / "media.mp4.ranges").write_text(f"{len(DATA)}:{CHUNK * 2}\n0\n")
+
+    fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+
+
+def test_completed_file_is_not_downloaded_again(server, tmp_path):
+    path = tmp_path / "media.mp4"
+    path.write_bytes(DATA)
+
+    fetch(server, tmp_path)
+
+    assert path.read_bytes() == DATA
+    assert server.ranges == ["bytes=0-0"]
+
+
+def test_single_connection_resumes_partial_file(server, tmp_path):
+    path = tmp_path / "thumb.jpg"
+    path.write_bytes(DATA[:1000])
+
+    assert download_single(server.url, {}, str(path)) == len(DATA)
+    assert path.read_bytes() == DATA
+    assert server.ranges == ["bytes=1000-"]
+
+    assert download_single(server.url, {}, str(path)) == len(DATA)
+    assert path.read_bytes() == DATA
+
+
+def test_single_connection_restarts_without_range_support(server, tmp_path):
+    server.ranges_supported = False
+    path = tmp_path / "thumb.jpg"
+    path.write_bytes(b"x" * 1000)
+
+    assert download_single(server.url, {}, str(path)) == len(DATA)
+    assert path.read_bytes() == DATA
@@ -0,0 +1,114 @@
+"""
+اختبارات حد الطلبات (ratelimit.py): الدفعات المتزامنة والنافذة المنزلقة والوضع المشترك
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import ratelimit
+from database import db
+from fake_mongo import FakeCollection
+from ratelimit import RateLimiter
+
+MINUTE_START = 60 * 1000
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ساعة يدوية لـ ratelimit فقط (time.monotonic للنافذة المحلية و time.time للدلاء)"""
+    now = {"monotonic": 1000.0, "time": float(MINUTE_START)}
+    monkeypatch.setattr(ratelimit, "time", SimpleNamespace(
+        monotonic=lambda: now["monotonic"], time=lambda: now["time"]
+    ))
+    return now
+
+
+@pytest.fixture
+def rate_limits(monkeypatch):
+    collection = FakeCollection()
+    monkeypatch.setattr(db, "rate_limits", collection)
+    return collection
+
+
+async def burst(limiters, user_id: int, count: int) -> list:
+    return await asyncio.gather(*(
+        limiters[i % len(limiters)].acquire(user_id) for i in range(count)
+    ))
+
+
+def test_burst_admits_exactly_the_limit(clock):
+    limiter = RateLimiter(limit=5)
+
+    async def scenario():
+        return await burst([limiter], 1, 20), await limiter.acquire(2)
+
+    results, other_user = asyncio.run(scenario())
+    assert results.count(True) == 5
+    assert results[:5] == [True] * 5
+    assert other_user is True
+
+
+def test_window_slides(clock):
+    limiter = RateLimiter(limit=2)
+
+    async def scenario():
+        results = [await limiter.acquire(1)]
+        clock["monotonic"] += 30
+        results += [await limiter.acquire(1), await limiter.acquire(1)]
+        # الطلب الأول خرج من النافذة فقط
+        clock["monotonic"] += 31
+        results += [await limiter.acquire(1), await limiter.acquire(1)]
+        return results
+
+    assert asyncio.run(scenario()) == [True, True, False, True, False]
+
+
+def test_idle_users_are_swept(clock, monkeypatch):
+    monkeypatch.setattr(ratelimit, "SWEEP_EVERY", 3)
+    limiter = RateLimiter(limit=5)
+
+    async def scenario():
+        await limiter.acquire(1)
+        clock["monotonic"] += 61
+        await limiter.acquire(2)
+        await limiter.acquire(2)
+
+    asyncio.run(scenario())
+    assert set(limiter._hits) == {2}
+
+
+def test_shared_limit_across_instances(clock, rate_limits):
+    limiters = [RateLimiter(limit=5, shared=True), RateLimiter(limit=5, shared=True)]
+
+    async def scenario():
+        return await burst(limiters, 1, 10)
+
+    results = asyncio.run(scenario())
+    assert results.count(True) == 5
+    # الطلبات المرفوضة تعيد حجزها
+    assert rate_limits.docs[f"1:{MINUTE_START // 60}"]["count"] == 5
+
+
+def test_shared_limit_weights_previous_minute(clock, rate_limits):
+    limiter = RateLimiter(limit=5, shared=True)
+    clock["time"] += 30
+    rate_limits.docs[f"1:{MINUTE_START // 60 - 1}"] = {
+        "_id": f"1:{MINUTE_START // 60 - 1}", "count": 4
+    }
+
+    async def scenario():
+        return await burst([limiter], 1, 5)
+
+    # نصف الدقيقة السابقة (2) + 3 جديدة = الحد
+    assert asyncio.run(scenario()).count(True) == 3
+
+
+def test_shared_mode_falls_back_to_local_limit_when_mongo_is_down(clock, rate_limits):
+    rate_limits.database.available = False
+    limiter = RateLimiter(limit=3, shared=True)
+
+    async def scenario():
+        return await burst([limiter], 1, 5)
+
+    assert asyncio.run(scenario()).count(True) == 3
@@ -0,0 +1,111 @@
+"""
+اختبارات الجدولة العادلة (scheduler.py)
+"""
+import asyncio
+
+from scheduler import FairScheduler
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+async def request(scheduler, name, user_id, order, priority=False, on_position=None, hold=None):
+    async with scheduler.slot(user_id, priority, on_position):
+        order.append(name)
+        if hold:
+            await hold.wait()
+
+
+def test_round_robin_between_users_with_priority_first():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrent=1, max_per_user=1)
+        order, blocker = [], asyncio.Event()
+        tasks = [asyncio.create_task(request(scheduler, "blocker", 0, order, hold=blocker))]
+        await settle()
+        for name, user_id, priority in [("a1", 1, False), ("a2", 1, False), ("a3", 1, False),
+                                        ("b1", 2, False), ("admin", 3, True)]:
+            tasks.append(asyncio.create_task(request(scheduler, name, user_id, order, priority)))
+            await settle()
+        assert scheduler.queued == 5
+
+        blocker.set()
+        await asyncio.gather(*tasks)
+        return order, scheduler
+
+    order, scheduler = asyncio.run(scenario())
+    assert order == ["blocker", "admin", "a1", "b1", "a2", "a3"]
+    assert scheduler.active == 0 and scheduler.queued == 0
+
+
+def test_per_user_limit_lets_other_users_pass():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrent=2, max_per_user=1)
+        order, release = [], asyncio.Event()
+        tasks = [asyncio.create_task(request(scheduler, name, user_id, order, hold=release))
+                 for name, user_id in [("a1", 1), ("a2", 1), ("b1", 2)]]
+        await settle()
+        running = list(order)
+        release.set()
+        await asyncio.gather(*tasks)
+        return running, order
+
+    running, order = asyncio.run(scenario())
+    assert running == ["a1", "b1"]
+    assert order == ["a1", "b1", "a2"]
+
+
+def test_cancelled_ticket_is_removed_and_positions_update():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrent=1, max_per_user=1)
+        order, blocker = [], asyncio.Event()
+        positions = {"b": [], "c": []}
+
+        def tracker(name):
+            async def on_position(position):
+                positions[name].append(position)
+            return on_position
+
+        holder = asyncio.create_task(request(scheduler, "blocker", 0, order, hold=blocker))
+        await settle()
+        waiting = asyncio.create_task(request(scheduler, "a", 1, order))
+        b = asyncio.create_task(request(scheduler, "b", 2, order, on_position=tracker("b")))
+        c = asyncio.create_task(request(scheduler, "c", 3, order, on_position=tracker("c")))
+        await settle()
+        assert scheduler.queued == 3
+
+        waiting.cancel()
+        await settle()
+        queued_after_cancel = scheduler.queued
+
+        blocker.set()
+        await asyncio.gather(holder, b, c)
+        return order, positions, queued_after_cancel, scheduler
+
+    order, positions, queued_after_cancel, scheduler = asyncio.run(scenario())
+    assert queued_after_cancel == 2
+    assert order == ["blocker", "b", "c"]
+    # كل منتظر يتقدم مكاناً عند إلغاء من أمامه
+    assert positions["b"][:2] == [2, 1]
+    assert positions["c"][:2] == [3, 2]
+    assert scheduler.active == 0 and scheduler.queued == 0
+
+
+def test_cancel_while_running_releases_slot():
+    async def scenario():
+        scheduler = FairScheduler(max_concurrent=1, max_per_user=1)
+        order, never = [], asyncio.Event()
+        running = asyncio.create_task(request(scheduler, "a", 1, order, hold=never))
+        await settle()
+        waiting = asyncio.create_task(request(scheduler, "b", 2, order))
+        await settle()
+        assert scheduler.active == 1 and scheduler.queued == 1
+
+        running.cancel()
+        await asyncio.gather(running, waiting, return_exceptions=True)
+        return order, scheduler
+
+    order, scheduler = asyncio.run(scenario())
+    assert order == ["a", "b"]
+    assert scheduler.active == 0 and scheduler.queued == 0
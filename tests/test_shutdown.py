@@ -0,0 +1,79 @@
+"""
+اختبار إيقاف البوت أثناء تحميل (main.begin_shutdown): الطلب يُقطع قبل أن ينتظره PTB
+ويبقى غير مكتمل في السجل ليُستأنف
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import main
+from database import db
+from downloader import dl_manager
+from fake_mongo import FakeCollection
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+class FakeMessage:
+    def __init__(self):
+        self.texts = []
+
+    async def reply_text(self, text, **kwargs):
+        self.texts.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.texts.append(text)
+
+
+@pytest.fixture(autouse=True)
+def fake_backend(monkeypatch):
+    monkeypatch.setattr(db, "journal", FakeCollection())
+    monkeypatch.setattr(db, "file_cache", FakeCollection())
+    monkeypatch.setattr(main, "JOB_QUEUE_MODE", False)
+    monkeypatch.setattr(dl_manager, "stopping", False)
+
+    async def is_admin(user_id):
+        return False
+
+    async def extract_info(url):
+        return {"id": "dQw4w9WgXcQ", "title": "Title", "duration": 60}
+
+    monkeypatch.setattr(db, "is_admin", is_admin)
+    monkeypatch.setattr(dl_manager, "cached_result", lambda *args: None)
+    monkeypatch.setattr(dl_manager, "extract_info", extract_info)
+
+
+def test_stop_signal_interrupts_running_download(monkeypatch):
+    started = asyncio.Event()
+    seen = {}
+
+    async def download(*args, **kwargs):
+        started.set()
+        try:
+            await asyncio.Event().wait()
+        finally:
+            seen["stopping"] = dl_manager.stopping
+
+    monkeypatch.setattr(dl_manager, "download", download)
+    stopped = []
+    app = SimpleNamespace(bot_data={}, stop_running=lambda: stopped.append(True))
+
+    async def scenario():
+        journal_id = await db.journal_create(main.NODE_NAME, 1, 1, URL, "video", "best")
+        request = asyncio.create_task(main.process_url(
+            FakeMessage(), app.bot_data, URL, 1, "video", "best", journal_id
+        ))
+        await started.wait()
+        main.begin_shutdown(app)
+        await asyncio.gather(request, return_exceptions=True)
+        return request, await db.journal_unfinished(main.NODE_NAME)
+
+    request, unfinished = asyncio.run(scenario())
+    assert request.cancelled()
+    # الإيقاف معلن قبل قطع التحميل فتبقى ملفاته الجزئية
+    assert seen["stopping"] is True
+    assert stopped == [True]
+    assert app.bot_data["requests"] == set()
+    assert [entry["state"] for entry in unfinished] == ["extracting"]
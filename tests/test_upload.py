@@ -0,0 +1,73 @@
+"""
+اختبارات الرفع (utils.open_upload) مقابل خادم Bot API البديل (fake_botapi.py)
+"""
+import asyncio
+
+import pytest
+from telegram import Bot, InputMediaVideo
+
+import utils
+from fake_botapi import start_fake_botapi
+from utils import open_upload
+
+TOKEN = "123456:test"
+
+
+async def send(tmp_path, local_mode: bool, group: bool = False):
+    api, runner = await start_fake_botapi("127.0.0.1", 0)
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}"
+    paths = []
+    for i in range(2 if group else 1):
+        path = tmp_path / f"video{i}.mp4"
+        path.write_bytes(b"v" * (1000 + i))
+        paths.append(path)
+    try:
+        # نفس إعداد main.py مع BOT_API_URL
+        async with Bot(TOKEN, base_url=f"{url}/bot", base_file_url=f"{url}/file/bot",
+                       local_mode=local_mode) as bot:
+            if group:
+                with open_upload(str(paths[0]), attach=True) as first, \
+                        open_upload(str(paths[1]), attach=True) as second:
+                    await bot.send_media_group(1, [InputMediaVideo(first), InputMediaVideo(second)])
+            else:
+                with open_upload(str(paths[0])) as upload:
+                    sent = await bot.send_video(1, upload)
+                assert sent.video.file_size == 1000
+    finally:
+        await runner.cleanup()
+    return api.uploads
+
+
+@pytest.fixture
+def local_mode(monkeypatch):
+    monkeypatch.setattr(utils, "BOT_API_LOCAL_MODE", True)
+
+
+def test_local_mode_uploads_by_path(tmp_path, local_mode):
+    uploads = asyncio.run(send(tmp_path, local_mode=True))
+
+    assert [(u["method"], u["source"], u["filename"], u["size"]) for u in uploads] == [
+        ("sendVideo", "path", "video0.mp4", 1000)
+    ]
+
+
+def test_local_mode_media_group_uses_paths(tmp_path, local_mode):
+    uploads = asyncio.run(send(tmp_path, local_mode=True, group=True))
+
+    assert [(u["source"], u["size"]) for u in uploads] == [("path", 1000), ("path", 1001)]
+
+
+def test_open_upload_yields_path_in_local_mode(tmp_path, local_mode):
+    path = tmp_path / "audio.m4a"
+    path.write_bytes(b"a")
+    with open_upload(str(path)) as upload:
+        assert upload == path
+
+
+def test_default_mode_streams_multipart(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "BOT_API_LOCAL_MODE", False)
+    uploads = asyncio.run(send(tmp_path, local_mode=False))
+
+    assert [(u["source"], u["filename"], u["size"]) for u in uploads] == [
+        ("multipart", "video0.mp4", 1000)
+    ]
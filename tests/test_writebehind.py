@@ -0,0 +1,149 @@
+"""
+اختبارات الكتابة المؤجلة (writebehind.py) مقابل بديل Mongo في الذاكرة
+"""
+import asyncio
+
+from bson import json_util
+
+from fake_mongo import FakeCollection, FakeDatabase
+from writebehind import WriteBehind
+
+
+def make_writer(tmp_path, max_items=100, interval=60):
+    database = FakeDatabase()
+    downloads, users = FakeCollection(database), FakeCollection(database)
+    writer = WriteBehind(downloads, users, max_items, interval, tmp_path / "spool.jsonl")
+    return writer, downloads, users
+
+
+def user_fields(users) -> dict:
+    return {doc["user_id"]: {k: v for k, v in doc.items() if k not in ("_id", "user_id")}
+            for doc in users.docs.values()}
+
+
+def test_inserts_are_batched_and_user_updates_merged(tmp_path):
+    writer, downloads, users = make_writer(tmp_path)
+
+    async def scenario():
+        writer.insert({"n": 1})
+        writer.insert({"n": 2})
+        writer.upsert_user(1, {"username": "a", "last_visit": 1})
+        writer.upsert_user(1, {"last_visit": 2})
+        assert writer.pending == 3
+        await writer.flush()
+
+    asyncio.run(scenario())
+    assert sorted(doc["n"] for doc in downloads.docs.values()) == [1, 2]
+    assert user_fields(users) == {1: {"username": "a", "last_visit": 2}}
+    assert writer.pending == 0
+
+
+def test_full_buffer_wakes_the_loop(tmp_path):
+    writer, downloads, _ = make_writer(tmp_path, max_items=2)
+
+    async def scenario():
+        writer.start()
+        writer.insert({"n": 1})
+        writer.insert({"n": 2})
+        await asyncio.sleep(0.05)
+        flushed = len(downloads.docs)
+        await writer.close()
+        return flushed
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_spool_while_down_and_replay_without_duplicates(tmp_path):
+    writer, downloads, users = make_writer(tmp_path)
+    database = downloads.database
+
+    async def scenario():
+        database.available = False
+        writer.insert({"n": 1})
+        writer.upsert_user(1, {"a": 1, "b": 1})
+        await writer.flush()
+        assert writer.spool_path.exists() and not downloads.docs
+        # الإرسال الأول وصل فعلاً قبل انقطاع الاتصال: إعادته لا تكرره
+        database.available = True
+        spooled = writer.spool_path.read_text().splitlines()[0]
+        await downloads.insert_one(json_util.loads(spooled)["insert"])
+        database.available = False
+
+        # ما زال غير متاح: الجديد يُلحق بالملف
+        writer.insert({"n": 2})
+        writer.upsert_user(1, {"b": 2})
+        await writer.flush()
+        database.available = True
+        await writer.flush()
+        await writer.flush()
+
+    asyncio.run(scenario())
+    assert sorted(doc["n"] for doc in downloads.docs.values()) == [1, 2]
+    assert user_fields(users) == {1: {"a": 1, "b": 2}}
+    assert not writer.spool_path.exists()
+    assert not writer.spool_path.with_suffix(".replay").exists()
+
+
+def test_close_writes_what_is_left(tmp_path):
+    writer, downloads, _ = make_writer(tmp_path)
+
+    async def scenario():
+        writer.start()
+        writer.insert({"n": 1})
+        await writer.close()
+
+    asyncio.run(scenario())
+    assert len(downloads.docs) == 1
+
+
+def test_loop_survives_unexpected_flush_errors(tmp_path):
+    writer, downloads, _ = make_writer(tmp_path, interval=0.01)
+    insert_many = downloads.insert_many
+    calls = []
+
+    async def flaky(docs, ordered=True):
+        calls.append(len(docs))
+        if len(calls) == 1:
+            raise ValueError("not a Mongo error")
+        await insert_many(docs, ordered=ordered)
+
+    downloads.insert_many = flaky
+
+    async def scenario():
+        writer.start()
+        writer.insert({"n": 1})
+        await asyncio.sleep(0.05)
+        writer.insert({"n": 2})
+        await asyncio.sleep(0.05)
+        alive = not writer._task.done()
+        await writer.close()
+        return alive
+
+    assert asyncio.run(scenario())
+    assert [doc["n"] for doc in downloads.docs.values()] == [2]
+
+
+def test_unexpected_loop_exit_restarts_it(tmp_path):
+    writer, downloads, _ = make_writer(tmp_path, interval=0.01)
+    run = writer._run
+    runs = []
+
+    async def crashing():
+        runs.append(1)
+        if len(runs) == 1:
+            raise RuntimeError("loop crashed")
+        await run()
+
+    writer._run = crashing
+
+    async def scenario():
+        writer.start()
+        await asyncio.sleep(0.01)
+        writer.insert({"n": 1})
+        await asyncio.sleep(0.05)
+        flushed = len(downloads.docs)
+        await writer.close()
+        return flushed
+
+    assert asyncio.run(scenario()) == 1
+    assert len(runs) == 2
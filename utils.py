@@ -1,8 +1,14 @@
 """
 أدوات مساعدة - بدون أي إشارة لـ aria2
 """
+import os
+from contextlib import contextmanager
 from pathlib import Path
 
+from telegram import InputFile
+
+from config import BOT_API_LOCAL_MODE
+
 
 async def cleanup_file(file_path: str):
     try:
@@ -17,6 +23,21 @@ async def cleanup_file(file_path: str):
         print(f"Cleanup error: {e}")
 
 
+@contextmanager
+def open_upload(file_path: str, attach: bool = False):
+    """
+    فتح الملف للرفع بالتدفق من القرص بدلاً من قراءته كاملاً في الذاكرة
+    (attach=True لعناصر مجموعات الوسائط)
+    """
+    if BOT_API_LOCAL_MODE:
+        # الخادم المحلي يقرأ الملف بنفسه عبر file:// بدون أي رفع من البوت
+        yield Path(file_path)
+        return
+    with open(file_path, 'rb') as f:
+        yield InputFile(f, filename=os.path.basename(file_path), attach=attach,
+                        read_file_handle=False)
+
+
 async def safe_edit_message(query, text: str, reply_markup=None, parse_mode="Markdown"):
     try:
         from telegram.error import BadRequest
@@ -34,3 +55,13 @@ def format_duration(seconds: int) -> str:
     minutes = seconds // 60
     secs = seconds % 60
     return f"{minutes}:{secs:02d}"
+
+
+def format_size(num_bytes) -> str:
+    if not num_bytes:
+        return "N/A"
+    for unit in ("B", "KB", "MB", "GB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}TB"
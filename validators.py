@@ -29,3 +29,14 @@ def sanitize_filename(filename: str) -> str:
     filename = re.sub(r'[<>:"/\\|?*]', '', filename)
     filename = re.sub(r'\s+', ' ', filename).strip()
     return filename[:100]
+
+VIDEO_ID_PATTERN = re.compile(
+    r'(?:youtube\.com/(?:watch\?(?:.*&)?v=|shorts/)|youtu\.be/)([\w-]{11})'
+)
+
+def extract_video_id(url: str):
+    """استخراج معرف الفيديو من الرابط (None لقوائم التشغيل)"""
+    if not url or 'list=' in url:
+        return None
+    match = VIDEO_ID_PATTERN.search(url)
+    return match.group(1) if match else None
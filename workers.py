@@ -0,0 +1,371 @@
+"""
+عمليات yt-dlp الدافئة - الاستخراج والتحميل في عمليات منفصلة بدلاً من خيوط حلقة البوت
+"""
+import os
+import signal
+import asyncio
+import logging
+import threading
+import multiprocessing
+from typing import Optional, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerCancelled(Exception):
+    pass
+
+
+class WorkerFailed(Exception):
+    def __init__(self, error_class: str, message: str):
+        self.error_class = error_class
+        self.message = message
+        super().__init__(message)
+
+
+# ============ داخل عملية العامل ============
+
+def _cpu_seconds() -> float:
+    """وقت المعالج لهذه العملية وعملياتها الفرعية المنتهية (ffmpeg)"""
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+def _task_extract(ydl_class, url: str, opts: dict, *, progress_hook: Callable) -> dict:
+    with ydl_class(opts) as ydl:
+        info = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(info) if info else None
+
+
+def _task_download(ydl_class, url: str, opts: dict, info: Optional[dict] = None, *,
+                   progress_hook: Callable) -> dict:
+    def postprocessor_hook(d):
+        if d.get('status') == 'started':
+            progress_hook({'status': 'processing', 'postprocessor': d.get('postprocessor')})
+
+    opts = {**opts, 'progress_hooks': [progress_hook], 'postprocessor_hooks': [postprocessor_hook]}
+    cpu_start = _cpu_seconds()
+    with ydl_class(opts) as ydl:
+        if info:
+            info = ydl.process_ie_result(info, download=True)
+        else:
+            info = ydl.extract_info(url, download=True)
+        if not info:
+            return None
+        info = ydl.sanitize_info(info)
+    info['cpu_time'] = round(_cpu_seconds() - cpu_start, 3)
+    return info
+
+
+def _task_ranged(ydl_class, parts: list, options: dict, thumbnail: Optional[dict] = None, *,
+                 progress_hook: Callable) -> dict:
+    """تحميل الصيغ التقدمية مباشرة بعدة اتصالات متوازية (لمرحلة المعالجة المنفصلة)"""
+    from ranged import download_parts, download_single
+
+    cpu_start = _cpu_seconds()
+    result = {'requested_downloads': download_parts(parts, progress_hook, **options)}
+    if thumbnail:
+        try:
+            download_single(thumbnail['url'], {}, thumbnail['filepath'])
+            result['thumbnails'] = [thumbnail]
+        except OSError:
+            pass
+    result['cpu_time'] = round(_cpu_seconds() - cpu_start, 3)
+    return result
+
+
+TASKS = {
+    "extract": _task_extract,
+    "download": _task_download,
+    "ranged": _task_ranged,
+}
+
+
+def _worker_main(conn):
+    """حلقة العامل: تحميل yt-dlp والمستخرجات مرة واحدة ثم تنفيذ المهام"""
+    import queue
+    import yt_dlp
+
+    # مجموعة عمليات خاصة حتى يشمل الإنهاء القسري عمليات ffmpeg الفرعية
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    from yt_dlp.extractor import gen_extractor_classes
+
+    # تسخين: استيراد كل المستخرجات وتهيئة مستخرج يوتيوب مسبقاً
+    list(gen_extractor_classes())
+    with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        ydl.get_info_extractor('Youtube')
+
+    send_lock = threading.Lock()
+    state_lock = threading.Lock()
+    jobs = queue.Queue()
+    cancelled = set()
+    # المهمة المسندة لهذا العامل الآن (المجموعة لا ترسل مهمة جديدة قبل انتهاء السابقة)
+    current = {"job_id": None}
+
+    def send(message):
+        with send_lock:
+            conn.send(message)
+
+    def listen():
+        """استقبال المهام وطلبات الإلغاء أثناء انشغال الخيط الرئيسي"""
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = ("stop",)
+            if message[0] == "cancel":
+                with state_lock:
+                    # إلغاء وصل بعد انتهاء المهمة يُتجاهل حتى لا يصيب مهمة لاحقة
+                    if message[1] == current["job_id"]:
+                        cancelled.add(message[1])
+                continue
+            if message[0] == "run":
+                with state_lock:
+                    current["job_id"] = message[1]
+            jobs.put(message)
+            if message[0] == "stop":
+                return
+
+    threading.Thread(target=listen, daemon=True).start()
+    send(("ready", os.getpid()))
+
+    while True:
+        message = jobs.get()
+        if message[0] == "stop":
+            return
+
+        _, job_id, task_name, args = message
+
+        def progress_hook(d, job_id=job_id):
+            if job_id in cancelled:
+                raise WorkerCancelled()
+            send(("progress", job_id, {
+                key: d.get(key) for key in (
+                    'status', 'downloaded_bytes', 'total_bytes', 'total_bytes_estimate',
+                    'speed', 'eta', 'filename', 'postprocessor'
+                )
+            }))
+
+        try:
+            result = TASKS[task_name](yt_dlp.YoutubeDL, *args, progress_hook=progress_hook)
+            send(("done", job_id, result))
+        except BaseException as e:
+            error_class = "WorkerCancelled" if job_id in cancelled else type(e).__name__
+            send(("error", job_id, error_class, str(e)))
+        finally:
+            with state_lock:
+                cancelled.discard(job_id)
+                if current["job_id"] == job_id:
+                    current["job_id"] = None
+
+
+# ============ داخل عملية البوت ============
+
+class _Worker:
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.pid: Optional[int] = None
+        self.jobs_done = 0
+        self.job_id: Optional[str] = None
+
+
+class WorkerPool:
+    """
+    مجموعة عمليات ثابتة الحجم مع إعادة تدوير كل عامل بعد عدد من المهام.
+    التحميل يشغل عاملاً طوال النقل، فلا يأخذ التحميل أكثر من size - extract_reserve عامل
+    ويبقى الباقي للاستخراج حتى تحت الحمل الكامل.
+    """
+
+    def __init__(self, size: int, max_jobs_per_worker: int = 50, extract_reserve: int = 0):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.transfer_limit = max(1, size - extract_reserve)
+        self._transfers = asyncio.Semaphore(self.transfer_limit)
+        self._ctx = multiprocessing.get_context("spawn")
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._idle: Optional[asyncio.Queue] = None
+        self._workers: Dict[int, _Worker] = {}
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._progress: Dict[str, Callable] = {}
+        self._job_counter = 0
+        self._closed = False
+
+    @property
+    def started(self) -> bool:
+        return self._idle is not None
+
+    async def start(self):
+        if self.started:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._idle = asyncio.Queue()
+        for _ in range(self.size):
+            self._spawn()
+        logger.info(f"yt-dlp worker pool started ({self.size} processes)")
+
+    def _spawn(self):
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+
+        worker = _Worker(process, parent_conn)
+        self._workers[id(worker)] = worker
+        threading.Thread(target=self._reader, args=(worker,), daemon=True).start()
+
+    def _reader(self, worker: _Worker):
+        """قراءة رسائل العامل في خيط ونقلها لحلقة الأحداث"""
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                message = None
+            try:
+                if message is None:
+                    self._loop.call_soon_threadsafe(self._on_exit, worker)
+                    return
+                self._loop.call_soon_threadsafe(self._on_message, worker, message)
+            except RuntimeError:
+                # حلقة الأحداث أُغلقت
+                return
+
+    def _on_message(self, worker: _Worker, message: tuple):
+        kind = message[0]
+        if kind == "ready":
+            worker.pid = message[1]
+            self._idle.put_nowait(worker)
+        elif kind == "progress":
+            callback = self._progress.get(message[1])
+            if callback:
+                try:
+                    callback(message[2])
+                except Exception as e:
+                    logger.error(f"Progress callback error: {e}")
+        elif kind in ("done", "error"):
+            job_id = message[1]
+            future = self._futures.pop(job_id, None)
+            self._progress.pop(job_id, None)
+            if future and not future.done():
+                if kind == "done":
+                    future.set_result(message[2])
+                elif message[2] == "WorkerCancelled":
+                    future.set_exception(WorkerCancelled())
+                else:
+                    future.set_exception(WorkerFailed(message[2], message[3]))
+            self._release(worker)
+
+    def _release(self, worker: _Worker):
+        worker.job_id = None
+        worker.jobs_done += 1
+        if worker.jobs_done >= self.max_jobs_per_worker and not self._closed:
+            # إعادة تدوير العامل لتفادي تراكم الذاكرة
+            self._retire(worker)
+            self._spawn()
+        else:
+            self._idle.put_nowait(worker)
+
+    def _retire(self, worker: _Worker):
+        self._workers.pop(id(worker), None)
+        try:
+            worker.conn.send(("stop",))
+        except OSError:
+            pass
+        self._loop.run_in_executor(None, worker.process.join, 10)
+
+    def _on_exit(self, worker: _Worker):
+        """خروج العامل (إعادة تدوير أو انهيار)"""
+        if self._workers.pop(id(worker), None) is None:
+            return
+        if worker.job_id:
+            future = self._futures.pop(worker.job_id, None)
+            self._progress.pop(worker.job_id, None)
+            if future and not future.done():
+                future.set_exception(WorkerFailed("WorkerCrashed", "yt-dlp worker exited unexpectedly"))
+        if self._closed:
+            return
+        if worker.pid is None:
+            # فشل قبل الجاهزية (مثلاً خطأ استيراد) - انتظار قبل المحاولة مجدداً
+            logger.error("yt-dlp worker failed to start, retrying in 5s")
+            self._loop.call_later(5, self._spawn)
+        else:
+            logger.warning(f"yt-dlp worker {worker.pid} exited, respawning")
+            self._spawn()
+
+    async def submit(self, task_name: str, *args, job_id: str = None,
+                     progress_callback: Callable = None) -> Any:
+        """تنفيذ مهمة على أول عامل متاح وانتظار نتيجتها"""
+        await self.start()
+        if task_name == "extract":
+            return await self._run(task_name, args, job_id, progress_callback)
+        async with self._transfers:
+            return await self._run(task_name, args, job_id, progress_callback)
+
+    async def _run(self, task_name: str, args: tuple, job_id: Optional[str],
+                   progress_callback: Optional[Callable]) -> Any:
+        if job_id is None:
+            self._job_counter += 1
+            job_id = f"job-{self._job_counter}"
+
+        worker = await self._idle.get()
+        while id(worker) not in self._workers:
+            worker = await self._idle.get()
+
+        future = self._loop.create_future()
+        self._futures[job_id] = future
+        if progress_callback:
+            self._progress[job_id] = progress_callback
+        worker.job_id = job_id
+        worker.conn.send(("run", job_id, task_name, args))
+        return await future
+
+    def _worker_for(self, job_id: str) -> Optional[_Worker]:
+        for worker in self._workers.values():
+            if worker.job_id == job_id:
+                return worker
+        return None
+
+    def cancel(self, job_id: str) -> bool:
+        """طلب إلغاء مهمة جارية (يتحقق منه العامل عند التقدم التالي)؛ False إن لم تبدأ"""
+        worker = self._worker_for(job_id)
+        if worker is None:
+            return False
+        try:
+            worker.conn.send(("cancel", job_id))
+        except OSError:
+            pass
+        return True
+
+    def kill(self, job_id: str) -> bool:
+        """إنهاء العامل المنفذ للمهمة فوراً مع عملياته الفرعية ثم استبداله"""
+        worker = self._worker_for(job_id)
+        if worker is None:
+            return False
+
+        self._workers.pop(id(worker), None)
+        future = self._futures.pop(job_id, None)
+        self._progress.pop(job_id, None)
+        if future and not future.done():
+            future.set_exception(WorkerCancelled())
+
+        try:
+            os.killpg(worker.pid, signal.SIGKILL)
+        except (OSError, AttributeError):
+            worker.process.kill()
+        self._loop.run_in_executor(None, worker.process.join, 5)
+        logger.info(f"yt-dlp worker {worker.pid} killed to cancel {job_id}")
+        if not self._closed:
+            self._spawn()
+        return True
+
+    async def shutdown(self):
+        self._closed = True
+        workers = list(self._workers.values())
+        for worker in workers:
+            self._retire(worker)
+        loop = asyncio.get_running_loop()
+        for worker in workers:
+            await loop.run_in_executor(None, worker.process.join, 5)
+            if worker.process.is_alive():
+                worker.process.kill()
@@ -0,0 +1,177 @@
+"""
+الكتابة المؤجلة - تجميع سجلات التحميل وتحديثات المستخدمين وكتابتها دفعة واحدة،
+مع حفظها في ملف محلي إن تعذر الوصول لـ Mongo وإعادة إرسالها لاحقاً
+"""
+import os
+import asyncio
+import logging
+from pathlib import Path
+from typing import Dict, List, Any
+
+from bson import ObjectId, json_util
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+
+
+class WriteBehind:
+    """
+    insert تضيف مستنداً لـ insert_many(ordered=False)، و upsert_user تدمج حقول
+    المستخدم نفسه في تحديث واحد لـ bulk_write. الكتابة عند بلوغ max_items أو كل interval ثانية.
+    لكل مستند _id مسبق حتى تكون إعادة الإرسال من الملف بدون تكرار.
+    """
+
+    def __init__(self, inserts_collection, users_collection, max_items: int,
+                 interval: float, spool_path: Path):
+        self.inserts_collection = inserts_collection
+        self.users_collection = users_collection
+        self.max_items = max_items
+        self.interval = interval
+        self.spool_path = Path(spool_path)
+        self._inserts: List[dict] = []
+        self._users: Dict[int, Dict[str, Any]] = {}
+        self._wakeup = asyncio.Event()
+        self._task: asyncio.Task = None
+        self._closing = False
+
+    @property
+    def pending(self) -> int:
+        return len(self._inserts) + len(self._users)
+
+    def insert(self, doc: dict):
+        self._inserts.append({"_id": ObjectId(), **doc})
+        if self.pending >= self.max_items:
+            self._wakeup.set()
+
+    def upsert_user(self, user_id: int, fields: Dict[str, Any]):
+        # استدعاءات متكررة لنفس المستخدم = تحديث واحد بآخر القيم
+        self._users.setdefault(user_id, {}).update(fields)
+        if self.pending >= self.max_items:
+            self._wakeup.set()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            self._task.add_done_callback(self._on_exit)
+
+    def _on_exit(self, task: asyncio.Task):
+        """الدورة لا تنتهي إلا بـ close: خروج غير متوقع يُسجل وتبدأ دورة جديدة"""
+        if self._closing or task.cancelled():
+            return
+        logger.error("Write-behind loop exited unexpectedly, restarting", exc_info=task.exception())
+        self._task = None
+        self.start()
+
+    async def close(self):
+        """إيقاف الدورة وكتابة ما تبقى (أو حفظه في الملف)"""
+        # بدون إلغاء حتى لا تضيع دفعة أثناء كتابتها
+        self._closing = True
+        self._wakeup.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # خطأ غير متوقع (ليس من Mongo): تضيع الدفعة الحالية فقط وتستمر الدورة
+                logger.error(f"Write-behind flush error: {e}", exc_info=True)
+
+    async def _reachable(self) -> bool:
+        try:
+            await self.inserts_collection.database.command("ping")
+            return True
+        except PyMongoError:
+            return False
+
+    async def flush(self):
+        if self.spool_path.exists():
+            if not await self._reachable():
+                # ما زال Mongo غير متاح: الجديد يُلحق بالملف بالترتيب (بدون إعادة كتابته)
+                inserts, self._inserts = self._inserts, []
+                users, self._users = self._users, {}
+                if inserts or users:
+                    self._spool(inserts, users)
+                return
+            # المحفوظ يُرسل أولاً مع الجديد حتى لا تسبق القيم القديمة الأحدث منها
+            self._load_spool()
+
+        inserts, self._inserts = self._inserts, []
+        users, self._users = self._users, {}
+        if not inserts and not users:
+            return
+
+        failed_inserts, failed_users = [], {}
+        if inserts:
+            try:
+                await self.inserts_collection.insert_many(inserts, ordered=False)
+            except BulkWriteError as e:
+                # المكرر سبق إرساله (إعادة من الملف) - يُعاد فقط ما فشل لسبب آخر
+                failed = {err["index"] for err in e.details.get("writeErrors", [])
+                          if err.get("code") != DUPLICATE_KEY}
+                failed_inserts = [doc for i, doc in enumerate(inserts) if i in failed]
+            except PyMongoError as e:
+                logger.warning(f"Write-behind insert failed: {e}")
+                failed_inserts = inserts
+
+        if users:
+            try:
+                await self.users_collection.bulk_write([
+                    UpdateOne({"user_id": user_id}, {"$set": fields}, upsert=True)
+                    for user_id, fields in users.items()
+                ], ordered=False)
+            except PyMongoError as e:
+                logger.warning(f"Write-behind user update failed: {e}")
+                failed_users = users
+
+        if failed_inserts or failed_users:
+            self._spool(failed_inserts, failed_users)
+
+    def _spool(self, inserts: List[dict], users: Dict[int, Dict[str, Any]]):
+        lines = [json_util.dumps({"insert": doc}) for doc in inserts]
+        lines += [json_util.dumps({"user_id": user_id, "fields": fields})
+                  for user_id, fields in users.items()]
+        try:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            logger.warning(f"Write-behind spooled {len(lines)} writes to {self.spool_path}")
+        except OSError as e:
+            logger.error(f"Write-behind spool error, {len(lines)} writes lost: {e}")
+
+    def _load_spool(self):
+        """نقل محتوى الملف إلى الذاكرة (القيم الأحدث في الذاكرة تتقدم على المحفوظة)"""
+        replay_path = self.spool_path.with_suffix(".replay")
+        try:
+            os.replace(self.spool_path, replay_path)
+        except FileNotFoundError:
+            return
+        count = 0
+        spooled_users: Dict[int, Dict[str, Any]] = {}
+        with open(replay_path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    item = json_util.loads(line)
+                except ValueError:
+                    continue
+                if "insert" in item:
+                    self._inserts.append(item["insert"])
+                else:
+                    spooled_users.setdefault(item["user_id"], {}).update(item["fields"])
+                count += 1
+        for user_id, fields in spooled_users.items():
+            self._users[user_id] = {**fields, **self._users.get(user_id, {})}
+        replay_path.unlink()
+        logger.info(f"Write-behind replaying {count} spooled writes")